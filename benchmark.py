@@ -0,0 +1,276 @@
+"""
+Benchmark suite for the dataset build pipeline and loaders.
+
+Each run generates a synthetic image dataset offline and times every pipeline stage on it:
+
+    export       - save_images: encode the arrays to `<raw>/<label>/<idx>.jpg`
+    split        - grouped_stratified_split + write_split_csv over the exported files
+    materialize  - Materializer: place the files into `<processed>/<split>/<label>/`
+    test_keys    - create_dataset_test_keys on the processed dataset
+    epoch_read   - one full epoch of the training split through data_loader.load_dataset
+
+For every stage the wall time, throughput, peak RSS while the stage ran, the growth of
+the lifetime peak RSS of this process and of its worker processes, and the number of
+files in the stage's output are reported. Results are saved as JSON; pass a previous
+result file with `--compare` to print the speed-up per stage.
+
+    python benchmark.py --num-images 10000 100000 --num-labels 10 100
+    python benchmark.py --num-images 10000 --compare benchmark_results.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+
+import numpy as np
+
+from create_test_key import create_dataset_test_keys
+from data_loader import load_dataset
+from dataset_files import list_split_files
+from image_export import save_images
+from instrumentation import RSSSampler
+from materialize import Materializer
+from splitter import grouped_stratified_split, write_split_csv
+
+DEFAULT_RESULTS_FILE = "benchmark_results.json"
+
+# bytes of float32 pixels generated per chunk, bounding the memory of the generator
+GENERATE_CHUNK_BYTES = 64 * 1024 * 1024
+
+MIB = 1024 * 1024
+
+SPLIT_NAMES = ["training", "testing"]
+
+SPLIT_RATIOS = (0.8, 0.2)
+
+
+def count_files(dir_path: str) -> int:
+    """Counts the files below a directory."""
+    return sum(len(files) for _, _, files in os.walk(dir_path))
+
+
+def dir_size(dir_path: str) -> int:
+    """Total size in bytes of the files below a directory."""
+    total = 0
+    for root, _, files in os.walk(dir_path):
+        for file_name in files:
+            total += os.lstat(os.path.join(root, file_name)).st_size
+    return total
+
+
+class StageTimer:
+    """Times one stage and records its throughput, peak RSS and output file count."""
+
+    def __init__(self, results: dict, name: str, items: int, output_dir=None):
+        self.results = results
+        self.name = name
+        self.items = items
+        self.output_dir = output_dir
+
+    def __enter__(self):
+        print(f"[{self.name}] running...")
+        self.rss = RSSSampler()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        seconds = time.perf_counter() - self.start_time
+        self.rss.stop()
+        if exc_type is not None:
+            return
+        stage_peak = self.rss.stage_peak
+        result = {
+            "seconds": seconds,
+            "items": self.items,
+            "items_per_second": self.items / seconds if seconds > 0 else None,
+            "peak_rss_mb": stage_peak / MIB if stage_peak is not None else None,
+            "peak_rss_growth_mb": self.rss.peak_growth / MIB,
+            "peak_workers_rss_growth_mb": self.rss.workers_peak_growth / MIB,
+        }
+        if self.output_dir is not None:
+            result["files"] = count_files(self.output_dir)
+            result["bytes"] = dir_size(self.output_dir)
+        self.results[self.name] = result
+        print(
+            f"[{self.name}] {seconds:.2f}s, {result['items_per_second'] or 0:.0f} items/s, "
+            f"peak RSS {result['peak_rss_mb'] or 0:.0f} MiB "
+            f"(+{result['peak_rss_growth_mb']:.0f} MiB, "
+            f"workers +{result['peak_workers_rss_growth_mb']:.0f} MiB)"
+        )
+
+
+def generate_images(num_images: int, num_labels: int, image_size: int, seed: int = 42):
+    """
+    Yields (images, labels, indices) chunks of a synthetic dataset.
+
+    Images are smooth random gradients with noise, so they compress like small natural
+    images rather than like pure noise. Pixels are generated as uint8 and combined in
+    float32, in chunks of about `GENERATE_CHUNK_BYTES`.
+    """
+    rng = np.random.default_rng(seed)
+    ramp = np.linspace(0, 1, image_size, dtype=np.float32)
+    gradient = (60 * (ramp[:, None] + ramp[None, :]))[None, :, :, None]
+    chunk_size = max(1, GENERATE_CHUNK_BYTES // (image_size * image_size * 3 * 4))
+    for start in range(0, num_images, chunk_size):
+        count = min(chunk_size, num_images - start)
+        colors = rng.integers(0, 128, size=(count, 1, 1, 3), dtype=np.uint8)
+        noise = rng.integers(0, 32, size=(count, image_size, image_size, 3), dtype=np.uint8)
+        images = noise.astype(np.float32)
+        images += colors
+        images += gradient
+        np.clip(images, 0, 255, out=images)
+        labels = rng.integers(0, num_labels, size=count)
+        yield images.astype(np.uint8), labels, np.arange(start, start + count)
+
+
+def run_benchmark(
+    work_dir: str,
+    num_images: int,
+    num_labels: int,
+    image_size: int = 28,
+    materialize_mode: str = "hardlink",
+    workers=None,
+    batch_size: int = 256,
+) -> dict:
+    """
+    Runs every stage on one synthetic dataset.
+
+    Args:
+        work_dir (str): Scratch directory for the raw and processed trees.
+        num_images (int): Number of images to generate.
+        num_labels (int): Number of class labels.
+        image_size (int): Height and width of the images.
+        materialize_mode (str): Materialize mode (see materialize.py).
+        workers (Optional[int]): Worker processes/threads per stage. Defaults to the CPU
+                                 count.
+        batch_size (int): Batch size of the epoch read.
+
+    Returns:
+        dict: The configuration of the run and the results per stage.
+    """
+    dataset_name = f"synthetic_{num_images}_{num_labels}"
+    raw_dir = os.path.join(work_dir, "raw", dataset_name)
+    processed_dir = os.path.join(work_dir, "processed")
+    dataset_dir = os.path.join(processed_dir, dataset_name)
+    split_csv_file = os.path.join(raw_dir, "train_test_split.csv")
+    stages = {}
+
+    with StageTimer(stages, "export", num_images, raw_dir):
+        for images, labels, indices in generate_images(num_images, num_labels, image_size):
+            save_images(images, labels, raw_dir, "all", indices=indices, workers=workers)
+
+    with StageTimer(stages, "split", num_images):
+        X, y = list_split_files(raw_dir, "all")
+        split_idx = grouped_stratified_split(
+            y, ratios=SPLIT_RATIOS, ids=[os.path.basename(path) for path in X]
+        )
+        write_split_csv(split_csv_file, X, y, split_idx, SPLIT_NAMES)
+
+    with StageTimer(stages, "materialize", num_images, dataset_dir):
+        with Materializer(dataset_dir, mode=materialize_mode) as materializer:
+            for file_path, label, idx in zip(X, y, split_idx.tolist()):
+                materializer.add(file_path, SPLIT_NAMES[idx], label)
+
+    num_test = int(np.count_nonzero(split_idx == SPLIT_NAMES.index("testing")))
+    with StageTimer(stages, "test_keys", num_test):
+        create_dataset_test_keys(dataset_dir)
+
+    num_train = num_images - num_test
+    with StageTimer(stages, "epoch_read", num_train):
+        loader = load_dataset(
+            dataset_name,
+            "training",
+            processed_dir=processed_dir,
+            batch_size=batch_size,
+            shuffle=True,
+            num_workers=workers or os.cpu_count() or 1,
+        )
+        num_read = sum(len(labels) for _, labels in loader)
+        assert num_read == num_train, f"read {num_read} of {num_train} images"
+
+    return {
+        "num_images": num_images,
+        "num_labels": num_labels,
+        "image_size": image_size,
+        "materialize_mode": materialize_mode,
+        "stages": stages,
+    }
+
+
+def compare_results(results: dict, baseline: dict) -> None:
+    """Prints the speed-up of every stage against a baseline result file."""
+    baseline_runs = {
+        (run["num_images"], run["num_labels"], run["image_size"]): run
+        for run in baseline["runs"]
+    }
+    for run in results["runs"]:
+        key = (run["num_images"], run["num_labels"], run["image_size"])
+        if key not in baseline_runs:
+            continue
+        print(f"\n{run['num_images']} images, {run['num_labels']} labels vs baseline:")
+        for stage, result in run["stages"].items():
+            previous = baseline_runs[key]["stages"].get(stage)
+            if previous and result["seconds"] > 0:
+                speedup = previous["seconds"] / result["seconds"]
+                print(
+                    f"  {stage:<12} {previous['seconds']:8.2f}s -> {result['seconds']:8.2f}s "
+                    f"({speedup:.2f}x)"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the dataset build pipeline.")
+    parser.add_argument("--num-images", type=int, nargs="+", default=[10000])
+    parser.add_argument("--num-labels", type=int, nargs="+", default=[10])
+    parser.add_argument("--image-size", type=int, default=28)
+    parser.add_argument("--materialize-mode", default="hardlink")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--work-dir", default=None, help="Default: a temporary directory.")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated files.")
+    parser.add_argument("--output", default=DEFAULT_RESULTS_FILE)
+    parser.add_argument("--compare", default=None, help="Previous results JSON file.")
+    args = parser.parse_args()
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "runs": [],
+    }
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="rt_benchmark_")
+    try:
+        for num_images in args.num_images:
+            for num_labels in args.num_labels:
+                run_dir = os.path.join(work_dir, f"{num_images}_{num_labels}")
+                print(f"\nBenchmarking {num_images} images with {num_labels} labels...")
+                results["runs"].append(
+                    run_benchmark(
+                        run_dir,
+                        num_images,
+                        num_labels,
+                        image_size=args.image_size,
+                        materialize_mode=args.materialize_mode,
+                        workers=args.workers,
+                        batch_size=args.batch_size,
+                    )
+                )
+                if not args.keep:
+                    shutil.rmtree(run_dir)
+    finally:
+        if not args.keep and args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as file:
+            compare_results(results, json.load(file))
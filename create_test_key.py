@@ -1,56 +1,231 @@
 import os
-import pandas as pd
+import csv
+import sys
+import argparse
+import concurrent.futures
+
 import paths
-from pathlib import Path
+from dataset_files import (
+    IGNORED_NAMES,
+    is_image_file,
+    list_dataset_names,
+    list_split_files,
+)
+from instrumentation import track_stage
+from materialize import SPLIT_MANIFEST_FILE_NAME, read_split_manifest
+from split_table import SplitTable, get_split_table_dir, has_split_table
+
 
+class TestKeyCollisionError(ValueError):
+    """Raised when the same file name appears under more than one test label."""
 
-def list_paths(root_dir):
-    """lists all dirs/file paths in a given directory."""
-    paths = []
-    listdir = [i for i in os.listdir(root_dir) if i != ".DS_Store"]
-    for entry in listdir:
-        full_path = os.path.join(root_dir, entry)
-        paths.append(full_path)
 
-    return paths
+def iter_test_keys(dataset_path, use_cache=False):
+    """
+    Yields (id, target) for every file in the testing split of a dataset.
 
+    Label directories and file names are traversed in sorted order with os.scandir;
+    the file types come with the directory entries, so no per-file stat calls are
+    needed (except to follow symlinks). With `use_cache` the files are listed from the
+    shared file cache instead, which only re-lists directories that changed. Both list
+    the same files: regular files with an image extension (see
+    `dataset_files.is_image_file`).
+    """
+    if use_cache:
+        X, y = list_split_files(dataset_path, "testing", use_cache=True)
+        for file_path, label in zip(X, y):
+            yield os.path.basename(file_path), label
+        return
 
-def get_test_keys_for_dataset(dataset_path):
-    """Returns a dictionary of {id: target} for a given dataset by traversing all labels directories."""
-    final_test_keys = {}
     test_path = os.path.join(dataset_path, "testing")
-    test_labels_dirs = list_paths(test_path)
-    for path in test_labels_dirs:
-        label = Path(path).name
-        file_names = os.listdir(path)
-        test_keys = {k: label for k in file_names}
-        final_test_keys.update(test_keys)
+    with os.scandir(test_path) as entries:
+        label_entries = sorted(
+            (e for e in entries if e.is_dir() and e.name not in IGNORED_NAMES),
+            key=lambda e: e.name,
+        )
+    for label_entry in label_entries:
+        with os.scandir(label_entry.path) as entries:
+            file_names = sorted(e.name for e in entries if _is_image_entry(e))
+        for file_name in file_names:
+            yield file_name, label_entry.name
+
+
+def _is_image_entry(entry) -> bool:
+    return is_image_file(entry.name) and entry.is_file()
+
+
+def has_split_files(split_path):
+    """Check if a split directory exists and holds at least one labelled image file."""
+    if not os.path.isdir(split_path):
+        return False
+    with os.scandir(split_path) as label_entries:
+        for label_entry in label_entries:
+            if not label_entry.is_dir() or label_entry.name in IGNORED_NAMES:
+                continue
+            with os.scandir(label_entry.path) as entries:
+                if any(_is_image_entry(e) for e in entries):
+                    return True
+    return False
+
+
+def iter_test_keys_from_manifest(manifest_path):
+    """Yields (id, target) for the testing rows of a split manifest."""
+    for row in read_split_manifest(manifest_path, split_name="testing"):
+        yield row["id"], row["label"]
+
+
+def iter_test_keys_from_table(table_dir):
+    """
+    Yields (id, target) for the testing rows of a split table, in the same label and
+    file name order as the directory traversal. Only the testing rows are read.
+    """
+    table = SplitTable(table_dir)
+    yield from zip(table.ids(split="testing"), table.labels(split="testing"))
 
-    return final_test_keys
 
+def write_test_keys(test_keys, save_path):
+    """
+    Streams (id, target) rows to a test key CSV file.
 
-def create_datasets_test_keys(dataset_paths):
-    """Creates test_key.csv files for all datasets."""
-    for path in dataset_paths:
-        ids = []
-        labels = []
-        test_keys = get_test_keys_for_dataset(path)
+    The file is written to a temporary path and only moved into place once all rows
+    are written, so a collision never leaves a partial key behind. An id repeated with
+    the same target is written once.
 
-        for id, label in test_keys.items():
-            ids.append(id)
-            labels.append(label)
+    Returns:
+        int: The number of rows written.
 
-        test_keys_df = pd.DataFrame({"id": ids, "target": labels})
-        dataset_name = Path(path).name
-        file_name = f"{dataset_name}_test_key.csv"
-        save_path = os.path.join(path, file_name)
-        test_keys_df.to_csv(save_path, index=False)
-        print(f"Test keys created for dataset {dataset_name}")
+    Raises:
+        TestKeyCollisionError: If an id appears with more than one target.
+    """
+    seen = {}
+    collisions = []
+    tmp_path = f"{save_path}.tmp"
+    with open(tmp_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "target"])
+        for id, target in test_keys:
+            previous_target = seen.get(id)
+            if previous_target is None:
+                seen[id] = target
+                writer.writerow([id, target])
+            elif previous_target != target:
+                collisions.append((id, previous_target, target))
+    if collisions:
+        os.remove(tmp_path)
+        examples = "; ".join(f"{i} in {a} and {b}" for i, a, b in collisions[:5])
+        raise TestKeyCollisionError(
+            f"{len(collisions)} file names appear under more than one label: {examples}"
+        )
+    os.replace(tmp_path, save_path)
+    return len(seen)
+
+
+def create_dataset_test_keys(
+    dataset_path, from_manifest=False, use_cache=False, from_table=False
+):
+    """
+    Creates the test_key.csv file of one dataset.
+
+    Args:
+        dataset_path (str): Path to the processed dataset directory.
+        from_manifest (bool): Read the testing split from the dataset's split manifest
+                              instead of traversing the label directories. Datasets
+                              with a manifest but no files under their testing
+                              directory ("manifest" mode) always use the manifest.
+        use_cache (bool): List the testing files from the shared file cache.
+        from_table (bool): Read the testing split from the dataset's split table. The
+                           table is also preferred over the manifest CSV when the
+                           manifest is used.
+
+    Returns:
+        int: The number of test keys written.
+    """
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    manifest_path = os.path.join(dataset_path, SPLIT_MANIFEST_FILE_NAME)
+    test_path = os.path.join(dataset_path, "testing")
+    # the split may have been materialized in "manifest" mode: nothing to traverse
+    use_manifest = from_manifest or (
+        (has_split_table(dataset_path) or os.path.exists(manifest_path))
+        and not has_split_files(test_path)
+    )
+    if from_table or (use_manifest and has_split_table(dataset_path)):
+        test_keys = iter_test_keys_from_table(get_split_table_dir(dataset_path))
+    elif use_manifest:
+        test_keys = iter_test_keys_from_manifest(manifest_path)
+    else:
+        test_keys = iter_test_keys(dataset_path, use_cache=use_cache)
+
+    save_path = os.path.join(dataset_path, f"{dataset_name}_test_key.csv")
+    with track_stage(f"{dataset_name}.test_keys", quiet=True) as stage:
+        try:
+            num_keys = write_test_keys(test_keys, save_path)
+        except TestKeyCollisionError:
+            stage.error()
+            raise
+        stage.add(num_keys, bytes_written=os.path.getsize(save_path))
+    return num_keys
+
+
+def create_datasets_test_keys(
+    dataset_paths, from_manifest=False, use_cache=False, workers=None, from_table=False
+):
+    """
+    Creates test_key.csv files for all datasets, processing datasets concurrently.
+
+    Returns:
+        List[str]: The names of the datasets whose test keys could not be created.
+    """
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        future_to_path = {
+            executor.submit(
+                create_dataset_test_keys, path, from_manifest, use_cache, from_table
+            ): path
+            for path in dataset_paths
+        }
+        for future in concurrent.futures.as_completed(future_to_path):
+            dataset_name = os.path.basename(os.path.normpath(future_to_path[future]))
+            try:
+                num_keys = future.result()
+                print(f"Test keys created for dataset {dataset_name} ({num_keys} ids)")
+            except (OSError, TestKeyCollisionError) as e:
+                print(f"Could not create test keys for dataset {dataset_name}: {e}")
+                failed.append(dataset_name)
+    return sorted(failed)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the test key CSV files.")
+    parser.add_argument("datasets", nargs="*", help="Dataset names (default: all).")
+    parser.add_argument(
+        "--from-manifest",
+        action="store_true",
+        help="Read the testing split from split_manifest.csv instead of the directories.",
+    )
+    parser.add_argument(
+        "--from-table",
+        action="store_true",
+        help="Read the testing split from the split table (split_table.py).",
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        help="List the testing files from the shared file cache (file_cache.py).",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
     PROCESSED_DIR_PATH = paths.PROCESSED_DIR
-    dataset_names = [i for i in os.listdir(PROCESSED_DIR_PATH) if i != ".DS_Store"]
+    dataset_names = args.datasets or list_dataset_names(PROCESSED_DIR_PATH)
     dataset_paths = [os.path.join(PROCESSED_DIR_PATH, i) for i in dataset_names]
 
-    create_datasets_test_keys(dataset_paths)
+    failed = create_datasets_test_keys(
+        dataset_paths,
+        from_manifest=args.from_manifest,
+        use_cache=args.use_cache,
+        workers=args.workers,
+        from_table=args.from_table,
+    )
+    if failed:
+        print(f"Test keys failed for {len(failed)} datasets: {', '.join(failed)}")
+        sys.exit(1)
@@ -0,0 +1,348 @@
+"""
+Data-loading API over the processed datasets.
+
+    from data_loader import load_dataset
+
+    loader = load_dataset("cifar10", split="training", batch_size=256, shuffle=True)
+    for images, labels in loader:
+        ...
+
+Batches are decoded NumPy arrays (N, H, W, C) with integer labels; `loader.class_names`
+maps label indices back to label names. The class table is the same for every split and
+storage of a dataset (`dataset_files.list_class_names`), so a class keeps its index in a
+split that lacks other classes. The fastest available storage is used:
+
+    1. the memory-mapped tensor cache (tensor_cache.py): no decoding at all,
+    2. packed shards (shards.py): one positioned read per image,
+    3. the processed folder tree (or its resized derivatives): one file per image.
+
+A tensor cache or shards built before the split's files last changed are skipped (see
+`dataset_files.split_fingerprint`).
+
+With `server_url`, samples are fetched from a dataset server (dataset_server.py) in
+batched requests over keep-alive connections instead of being read from local disk.
+
+Images are read and decoded by a thread pool (PIL releases the GIL while decoding) and a
+background thread keeps up to `prefetch` batches ready. Shuffling permutes the whole
+sample order (the sources are ordered by label, so a bounded buffer alone would feed
+only a few classes at a time); `shuffle_buffer` trades some of that randomness for read
+locality. `num_shards`/`shard_index` give each of N processes a disjoint strided subset
+of the split (every N-th sample), so each process sees every class.
+"""
+
+import os
+import queue
+import itertools
+import threading
+import concurrent.futures
+
+import numpy as np
+
+import paths
+from dataset_files import get_dataset_path, list_class_names, list_split_files
+from dataset_server import DatasetClient
+from derivatives import get_resized_dir
+from image_formats import read_image
+from shards import get_shards_dir, is_shards_fresh, ShardReader
+from tensor_cache import has_tensor_cache, is_tensor_cache_fresh, load_tensor_cache
+
+# None: shuffle the whole epoch; a size keeps reads within blocks of that many samples
+DEFAULT_SHUFFLE_BUFFER = None
+
+
+def _stack(images):
+    """Stacks same-shaped images into one array; images of different sizes stay a list."""
+    if all(image.shape == images[0].shape for image in images):
+        return np.stack(images)
+    return images
+
+
+def _class_lookup(label_names, class_names) -> np.ndarray:
+    """Returns the index in `class_names` of each of `label_names`."""
+    class_to_idx = {name: idx for idx, name in enumerate(class_names)}
+    return np.array([class_to_idx[name] for name in label_names], dtype=np.int64)
+
+
+class TensorCacheSource:
+    """Samples served from the memory-mapped tensor cache."""
+
+    def __init__(self, dataset_path: str, split_name: str, class_names=None):
+        self.split = load_tensor_cache(dataset_path, split_name)
+        self.labels = np.asarray(self.split.labels, dtype=np.int64)
+        self.ids = self.split.ids
+        self.class_names = self.split.class_names
+        if class_names is not None and self.class_names is not None:
+            self.labels = _class_lookup(self.class_names, class_names)[self.labels]
+            self.class_names = list(class_names)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def read_batch(self, indices, executor):
+        # sorted reads walk the memory map sequentially; restore the requested order after
+        order = np.argsort(indices)
+        images = np.empty((len(indices),) + self.split.images.shape[1:], dtype=np.uint8)
+        images[order] = self.split.images[np.asarray(indices)[order]]
+        return images
+
+
+class ShardSource:
+    """Samples served from packed shards."""
+
+    def __init__(self, shards_dir: str, class_names=None):
+        self.reader = ShardReader(shards_dir)
+        # the label table of a shard lists the labels in the order they first appear
+        self.class_names = list(class_names or sorted(self.reader.labels))
+        lookup = _class_lookup(self.reader.labels, self.class_names)
+        self.labels = lookup[np.asarray(self.reader.label_idxs, dtype=np.int64)]
+        self.ids = self.reader.ids
+
+    def __len__(self):
+        return len(self.reader)
+
+    def _read(self, idx):
+        return read_image(self.reader.read(idx)[0])
+
+    def read_batch(self, indices, executor):
+        return _stack(list(executor.map(self._read, indices)))
+
+
+class FileSource:
+    """Samples served from a `<split>/<label>/<file>` folder tree."""
+
+    def __init__(self, dataset_path: str, split_name: str, class_names=None):
+        self.paths, label_names = list_split_files(dataset_path, split_name)
+        self.class_names = list(class_names or sorted(set(label_names)))
+        self.labels = _class_lookup(label_names, self.class_names)
+        self.ids = [os.path.basename(path) for path in self.paths]
+
+    def __len__(self):
+        return len(self.paths)
+
+    def read_batch(self, indices, executor):
+        return _stack(list(executor.map(read_image, [self.paths[i] for i in indices])))
+
+
+class RemoteSource:
+    """Samples served by a dataset server (dataset_server.py)."""
+
+    # samples per request; the requests of one batch run in parallel
+    REQUEST_SIZE = 64
+
+    def __init__(self, server_url: str, dataset_name: str, split_name: str):
+        self.client = DatasetClient(server_url)
+        self.dataset_name = dataset_name
+        self.split_name = split_name
+        index = self.client.get_index(dataset_name, split_name)
+        self.class_names = index["class_names"]
+        self.labels = np.asarray(index["labels"], dtype=np.int64)
+        self.ids = index["ids"]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _fetch(self, indices):
+        samples = self.client.get_batch(self.dataset_name, self.split_name, indices)
+        return [read_image(data) for data in samples]
+
+    def read_batch(self, indices, executor):
+        requests = [
+            indices[i:i + self.REQUEST_SIZE]
+            for i in range(0, len(indices), self.REQUEST_SIZE)
+        ]
+        images = [image for chunk in executor.map(self._fetch, requests) for image in chunk]
+        return _stack(images)
+
+
+def open_source(dataset_path: str, split_name: str, resolution=None):
+    """
+    Returns the fastest available, up-to-date source for a split of a processed dataset.
+    Every source maps the labels through the class table of the whole dataset.
+    """
+    class_names = list_class_names(dataset_path)
+    if resolution is not None:
+        resized_dir = get_resized_dir(dataset_path, resolution)
+        return FileSource(resized_dir, split_name, class_names)
+    if has_tensor_cache(dataset_path, split_name):
+        if is_tensor_cache_fresh(dataset_path, split_name):
+            return TensorCacheSource(dataset_path, split_name, class_names)
+        print(
+            f"Tensor cache of {dataset_path} {split_name} is outdated, not using it "
+            "(rebuild it with tensor_cache.py)"
+        )
+    shards_dir = get_shards_dir(dataset_path, split_name)
+    if os.path.isdir(shards_dir):
+        if is_shards_fresh(dataset_path, split_name):
+            return ShardSource(shards_dir, class_names)
+        print(
+            f"Shards of {dataset_path} {split_name} are outdated, not using them "
+            "(rebuild them with shards.py)"
+        )
+    return FileSource(dataset_path, split_name, class_names)
+
+
+def buffered_shuffle(indices, buffer_size: int, rng):
+    """
+    Yields `indices` in a shuffled order using a buffer of at most `buffer_size` items.
+
+    Each incoming index replaces a randomly chosen buffered one, which is yielded, so
+    samples move at most about `buffer_size` positions. On its own this keeps the order
+    of a label-sorted source largely intact; see `shuffle_indices`.
+    """
+    buffer = []
+    for idx in indices:
+        if len(buffer) < buffer_size:
+            buffer.append(idx)
+            continue
+        slot = rng.integers(len(buffer))
+        yield buffer[slot]
+        buffer[slot] = idx
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+def shuffle_indices(indices: np.ndarray, rng, buffer_size=None):
+    """
+    Returns `indices` in a shuffled order.
+
+    Without `buffer_size` (or with one covering every index) this is a full permutation.
+    Otherwise the indices are cut into contiguous blocks of `buffer_size`, the block
+    order is permuted and a buffer of `buffer_size` shuffles within the blocks, so reads
+    stay within about two blocks at a time while every part of the split can come first.
+    """
+    if buffer_size is None or buffer_size >= len(indices):
+        return rng.permutation(indices).tolist()
+    starts = rng.permutation(np.arange(0, len(indices), buffer_size))
+    blocks = (indices[start:start + buffer_size].tolist() for start in starts)
+    return buffered_shuffle(itertools.chain.from_iterable(blocks), buffer_size, rng)
+
+
+class DatasetLoader:
+    """
+    Iterable over batches of (images, labels) of one split.
+
+    Every iteration is one epoch. With `shuffle`, each epoch uses a different order
+    derived from `seed` and the epoch number (see `set_epoch`).
+    """
+
+    def __init__(
+        self,
+        source,
+        batch_size: int = 32,
+        shuffle: bool = False,
+        shuffle_buffer: int = DEFAULT_SHUFFLE_BUFFER,
+        seed: int = 42,
+        num_shards: int = 1,
+        shard_index: int = 0,
+        prefetch: int = 4,
+        num_workers: int = 8,
+        drop_last: bool = False,
+    ):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index must be in [0, {num_shards}), got {shard_index}")
+        self.source = source
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.prefetch = prefetch
+        self.num_workers = num_workers
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.class_names = source.class_names
+        # strided, not contiguous: the sources are ordered by label
+        self.indices = np.arange(shard_index, len(source), num_shards)
+
+    def __len__(self):
+        """Number of batches per epoch."""
+        if self.drop_last:
+            return len(self.indices) // self.batch_size
+        return -(-len(self.indices) // self.batch_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        """Sets the epoch used to derive the shuffling order."""
+        self.epoch = epoch
+
+    def _iter_batch_indices(self):
+        indices = self.indices.tolist()
+        if self.shuffle:
+            rng = np.random.default_rng([self.seed, self.epoch])
+            indices = shuffle_indices(self.indices, rng, self.shuffle_buffer)
+        batch = []
+        for idx in indices:
+            batch.append(idx)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch and not self.drop_last:
+            yield batch
+
+    def _produce(self, batches: queue.Queue, stop: threading.Event):
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.num_workers) as executor:
+                for batch in self._iter_batch_indices():
+                    if stop.is_set():
+                        return
+                    images = self.source.read_batch(batch, executor)
+                    batches.put((images, self.source.labels[batch]))
+            batches.put(None)
+        except Exception as e:  # surfaced in the consuming thread
+            batches.put(e)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            # unblock the producer if it is waiting on a full queue
+            while producer.is_alive():
+                try:
+                    batches.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            self.epoch += 1 if self.shuffle else 0
+
+
+def load_dataset(
+    dataset_name: str,
+    split: str = "training",
+    processed_dir: str = paths.PROCESSED_DIR,
+    resolution=None,
+    server_url=None,
+    **loader_kwargs,
+) -> DatasetLoader:
+    """
+    Opens a split of a processed dataset as a batched, prefetching loader.
+
+    Args:
+        dataset_name (str): Name of the dataset, e.g. "cifar10".
+        split (str): Training, validation, or testing.
+        processed_dir (str): Directory holding the processed datasets.
+        resolution (Optional[int]): Read the resized derivatives at this resolution
+                                    (see derivatives.py) instead of the originals.
+        server_url (Optional[str]): Fetch the samples from a dataset server, e.g.
+                                    "http://node-1:8080" (see dataset_server.py).
+        **loader_kwargs: batch_size, shuffle, shuffle_buffer, seed, num_shards,
+                         shard_index, prefetch, num_workers and drop_last
+                         (see DatasetLoader).
+
+    Returns:
+        DatasetLoader: An iterable over (images, labels) batches.
+    """
+    if server_url is not None:
+        if resolution is not None:
+            raise ValueError("Resized derivatives are not served by the dataset server")
+        return DatasetLoader(RemoteSource(server_url, dataset_name, split), **loader_kwargs)
+    dataset_path = get_dataset_path(dataset_name, processed_dir)
+    source = open_source(dataset_path, split, resolution=resolution)
+    return DatasetLoader(source, **loader_kwargs)
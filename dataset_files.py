@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+
+import paths
+
+# names of the split directories used under each processed dataset
+SPLITS = ["training", "validation", "testing"]
+
+# extensions of every image format (see image_formats.py)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".npy")
+
+IGNORED_NAMES = {".DS_Store"}
+
+
+def is_image_file(file_name: str) -> bool:
+    """Check if the file name has one of the supported image extensions."""
+    return file_name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def get_dataset_path(dataset_name: str, processed_dir: str = paths.PROCESSED_DIR) -> str:
+    """Returns the path of a processed dataset given its name."""
+    return os.path.join(processed_dir, dataset_name)
+
+
+def list_dataset_names(processed_dir: str = paths.PROCESSED_DIR) -> list:
+    """Lists the names of all datasets in the processed directory."""
+    return sorted(
+        entry.name
+        for entry in os.scandir(processed_dir)
+        if entry.is_dir() and entry.name not in IGNORED_NAMES
+    )
+
+
+def list_split_names(dataset_path: str) -> list:
+    """Lists the split directories (training, validation, testing) present for a dataset."""
+    return [s for s in SPLITS if os.path.isdir(os.path.join(dataset_path, s))]
+
+
+def list_split_files(dataset_path: str, split_name: str, use_cache: bool = False):
+    """
+    Lists the image files of one split of a processed dataset.
+
+    The processed layout is `<dataset>/<split>/<label>/<file>`. Labels and file names
+    are sorted so the order is stable across runs and platforms.
+
+    Args:
+        dataset_path (str): Path to the processed dataset directory.
+        split_name (str): Training, validation, or testing.
+        use_cache (bool): List the files from the shared file cache (file_cache.py),
+                          which only re-lists directories that changed.
+
+    Returns:
+        Tuple[List[str], List[str]]: The image file paths and their labels.
+    """
+    if use_cache:
+        from file_cache import get_file_cache
+
+        return get_file_cache().list_split_files(dataset_path, split_name)
+
+    split_path = os.path.join(dataset_path, split_name)
+    X = []
+    y = []
+    label_entries = sorted(
+        (e for e in os.scandir(split_path) if e.is_dir()), key=lambda e: e.name
+    )
+    for label_entry in label_entries:
+        file_names = sorted(
+            e.name
+            for e in os.scandir(label_entry.path)
+            if is_image_file(e.name) and e.is_file()
+        )
+        X.extend(os.path.join(label_entry.path, name) for name in file_names)
+        y += [label_entry.name] * len(file_names)
+    return X, y
+
+
+def list_class_names(dataset_path: str) -> list:
+    """
+    Lists the class names of a processed dataset: the sorted labels over all splits.
+
+    Every split (and every storage of a split) maps labels to indices through this one
+    table, so a class keeps its index in splits that lack some of the classes. Labels
+    are collected from the split directories, the shard label tables, the tensor cache
+    class table and the split table, whichever exist.
+    """
+    from shards import LABELS_FILE_NAME, SHARDS_DIR_NAME
+    from split_table import SplitTable, has_split_table, get_split_table_dir
+    from tensor_cache import CLASSES_FILE_NAME, get_cache_dir
+
+    class_names = set()
+    for split_name in list_split_names(dataset_path):
+        split_path = os.path.join(dataset_path, split_name)
+        class_names.update(e.name for e in os.scandir(split_path) if e.is_dir())
+    labels_paths = [
+        os.path.join(dataset_path, SHARDS_DIR_NAME, split_name, LABELS_FILE_NAME)
+        for split_name in SPLITS
+    ]
+    labels_paths.append(os.path.join(get_cache_dir(dataset_path), CLASSES_FILE_NAME))
+    for labels_path in labels_paths:
+        if os.path.exists(labels_path):
+            with open(labels_path, "r") as file:
+                class_names.update(json.load(file))
+    if has_split_table(dataset_path):
+        class_names.update(SplitTable(get_split_table_dir(dataset_path)).label_names)
+    return sorted(class_names - IGNORED_NAMES)
+
+
+def split_fingerprint(dataset_path: str, split_name: str):
+    """
+    Returns a fingerprint of the files of one split: a hash of the label, name, size and
+    mtime of every file. Derived storages (tensor cache, shards) record it when they are
+    built, so a split rebuilt afterwards is detected. None if the split directory does
+    not exist.
+    """
+    split_path = os.path.join(dataset_path, split_name)
+    if not os.path.isdir(split_path):
+        return None
+    digest = hashlib.sha1()
+    for label_entry in sorted(
+        (e for e in os.scandir(split_path) if e.is_dir()), key=lambda e: e.name
+    ):
+        entries = sorted(
+            (e for e in os.scandir(label_entry.path) if is_image_file(e.name)),
+            key=lambda e: e.name,
+        )
+        for entry in entries:
+            stat = entry.stat()
+            digest.update(
+                f"{label_entry.name}/{entry.name}:{stat.st_size}:{stat.st_mtime_ns}\n"
+                .encode("utf-8")
+            )
+    return digest.hexdigest()
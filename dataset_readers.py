@@ -0,0 +1,498 @@
+"""
+Pure-NumPy readers for the source files of the array datasets (MNIST, Fashion-MNIST,
+mini-MNIST, CIFAR-10 and CIFAR-100), used by the export notebooks instead of
+`tf.keras.datasets`, so exporting does not need TensorFlow.
+
+The `load_*` functions return `((x_train, y_train), (x_test, y_test))` exactly like the
+Keras loaders. IDX arrays are `np.frombuffer` views of the file contents (memory-mapped
+for uncompressed files), so nothing is copied after decompression. The source files are
+looked up in `datasets/raw/<dataset>/data/`, then in what the Keras loaders cache in
+~/.keras/datasets (`mnist.npz`, the Fashion-MNIST IDX files in `fashion-mnist/` and the
+extracted CIFAR batch directories), and downloaded into the data directory when missing:
+
+    from dataset_readers import load_cifar10
+
+    (x_train, y_train), (x_test, y_test) = load_cifar10()
+
+The `iter_*` functions yield (images, labels, indices) chunks that
+`image_export.save_image_chunks` exports directly, so a dataset is never loaded into
+memory as a whole. The export notebooks use them per split (`iter_mnist_chunks("train")`,
+`iter_cifar10_chunks("test")`, ...); the chunks are read from:
+
+    IDX    - MNIST-style `*-images-idx3-ubyte` / `*-labels-idx1-ubyte` files, plain or
+             gzipped. Records are read in slices of `chunk_size` from the data section.
+    CIFAR  - the pickled batch files of CIFAR-10 (`data_batch_1`..`5`, `test_batch`) and
+             CIFAR-100 (`train`, `test`), read one batch at a time, either from the
+             extracted directory or streamed from the `.tar.gz` archive.
+
+    from dataset_readers import iter_mnist_chunks
+    from image_export import save_image_chunks
+
+    save_image_chunks(iter_mnist_chunks("train"), output_dir, "training")
+"""
+
+import os
+import gzip
+import mmap
+import pickle
+import tarfile
+
+import numpy as np
+
+import paths
+
+DEFAULT_CHUNK_SIZE = 2000
+
+# IDX data type codes (third byte of the magic number)
+IDX_DTYPES = {
+    0x08: np.dtype(np.uint8),
+    0x09: np.dtype(np.int8),
+    0x0B: np.dtype(">i2"),
+    0x0C: np.dtype(">i4"),
+    0x0D: np.dtype(">f4"),
+    0x0E: np.dtype(">f8"),
+}
+
+CIFAR_IMAGE_SHAPE = (3, 32, 32)
+
+KERAS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".keras", "datasets")
+
+# Keras caches MNIST as one .npz file instead of the IDX files
+KERAS_MNIST_FILE = os.path.join(KERAS_CACHE_DIR, "mnist.npz")
+
+MNIST_URL = "https://storage.googleapis.com/cvdf-datasets/mnist/"
+
+FASHION_MNIST_URL = "https://storage.googleapis.com/tensorflow/tf-keras-datasets/"
+
+CIFAR10_URL = "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
+
+CIFAR100_URL = "https://www.cs.toronto.edu/~kriz/cifar-100-python.tar.gz"
+
+IDX_FILE_NAMES = {
+    "x_train": "train-images-idx3-ubyte.gz",
+    "y_train": "train-labels-idx1-ubyte.gz",
+    "x_test": "t10k-images-idx3-ubyte.gz",
+    "y_test": "t10k-labels-idx1-ubyte.gz",
+}
+
+# archive name, name of the extracted directory, training and test batch names
+CIFAR_SOURCES = {
+    "cifar10": (
+        "cifar-10-python.tar.gz",
+        "cifar-10-batches-py",
+        [f"data_batch_{i}" for i in range(1, 6)],
+        ["test_batch"],
+    ),
+    "cifar100": ("cifar-100-python.tar.gz", "cifar-100-python", ["train"], ["test"]),
+}
+
+
+def get_data_dir(dataset_name: str) -> str:
+    """Returns the directory holding the source files of a dataset."""
+    return os.path.join(paths.RAW_DIR, dataset_name, "data")
+
+
+def download_file(url: str, file_path: str) -> str:
+    """Downloads a file, writing to a temporary name first so no partial file is left."""
+    import requests
+
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    print(f"Downloading {url}...")
+    tmp_path = f"{file_path}.part"
+    with requests.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        with open(tmp_path, "wb") as file:
+            for data in response.iter_content(1024 * 1024):
+                file.write(data)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+def find_source_file(file_name: str, data_dir: str, keras_subdir=None, url=None):
+    """
+    Returns the path of a source file: from `data_dir`, from `keras_subdir` of the Keras
+    cache if the Keras loader caches the file as is or, if a `url` is given, downloaded
+    into `data_dir`.
+    """
+    candidates = [os.path.join(data_dir, file_name)]
+    if keras_subdir is not None:
+        candidates.append(os.path.join(KERAS_CACHE_DIR, keras_subdir, file_name))
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    if url is None:
+        raise FileNotFoundError(f"{file_name} not found in {data_dir}")
+    return download_file(url, os.path.join(data_dir, file_name))
+
+
+def open_idx_file(file_path: str):
+    """Opens an IDX file for reading, transparently decompressing `.gz` files."""
+    if file_path.endswith(".gz"):
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+def read_idx_header(file):
+    """
+    Reads the header of an IDX file.
+
+    Args:
+        file: Binary file object positioned at the start of the file.
+
+    Returns:
+        Tuple[np.dtype, Tuple[int]]: The data type and the shape of the array.
+    """
+    magic = file.read(4)
+    if len(magic) != 4 or magic[:2] != b"\x00\x00" or magic[2] not in IDX_DTYPES:
+        raise ValueError(f"Not an IDX file (magic {magic!r})")
+    num_dims = magic[3]
+    shape = tuple(np.frombuffer(file.read(4 * num_dims), dtype=">u4").tolist())
+    return IDX_DTYPES[magic[2]], shape
+
+
+def load_idx(file_path: str) -> np.ndarray:
+    """
+    Reads a whole IDX file into a read-only array.
+
+    The array is a `np.frombuffer` view of the file contents: of the decompressed bytes
+    for `.gz` files, of a memory map otherwise, so no copy is made.
+    """
+    if file_path.endswith(".gz"):
+        with gzip.open(file_path, "rb") as file:
+            data = file.read()
+    else:
+        with open(file_path, "rb") as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    header = memoryview(data)[:4]
+    if len(header) != 4 or header[2] not in IDX_DTYPES:
+        raise ValueError(f"{file_path} is not an IDX file")
+    dtype, num_dims = IDX_DTYPES[header[2]], header[3]
+    shape = tuple(np.frombuffer(data, dtype=">u4", count=num_dims, offset=4).tolist())
+    count = int(np.prod(shape, dtype=np.int64))
+    if len(data) < 4 + 4 * num_dims + count * dtype.itemsize:
+        raise ValueError(f"{file_path} is truncated")
+    return np.frombuffer(data, dtype=dtype, count=count, offset=4 + 4 * num_dims).reshape(
+        shape
+    )
+
+
+def get_idx_files(data_dir: str, split: str, url=None, keras_subdir=None):
+    """
+    Returns the paths of the image and label IDX files of the "train" or "test" split
+    of an MNIST-style dataset, see `find_source_file`.
+    """
+    file_names = (IDX_FILE_NAMES[f"x_{split}"], IDX_FILE_NAMES[f"y_{split}"])
+    return tuple(
+        find_source_file(file_name, data_dir, keras_subdir, url and f"{url}{file_name}")
+        for file_name in file_names
+    )
+
+
+def load_idx_dataset(data_dir: str, url=None, keras_subdir=None):
+    """
+    Loads the four IDX files of an MNIST-style dataset.
+
+    Returns:
+        Tuple: ((x_train, y_train), (x_test, y_test)) as uint8 arrays.
+    """
+    return tuple(
+        tuple(map(load_idx, get_idx_files(data_dir, split, url, keras_subdir)))
+        for split in ("train", "test")
+    )
+
+
+def find_keras_mnist_file(data_dir: str):
+    """Returns the `mnist.npz` cached by Keras, if the IDX files are not in `data_dir`."""
+    if all(
+        os.path.exists(os.path.join(data_dir, file_name))
+        for file_name in IDX_FILE_NAMES.values()
+    ):
+        return None
+    return KERAS_MNIST_FILE if os.path.exists(KERAS_MNIST_FILE) else None
+
+
+def load_mnist(data_dir=None, download: bool = True):
+    """Loads MNIST like `tf.keras.datasets.mnist.load_data()`."""
+    data_dir = data_dir or get_data_dir("mnist")
+    npz_file = find_keras_mnist_file(data_dir)
+    if npz_file is not None:
+        with np.load(npz_file) as data:
+            return (data["x_train"], data["y_train"]), (data["x_test"], data["y_test"])
+    return load_idx_dataset(data_dir, url=MNIST_URL if download else None)
+
+
+def load_fashion_mnist(data_dir=None, download: bool = True):
+    """Loads Fashion-MNIST like `tf.keras.datasets.fashion_mnist.load_data()`."""
+    return load_idx_dataset(
+        data_dir or get_data_dir("fashion_mnist"),
+        url=FASHION_MNIST_URL if download else None,
+        keras_subdir="fashion-mnist",
+    )
+
+
+def iter_idx_slices(file_path: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yields consecutive slices of the records of an IDX file.
+
+    Only `chunk_size` records are held in memory at a time.
+
+    Yields:
+        np.ndarray: Arrays of shape (<= chunk_size, *record_shape).
+    """
+    with open_idx_file(file_path) as file:
+        dtype, shape = read_idx_header(file)
+        record_shape = shape[1:]
+        record_size = dtype.itemsize * int(np.prod(record_shape, dtype=np.int64))
+        for start in range(0, shape[0], chunk_size):
+            count = min(chunk_size, shape[0] - start)
+            data = file.read(count * record_size)
+            if len(data) != count * record_size:
+                raise ValueError(f"{file_path} is truncated")
+            yield np.frombuffer(data, dtype=dtype).reshape((count,) + record_shape)
+
+
+def iter_idx_chunks(
+    images_file: str, labels_file: str, chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """Yields (images, labels, indices) chunks from a pair of IDX image and label files."""
+    start = 0
+    for images, labels in zip(
+        iter_idx_slices(images_file, chunk_size), iter_idx_slices(labels_file, chunk_size)
+    ):
+        if len(images) != len(labels):
+            raise ValueError(f"{images_file} and {labels_file} differ in length")
+        yield images, labels, np.arange(start, start + len(images))
+        start += len(images)
+
+
+def iter_mnist_chunks(
+    split: str, data_dir=None, download: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """
+    Yields (images, labels, indices) chunks of the "train" or "test" split of MNIST.
+
+    From the Keras `mnist.npz` the split is loaded as a whole (an .npz member cannot be
+    read in slices) and then cut into chunks.
+    """
+    data_dir = data_dir or get_data_dir("mnist")
+    npz_file = find_keras_mnist_file(data_dir)
+    if npz_file is not None:
+        with np.load(npz_file) as data:
+            images, labels = data[f"x_{split}"], data[f"y_{split}"]
+        return _split_batch(images, labels, 0, chunk_size)
+    images_file, labels_file = get_idx_files(
+        data_dir, split, url=MNIST_URL if download else None
+    )
+    return iter_idx_chunks(images_file, labels_file, chunk_size)
+
+
+def iter_fashion_mnist_chunks(
+    split: str, data_dir=None, download: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """Yields (images, labels, indices) chunks of a split of Fashion-MNIST."""
+    images_file, labels_file = get_idx_files(
+        data_dir or get_data_dir("fashion_mnist"),
+        split,
+        url=FASHION_MNIST_URL if download else None,
+        keras_subdir="fashion-mnist",
+    )
+    return iter_idx_chunks(images_file, labels_file, chunk_size)
+
+
+def select_chunks(chunks, indices):
+    """
+    Yields the part of each (images, labels, indices) chunk whose indices are in
+    `indices`, e.g. to export a sample of a dataset without loading it.
+    """
+    indices = np.asarray(indices)
+    for images, labels, chunk_indices in chunks:
+        mask = np.isin(chunk_indices, indices)
+        if mask.any():
+            yield images[mask], labels[mask], chunk_indices[mask]
+
+
+def _cifar_batch_arrays(batch: dict, label_key: str):
+    """Returns (images, labels) of an unpickled CIFAR batch, images as (N, 32, 32, 3)."""
+    data = np.asarray(batch[b"data"], dtype=np.uint8)
+    images = data.reshape((-1,) + CIFAR_IMAGE_SHAPE).transpose(0, 2, 3, 1)
+    labels = np.asarray(batch[label_key.encode()], dtype=np.int64)
+    return images, labels
+
+
+def _split_batch(images, labels, start: int, chunk_size):
+    # a chunk size of None yields the whole batch as one chunk
+    chunk_size = chunk_size or len(images)
+    for offset in range(0, len(images), chunk_size):
+        yield (
+            images[offset:offset + chunk_size],
+            labels[offset:offset + chunk_size],
+            np.arange(start + offset, start + min(offset + chunk_size, len(images))),
+        )
+
+
+def iter_cifar_chunks(
+    batch_files, label_key: str = "labels", chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """
+    Yields (images, labels, indices) chunks from CIFAR pickle batch files, one batch in
+    memory at a time.
+
+    Args:
+        batch_files (List[str]): Batch files in order, e.g. data_batch_1..5.
+        label_key (str): "labels" (CIFAR-10), "fine_labels" or "coarse_labels"
+                         (CIFAR-100).
+        chunk_size (Optional[int]): Number of images per chunk; None for one chunk per
+                                    batch.
+    """
+    start = 0
+    for batch_file in batch_files:
+        with open(batch_file, "rb") as file:
+            images, labels = _cifar_batch_arrays(
+                pickle.load(file, encoding="bytes"), label_key
+            )
+        yield from _split_batch(images, labels, start, chunk_size)
+        start += len(images)
+
+
+def iter_cifar_archive_chunks(
+    archive_file: str,
+    batch_names,
+    label_key: str = "labels",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """
+    Like `iter_cifar_chunks`, but streams the batches from the `.tar.gz` archive without
+    extracting it. Batches are yielded in the order of `batch_names`.
+
+    Args:
+        archive_file (str): Path of cifar-10-python.tar.gz or cifar-100-python.tar.gz.
+        batch_names (List[str]): Base names of the batch members, e.g. ["test_batch"].
+        label_key (str): See `iter_cifar_chunks`.
+        chunk_size (Optional[int]): See `iter_cifar_chunks`.
+    """
+    batch_names = list(batch_names)
+    batches = {}
+    start = 0
+    with tarfile.open(archive_file, "r|gz") as tar:
+        for member in tar:
+            name = member.name.rsplit("/", 1)[-1]
+            if not member.isfile() or name not in batch_names:
+                continue
+            batches[name] = _cifar_batch_arrays(
+                pickle.load(tar.extractfile(member), encoding="bytes"), label_key
+            )
+            # yield every batch that is next in order; out-of-order ones wait in memory
+            while batch_names and batch_names[0] in batches:
+                images, labels = batches.pop(batch_names.pop(0))
+                yield from _split_batch(images, labels, start, chunk_size)
+                start += len(images)
+    if batch_names:
+        raise ValueError(f"Batches {batch_names} not found in {archive_file}")
+
+
+def iter_cifar_batches(
+    dataset_name: str,
+    batch_names,
+    data_dir=None,
+    label_key=None,
+    download: bool = True,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """
+    Yields (images, labels, indices) chunks of the given CIFAR batches, from the
+    extracted batch directory or streamed from the archive.
+
+    Args:
+        dataset_name (str): "cifar10" or "cifar100".
+        batch_names (List[str]): Base names of the batches, in order.
+        data_dir (Optional[str]): Directory of the source files. Defaults to
+                                  `datasets/raw/<dataset>/data/`.
+        label_key (Optional[str]): Label field, see `iter_cifar_chunks`. Defaults to
+                                   the fine labels, like Keras.
+        download (bool): Download the archive when it is not found.
+        chunk_size (Optional[int]): See `iter_cifar_chunks`.
+    """
+    archive_name, dir_name, _, _ = CIFAR_SOURCES[dataset_name]
+    data_dir = data_dir or get_data_dir(dataset_name)
+    label_key = label_key or ("labels" if dataset_name == "cifar10" else "fine_labels")
+
+    for batch_dir in (
+        os.path.join(data_dir, dir_name),
+        os.path.join(KERAS_CACHE_DIR, dir_name),
+    ):
+        batch_files = [os.path.join(batch_dir, name) for name in batch_names]
+        if all(os.path.exists(batch_file) for batch_file in batch_files):
+            return iter_cifar_chunks(batch_files, label_key, chunk_size)
+    url = {"cifar10": CIFAR10_URL, "cifar100": CIFAR100_URL}[dataset_name]
+    archive_file = find_source_file(archive_name, data_dir, url=url if download else None)
+    return iter_cifar_archive_chunks(archive_file, batch_names, label_key, chunk_size)
+
+
+def iter_cifar10_chunks(
+    split: str, data_dir=None, download: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE
+):
+    """Yields (images, labels, indices) chunks of the "train" or "test" split of CIFAR-10."""
+    _, _, train_batches, test_batches = CIFAR_SOURCES["cifar10"]
+    batch_names = train_batches if split == "train" else test_batches
+    return iter_cifar_batches(
+        "cifar10", batch_names, data_dir, download=download, chunk_size=chunk_size
+    )
+
+
+def iter_cifar100_chunks(
+    split: str,
+    data_dir=None,
+    label_key: str = "fine_labels",
+    download: bool = True,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+):
+    """Yields (images, labels, indices) chunks of a split of CIFAR-100."""
+    _, _, train_batches, test_batches = CIFAR_SOURCES["cifar100"]
+    batch_names = train_batches if split == "train" else test_batches
+    return iter_cifar_batches(
+        "cifar100", batch_names, data_dir, label_key, download, chunk_size
+    )
+
+
+def load_cifar(dataset_name: str, data_dir=None, label_key=None, download: bool = True):
+    """
+    Loads CIFAR-10 or CIFAR-100 from the extracted batch directory or the archive.
+
+    Args:
+        dataset_name (str): "cifar10" or "cifar100".
+        data_dir (Optional[str]): See `iter_cifar_batches`.
+        label_key (Optional[str]): See `iter_cifar_batches`.
+        download (bool): Download the archive when it is not found.
+
+    Returns:
+        Tuple: ((x_train, y_train), (x_test, y_test)), images as (N, 32, 32, 3) uint8.
+    """
+    _, _, train_batches, test_batches = CIFAR_SOURCES[dataset_name]
+    batches = iter_cifar_batches(
+        dataset_name,
+        train_batches + test_batches,
+        data_dir,
+        label_key,
+        download,
+        chunk_size=None,
+    )
+
+    # one chunk per batch, in the order of batch_names
+    batches = [(images, labels) for images, labels, _ in batches]
+    return tuple(
+        (
+            np.concatenate([images for images, _ in split_batches]),
+            np.concatenate([labels for _, labels in split_batches]),
+        )
+        for split_batches in (batches[:len(train_batches)], batches[len(train_batches):])
+    )
+
+
+def load_cifar10(data_dir=None, download: bool = True):
+    """Loads CIFAR-10 like `tf.keras.datasets.cifar10.load_data()` (labels flattened)."""
+    return load_cifar("cifar10", data_dir, download=download)
+
+
+def load_cifar100(data_dir=None, label_key: str = "fine_labels", download: bool = True):
+    """Loads CIFAR-100 like `tf.keras.datasets.cifar100.load_data()` (flat labels)."""
+    return load_cifar("cifar100", data_dir, label_key=label_key, download=download)
@@ -0,0 +1,630 @@
+"""
+Read-only HTTP server for the processed datasets.
+
+Training nodes can read samples over the network instead of copying the whole processed
+tree first. The server keeps connections alive (HTTP/1.1) and answers from an in-memory
+LRU cache of recently served images:
+
+    GET /datasets                                   dataset names (JSON)
+    GET /datasets/<dataset>/<split>/index           ids, label indices and class names
+    GET /datasets/<dataset>/<split>/samples/<id>    one encoded image (label in X-Label)
+    GET /datasets/<dataset>/<split>/batch?indices=0,5,9
+                                                    several images back to back, their
+                                                    sizes in X-Sample-Lengths
+    GET /datasets/<dataset>/<split>/shards/<file>   a shard, shard index or label table;
+                                                    supports Range requests
+    GET /stats                                      cache hits, misses and size
+
+Samples are numbered like the loader sources (data_loader.py): in shard order when the
+split has up-to-date shards, otherwise in the sorted order of the folder tree. Label
+indices refer to the class table of the whole dataset (`dataset_files.list_class_names`).
+Split catalogs are rebuilt when the split is (the manifest, shard label table or split
+directories change), checked at most every CATALOG_CHECK_INTERVAL seconds. A catalog is
+built outside the server-wide lock, so other splits are served meanwhile, and a replaced
+catalog closes its shard files once the last request using it is done. Read errors
+are answered with a JSON error (404 for missing files, 500 otherwise).
+`DatasetClient` is the matching client; `load_dataset(..., server_url=...)` reads
+through it.
+
+    python dataset_server.py --port 8080 --cache-mb 1024
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import contextlib
+import http.client
+import collections
+import urllib.parse
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paths
+from dataset_files import (
+    SPLITS,
+    get_dataset_path,
+    list_class_names,
+    list_dataset_names,
+    list_split_files,
+)
+from materialize import SPLIT_MANIFEST_FILE_NAME
+from shards import (
+    FINGERPRINT_FILE_NAME,
+    LABELS_FILE_NAME,
+    SHARDS_DIR_NAME,
+    ShardReader,
+    get_shards_dir,
+    is_shards_fresh,
+)
+
+DEFAULT_PORT = 8080
+
+DEFAULT_CACHE_BYTES = 512 * 1024 * 1024
+
+# upper bound of the number of samples of one batch request
+MAX_BATCH_SIZE = 4096
+
+# seconds between two checks of whether the split of a catalog was rebuilt
+CATALOG_CHECK_INTERVAL = 2.0
+
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".json": "application/json",
+    ".csv": "text/csv",
+}
+
+
+class LRUCache:
+    """Thread-safe LRU cache of byte strings, bounded by their total size."""
+
+    def __init__(self, max_bytes: int = DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.num_bytes -= len(previous)
+            self._items[key] = data
+            self.num_bytes += len(data)
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.num_bytes -= len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self.num_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def catalog_signature(dataset_path: str, split_name: str) -> tuple:
+    """
+    Returns the mtimes a split catalog depends on: the split manifest, the shard label
+    table and fingerprint, and the split and label directories. Rebuilding the split
+    changes at least one of them.
+    """
+    shards_dir = get_shards_dir(dataset_path, split_name)
+    split_path = os.path.join(dataset_path, split_name)
+    signature = []
+    for path in (
+        os.path.join(dataset_path, SPLIT_MANIFEST_FILE_NAME),
+        os.path.join(shards_dir, LABELS_FILE_NAME),
+        os.path.join(shards_dir, FINGERPRINT_FILE_NAME),
+        split_path,
+    ):
+        try:
+            signature.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            signature.append(None)
+    if os.path.isdir(split_path):
+        signature.extend(
+            (entry.name, entry.stat().st_mtime_ns)
+            for entry in sorted(os.scandir(split_path), key=lambda e: e.name)
+            if entry.is_dir()
+        )
+    return tuple(signature)
+
+
+class SplitCatalog:
+    """The samples of one split of a processed dataset, read from shards or files."""
+
+    def __init__(self, dataset_path: str, split_name: str):
+        self.dataset_path = dataset_path
+        self.split_name = split_name
+        # taken first: a change during the build then shows as a different signature
+        self.signature = catalog_signature(dataset_path, split_name)
+        self.checked_at = time.monotonic()
+        shards_dir = get_shards_dir(dataset_path, split_name)
+        self.shards_dir = shards_dir
+        self.reader = None
+        self.class_names = list_class_names(dataset_path)
+        class_to_idx = {name: idx for idx, name in enumerate(self.class_names)}
+        if os.path.isdir(shards_dir) and is_shards_fresh(dataset_path, split_name):
+            self.reader = ShardReader(shards_dir)
+            self.ids = self.reader.ids
+            lookup = [class_to_idx[label] for label in self.reader.labels]
+            self.labels = [lookup[label_idx] for label_idx in self.reader.label_idxs]
+        else:
+            self.paths, label_names = list_split_files(dataset_path, split_name)
+            self.ids = [os.path.basename(path) for path in self.paths]
+            self.labels = [class_to_idx[label] for label in label_names]
+        self._id_to_idx = {sample_id: idx for idx, sample_id in enumerate(self.ids)}
+        self._users = 0
+        self._retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index_of(self, sample_id: str):
+        return self._id_to_idx.get(sample_id)
+
+    def read(self, idx: int) -> bytes:
+        if self.reader is not None:
+            return self.reader.read(idx)[0]
+        with open(self.paths[idx], "rb") as file:
+            return file.read()
+
+    def to_dict(self) -> dict:
+        return {"ids": self.ids, "labels": self.labels, "class_names": self.class_names}
+
+    def acquire(self) -> bool:
+        """Registers a request using the catalog; False if it is already closed."""
+        with self._lock:
+            if self._closed:
+                return False
+            self._users += 1
+            return True
+
+    def release(self) -> None:
+        """Unregisters a request, closing a retired catalog once it is no longer used."""
+        with self._lock:
+            self._users -= 1
+            unused = self._retired and self._users == 0
+        if unused:
+            self.close()
+
+    def retire(self) -> None:
+        """Marks a replaced catalog, closing it now or when its last request is done."""
+        with self._lock:
+            self._retired = True
+            unused = self._users == 0
+        if unused:
+            self.close()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self.reader is not None:
+            self.reader.close()
+
+
+class DatasetServer(ThreadingHTTPServer):
+    """Serves the processed datasets under `processed_dir`."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        processed_dir: str = paths.PROCESSED_DIR,
+        cache_bytes: int = DEFAULT_CACHE_BYTES,
+    ):
+        super().__init__(address, DatasetRequestHandler)
+        self.processed_dir = processed_dir
+        self.cache = LRUCache(cache_bytes)
+        self._catalogs = {}
+        # one lock per split, held while its catalog is built
+        self._build_locks = {}
+        # guards the two dicts only, never held while reading the disk
+        self._catalogs_lock = threading.Lock()
+
+    @staticmethod
+    def _is_current(catalog: SplitCatalog) -> bool:
+        now = time.monotonic()
+        if now - catalog.checked_at < CATALOG_CHECK_INTERVAL:
+            return True
+        if catalog_signature(catalog.dataset_path, catalog.split_name) == catalog.signature:
+            catalog.checked_at = now
+            return True
+        return False
+
+    def get_catalog(self, dataset_name: str, split_name: str) -> SplitCatalog:
+        """
+        Returns the catalog of a split, built on first use and rebuilt when the split
+        changed (see `catalog_signature`); KeyError if unknown. Use `use_catalog` to
+        read from it.
+        """
+        key = (dataset_name, split_name)
+        with self._catalogs_lock:
+            catalog = self._catalogs.get(key)
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        if catalog is not None and self._is_current(catalog):
+            return catalog
+
+        with build_lock:
+            with self._catalogs_lock:
+                current = self._catalogs.get(key)
+            # built by another request while this one waited for the lock
+            if current is not None and current is not catalog and self._is_current(current):
+                return current
+            # names come from the URL: only accept existing datasets and splits
+            if split_name not in SPLITS or dataset_name not in list_dataset_names(
+                self.processed_dir
+            ):
+                raise KeyError(f"{dataset_name}/{split_name}")
+            dataset_path = get_dataset_path(dataset_name, self.processed_dir)
+            if not os.path.isdir(os.path.join(dataset_path, split_name)) and not (
+                os.path.isdir(get_shards_dir(dataset_path, split_name))
+            ):
+                raise KeyError(f"{dataset_name}/{split_name}")
+            catalog = SplitCatalog(dataset_path, split_name)
+            with self._catalogs_lock:
+                previous = self._catalogs.get(key)
+                self._catalogs[key] = catalog
+        if previous is not None:
+            previous.retire()
+        return catalog
+
+    @contextlib.contextmanager
+    def use_catalog(self, dataset_name: str, split_name: str):
+        """
+        Yields the current catalog of a split (see `get_catalog`), keeping it open until
+        the block is done even if the split is rebuilt meanwhile.
+        """
+        catalog = self.get_catalog(dataset_name, split_name)
+        # a catalog closed between the lookup and the acquire was replaced: look again
+        while not catalog.acquire():
+            catalog = self.get_catalog(dataset_name, split_name)
+        try:
+            yield catalog
+        finally:
+            catalog.release()
+
+    def read_sample(self, catalog: SplitCatalog, idx: int) -> bytes:
+        """Returns the encoded bytes of a sample, from the cache when possible."""
+        # the signature keeps samples of a rebuilt split apart from the previous ones
+        key = (catalog.dataset_path, catalog.split_name, catalog.signature, idx)
+        data = self.cache.get(key)
+        if data is None:
+            data = catalog.read(idx)
+            self.cache.put(key, data)
+        return data
+
+    def server_close(self) -> None:
+        super().server_close()
+        with self._catalogs_lock:
+            catalogs = list(self._catalogs.values())
+            self._catalogs.clear()
+        for catalog in catalogs:
+            catalog.close()
+
+
+def parse_range(range_header: str, size: int):
+    """
+    Parses a single-range `Range: bytes=...` header.
+
+    Returns:
+        Optional[Tuple[int, int]]: The first and last byte (inclusive), or None if the
+                                   range is malformed or not satisfiable.
+    """
+    if not range_header.startswith("bytes=") or "," in range_header:
+        return None
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    try:
+        if start == "":
+            length = int(end)
+            if length <= 0:
+                return None
+            return max(0, size - length), size - 1
+        first = int(start)
+        last = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+class DatasetRequestHandler(BaseHTTPRequestHandler):
+    """Request handler of `DatasetServer`. Connections are kept alive (HTTP/1.1)."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # one line per request is too noisy for a data server
+        pass
+
+    def _send_headers(self, status, length: int, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(length))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def _send(self, status, body: bytes, content_type: str, headers=None) -> None:
+        self._send_headers(status, len(body), content_type, headers)
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_json(self, data) -> None:
+        self._send(HTTPStatus.OK, json.dumps(data).encode(), "application/json")
+
+    def _send_error(self, status, message: str) -> None:
+        self._send(status, json.dumps({"error": message}).encode(), "application/json")
+
+    def _send_file(self, file_path: str) -> None:
+        size = os.path.getsize(file_path)
+        content_type = CONTENT_TYPES.get(
+            os.path.splitext(file_path)[1].lower(), "application/octet-stream"
+        )
+        headers = {"Accept-Ranges": "bytes"}
+        range_header = self.headers.get("Range")
+        if range_header is None:
+            first, last, status = 0, size - 1, HTTPStatus.OK
+        else:
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                headers["Content-Range"] = f"bytes */{size}"
+                self._send(
+                    HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, b"", content_type, headers
+                )
+                return
+            first, last = byte_range
+            status = HTTPStatus.PARTIAL_CONTENT
+            headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+        with open(file_path, "rb") as file:
+            # opened before the headers go out, so a missing file still gets a 404
+            self._send_headers(status, last - first + 1, content_type, headers)
+            if self.command != "HEAD" and last >= first:
+                try:
+                    # streamed straight from the page cache, never held in memory whole
+                    self.connection.sendfile(file, offset=first, count=last - first + 1)
+                except OSError:
+                    # the headers are out: all that is left is to drop the connection
+                    self.close_connection = True
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        parts = [urllib.parse.unquote(part) for part in url.path.strip("/").split("/")]
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            if parts == ["datasets"]:
+                self._send_json(list_dataset_names(self.server.processed_dir))
+            elif parts == ["stats"]:
+                self._send_json(self.server.cache.stats())
+            elif len(parts) >= 4 and parts[0] == "datasets":
+                self._handle_split(parts[1], parts[2], parts[3], parts[4:], query)
+            else:
+                self._send_error(HTTPStatus.NOT_FOUND, f"Unknown path {url.path}")
+        except KeyError as e:
+            self._send_error(HTTPStatus.NOT_FOUND, f"Not found: {e.args[0]}")
+        except ValueError as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, str(e))
+        except (ConnectionError, TimeoutError):
+            # the client is gone, there is nobody to answer
+            raise
+        except FileNotFoundError as e:
+            # e.g. a file removed since the catalog was built
+            name = os.path.basename(e.filename) if e.filename else str(e)
+            self._send_error(HTTPStatus.NOT_FOUND, f"Not found: {name}")
+        except OSError as e:
+            self._send_error(HTTPStatus.INTERNAL_SERVER_ERROR, f"Read error: {e}")
+
+    def _handle_split(self, dataset_name, split_name, endpoint, rest, query) -> None:
+        with self.server.use_catalog(dataset_name, split_name) as catalog:
+            self._handle_catalog(catalog, endpoint, rest, query)
+
+    def _handle_catalog(self, catalog: SplitCatalog, endpoint, rest, query) -> None:
+        if endpoint == "index" and not rest:
+            self._send_json(catalog.to_dict())
+        elif endpoint == "samples" and len(rest) == 1:
+            idx = catalog.index_of(rest[0])
+            if idx is None:
+                raise KeyError(rest[0])
+            data = self.server.read_sample(catalog, idx)
+            content_type = CONTENT_TYPES.get(
+                os.path.splitext(rest[0])[1].lower(), "application/octet-stream"
+            )
+            label = catalog.class_names[catalog.labels[idx]]
+            self._send(HTTPStatus.OK, data, content_type, {"X-Label": label})
+        elif endpoint == "batch" and not rest:
+            indices = [int(i) for i in query.get("indices", [""])[0].split(",") if i]
+            if len(indices) > MAX_BATCH_SIZE:
+                raise ValueError(f"At most {MAX_BATCH_SIZE} samples per batch")
+            if any(not 0 <= idx < len(catalog) for idx in indices):
+                raise ValueError(f"Sample indices must be in [0, {len(catalog)})")
+            samples = [self.server.read_sample(catalog, idx) for idx in indices]
+            lengths = ",".join(str(len(data)) for data in samples)
+            self._send(
+                HTTPStatus.OK,
+                b"".join(samples),
+                "application/octet-stream",
+                {"X-Sample-Lengths": lengths},
+            )
+        elif endpoint == SHARDS_DIR_NAME and len(rest) == 1:
+            # only plain file names inside the shards directory
+            file_path = os.path.join(catalog.shards_dir, os.path.basename(rest[0]))
+            if rest[0] != os.path.basename(rest[0]) or not os.path.isfile(file_path):
+                raise KeyError(rest[0])
+            self._send_file(file_path)
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, f"Unknown endpoint {endpoint}")
+
+
+def start_server(
+    host: str = "127.0.0.1",
+    port: int = DEFAULT_PORT,
+    processed_dir: str = paths.PROCESSED_DIR,
+    cache_bytes: int = DEFAULT_CACHE_BYTES,
+) -> DatasetServer:
+    """
+    Starts a server in a background thread; port 0 picks a free port.
+
+    Returns:
+        DatasetServer: The running server (its address is `server.server_address`).
+                       Stop it with `server.shutdown()` and `server.server_close()`.
+    """
+    server = DatasetServer((host, port), processed_dir, cache_bytes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class DatasetClient:
+    """
+    Client of a `DatasetServer`. Every thread keeps its own keep-alive connection.
+
+        client = DatasetClient("http://node-1:8080")
+        index = client.get_index("cifar10", "training")
+        images = client.get_batch("cifar10", "training", [0, 1, 2])
+    """
+
+    def __init__(self, base_url: str, timeout: float = 60.0, retries: int = 2):
+        url = urllib.parse.urlsplit(base_url)
+        if url.scheme != "http":
+            raise ValueError(f"Only http:// servers are supported, got {base_url}")
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.timeout = timeout
+        self.retries = retries
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+            self._local.connection = connection
+        return connection
+
+    def request(self, path: str, headers=None):
+        """
+        Sends a GET request, reconnecting once a kept-alive connection was dropped.
+
+        Returns:
+            Tuple[int, dict, bytes]: The status, the response headers and the body.
+        """
+        for attempt in range(self.retries + 1):
+            connection = self._connection()
+            try:
+                connection.request("GET", path, headers=headers or {})
+                response = connection.getresponse()
+                body = response.read()
+                return response.status, dict(response.getheaders()), body
+            except (http.client.HTTPException, ConnectionError, TimeoutError):
+                connection.close()
+                self._local.connection = None
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.1 * (attempt + 1))
+
+    def _get(self, path: str, headers=None, expected=(HTTPStatus.OK,)):
+        status, response_headers, body = self.request(path, headers)
+        if status not in expected:
+            raise OSError(f"GET {path} failed with {status}: {body[:200]!r}")
+        return response_headers, body
+
+    @staticmethod
+    def _split_path(dataset_name: str, split_name: str, *parts) -> str:
+        return "/" + "/".join(
+            urllib.parse.quote(part, safe="")
+            for part in ("datasets", dataset_name, split_name) + parts
+        )
+
+    def list_datasets(self) -> list:
+        return json.loads(self._get("/datasets")[1])
+
+    def get_index(self, dataset_name: str, split_name: str) -> dict:
+        """Returns {"ids": [...], "labels": [...], "class_names": [...]} of a split."""
+        return json.loads(self._get(self._split_path(dataset_name, split_name, "index"))[1])
+
+    def get_sample(self, dataset_name: str, split_name: str, sample_id: str):
+        """Returns the encoded bytes and the label of a sample."""
+        headers, body = self._get(
+            self._split_path(dataset_name, split_name, "samples", sample_id)
+        )
+        return body, headers.get("X-Label")
+
+    def get_batch(self, dataset_name: str, split_name: str, indices) -> list:
+        """Returns the encoded bytes of several samples, in the order of `indices`."""
+        path = self._split_path(dataset_name, split_name, "batch")
+        path += "?indices=" + ",".join(str(int(idx)) for idx in indices)
+        headers, body = self._get(path)
+        samples, offset = [], 0
+        for length in (int(n) for n in headers["X-Sample-Lengths"].split(",") if n):
+            samples.append(body[offset:offset + length])
+            offset += length
+        return samples
+
+    def get_shard_range(
+        self, dataset_name: str, split_name: str, file_name: str, offset: int, length: int
+    ) -> bytes:
+        """Reads `length` bytes at `offset` of a file in the shards directory of a split."""
+        path = self._split_path(dataset_name, split_name, SHARDS_DIR_NAME, file_name)
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        return self._get(path, headers, expected=(HTTPStatus.PARTIAL_CONTENT,))[1]
+
+    def get_stats(self) -> dict:
+        return json.loads(self._get("/stats")[1])
+
+    def close(self) -> None:
+        """Closes the connection of the calling thread."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the processed datasets over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to serve remotely.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--processed-dir", default=paths.PROCESSED_DIR)
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_CACHE_BYTES // 2**20)
+    args = parser.parse_args()
+
+    server = DatasetServer(
+        (args.host, args.port), args.processed_dir, args.cache_mb * 2**20
+    )
+    print(f"Serving {args.processed_dir} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
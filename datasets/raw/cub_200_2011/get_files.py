@@ -17,7 +17,7 @@ os.makedirs(download_location, exist_ok=True)
 def download_dataset(url, dataset_path):
     response = requests.get(url, stream=True)
     total_size_in_bytes = int(response.headers.get("content-length", 0))
-    block_size = 1024  # 1 Kibibyte
+    block_size = 1024 * 1024  # 1 Mebibyte
     progress_bar = tqdm(total=total_size_in_bytes, unit="iB", unit_scale=True)
     with open(dataset_path, "wb") as file:
         for data in response.iter_content(block_size):
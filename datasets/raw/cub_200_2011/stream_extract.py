@@ -0,0 +1,194 @@
+"""
+Streams the CUB-200-2011 archive straight into the processed split directories.
+
+The archive is decompressed as it is read (from the download URL or from a local
+.tgz file) and every image is written directly to
+`processed/cub_200_2011/<split>/<label>/<file>` according to train_test_split.json.
+Neither the archive nor the extracted `images/` tree is ever stored on disk. The images
+are extracted into a temporary sibling directory (`processed/cub_200_2011.tmp`) and its
+split directories are only swapped in for the existing ones once the whole stream was
+read, so a failed download leaves the existing dataset untouched and a finished one
+leaves no images of an earlier split behind.
+
+    python stream_extract.py                      # stream from the download URL
+    python stream_extract.py path/to/CUB_200_2011.tgz
+"""
+
+import os
+import sys
+import json
+import shutil
+import tarfile
+from pathlib import PurePosixPath
+
+import requests
+from tqdm import tqdm
+
+# make the repository level modules importable when run from this directory
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+import paths  # noqa: E402
+from instrumentation import track_stage  # noqa: E402
+from materialize import SPLIT_MANIFEST_FILE_NAME, write_split_manifest  # noqa: E402
+
+URL = "https://data.caltech.edu/records/65de6-vp158/files/CUB_200_2011.tgz?download=1"
+PROCESSED_DIR = os.path.join(paths.PROCESSED_DIR, "cub_200_2011")
+TRAIN_TEST_SPLIT_FILE = os.path.join(
+    paths.RAW_DIR, "cub_200_2011", "train_test_split.json"
+)
+
+# split names used in train_test_split.json -> processed split directory names
+SPLIT_DIR_NAMES = {"train": "training", "test": "testing"}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class ProgressReader:
+    """File-like wrapper that reports the number of bytes read to a progress bar."""
+
+    def __init__(self, file, progress_bar):
+        self.file = file
+        self.progress_bar = progress_bar
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.progress_bar.update(len(data))
+        return data
+
+
+def load_split_assignment(split_file=TRAIN_TEST_SPLIT_FILE):
+    """Returns {file_name: processed split directory name} from train_test_split.json."""
+    with open(split_file, "r") as file:
+        data = json.load(file)
+    return {
+        file_name: SPLIT_DIR_NAMES.get(split_name, split_name)
+        for split_name, file_names in data.items()
+        for file_name in file_names
+    }
+
+
+def swap_split_dirs(staging_dir, output_dir, split_names) -> None:
+    """
+    Replaces the split directories of `output_dir` with those extracted to
+    `staging_dir`. The old directory is renamed aside before the new one is renamed into
+    place, and only deleted afterwards.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    for split_name in split_names:
+        split_path = os.path.join(output_dir, split_name)
+        old_path = f"{split_path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(split_path):
+            os.replace(split_path, old_path)
+        staged_path = os.path.join(staging_dir, split_name)
+        if os.path.exists(staged_path):
+            os.replace(staged_path, split_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def extract_to_splits(fileobj, split_assignment, output_dir=PROCESSED_DIR):
+    """
+    Reads a gzipped tar stream and writes every assigned image into its split directory.
+
+    Members are processed in archive order with tarfile's streaming mode ("r|gz"), so
+    the stream never needs to be seekable. The images are extracted into
+    `<output_dir>.tmp` and the split directories of `split_assignment` are only
+    replaced once the stream was read completely; on an error the staged images are
+    removed and the existing splits are kept. The manifest records the final absolute
+    path of every extracted image as its source.
+
+    Args:
+        fileobj: A readable binary stream of the .tgz archive.
+        split_assignment (dict): {file_name: split directory name}.
+        output_dir (str): The processed dataset directory.
+
+    Returns:
+        dict: The number of written and skipped images.
+    """
+    counts = {"written": 0, "skipped": 0}
+    manifest_rows = []
+    output_dir = os.path.abspath(output_dir)
+    staging_dir = f"{output_dir}.tmp"
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        _extract_members(
+            fileobj, split_assignment, output_dir, staging_dir, counts, manifest_rows
+        )
+        swap_split_dirs(staging_dir, output_dir, sorted(set(split_assignment.values())))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    write_split_manifest(os.path.join(output_dir, SPLIT_MANIFEST_FILE_NAME), manifest_rows)
+    return counts
+
+
+def _extract_members(fileobj, split_assignment, output_dir, staging_dir, counts, rows):
+    """Streams the assigned images of the archive into `staging_dir`."""
+    created_dirs = set()
+    with track_stage("cub_200_2011.stream_extract", quiet=True) as stage, tarfile.open(
+        fileobj=fileobj, mode="r|gz"
+    ) as tar:
+        for member in tar:
+            member_path = PurePosixPath(member.name)
+            # images are stored as <root>/images/<label>/<file>
+            if (
+                not member.isfile()
+                or len(member_path.parts) < 3
+                or member_path.parts[-3] != "images"
+                or not member_path.name.lower().endswith((".jpg", ".jpeg"))
+            ):
+                continue
+            split_name = split_assignment.get(member_path.name)
+            if split_name is None:
+                counts["skipped"] += 1
+                stage.skip()
+                continue
+            label = member_path.parts[-2]
+            staged_dir = os.path.join(staging_dir, split_name, label)
+            if staged_dir not in created_dirs:
+                os.makedirs(staged_dir, exist_ok=True)
+                created_dirs.add(staged_dir)
+            with tar.extractfile(member) as source, open(
+                os.path.join(staged_dir, member_path.name), "wb"
+            ) as file:
+                shutil.copyfileobj(source, file, CHUNK_SIZE)
+            destination = os.path.join(output_dir, split_name, label, member_path.name)
+            rows.append([member_path.name, label, split_name, destination])
+            counts["written"] += 1
+            stage.add(bytes_written=member.size)
+
+
+def stream_dataset(source=URL, output_dir=PROCESSED_DIR, split_file=TRAIN_TEST_SPLIT_FILE):
+    """
+    Streams the archive from a URL or a local file into the processed split directories.
+
+    Returns:
+        dict: The number of written and skipped images.
+    """
+    split_assignment = load_split_assignment(split_file)
+    if source.startswith(("http://", "https://")):
+        with requests.get(source, stream=True) as response:
+            response.raise_for_status()
+            total_size = int(response.headers.get("content-length", 0))
+            with tqdm(total=total_size, unit="iB", unit_scale=True) as progress_bar:
+                counts = extract_to_splits(
+                    ProgressReader(response.raw, progress_bar), split_assignment, output_dir
+                )
+    else:
+        with open(source, "rb") as file, tqdm(
+            total=os.path.getsize(source), unit="iB", unit_scale=True
+        ) as progress_bar:
+            counts = extract_to_splits(
+                ProgressReader(file, progress_bar), split_assignment, output_dir
+            )
+    print(
+        f"Wrote {counts['written']} images to {output_dir} "
+        f"({counts['skipped']} images not in the split file were skipped)"
+    )
+    return counts
+
+
+if __name__ == "__main__":
+    stream_dataset(sys.argv[1] if len(sys.argv) > 1 else URL)
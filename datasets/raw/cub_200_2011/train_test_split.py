@@ -1,9 +1,22 @@
 import os
-import json
-import shutil
+import sys
+import argparse
 from tqdm import tqdm
 from pathlib import Path
-from sklearn.model_selection import train_test_split
+
+# make the repository level modules importable when run from this directory
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+import paths  # noqa: E402
+from file_cache import get_file_cache  # noqa: E402
+from materialize import Materializer  # noqa: E402
+from splitter import (  # noqa: E402
+    grouped_stratified_split,
+    read_split_json,
+    write_split_json,
+)
 
 DATA_DIR = os.path.join(paths.RAW_DIR, "cub_200_2011", "data", "cub_200_2011", "images")
 PROCESSED_DIR = os.path.join(paths.PROCESSED_DIR, "cub_200_2011")
@@ -13,69 +26,89 @@ TRAIN_TEST_SPLIT_FILE = os.path.join(
 
 TEST_SIZE = 0.2
 
+SPLIT_NAMES = ["training", "testing"]
 
-def list_directories(root_dir):
-    directories = []
-    for root, dirs, _ in os.walk(root_dir):
-        for dir_name in dirs:
-            directories.append(os.path.join(root, dir_name))
-    return directories
+# split names used in train_test_split.json
+SPLIT_FILE_NAMES = ["train", "test"]
+
+# how images are placed into the processed split directories:
+# copy, hardlink, symlink, reflink or manifest (see materialize.py)
+MATERIALIZE_MODE = "hardlink"
 
 
 def get_file_names_and_labels():
-    class_labels = [Path(i).name for i in list_directories(DATA_DIR)]
-    class_labels = sorted(class_labels)
+    files = get_file_cache().list_files(DATA_DIR, suffixes=(".jpg", ".jpeg"))
+    data_dir = os.path.abspath(DATA_DIR)
 
     X = []
     y = []
 
-    for label in class_labels:
-        images_dir_path = os.path.join(DATA_DIR, label)
-
-        images_files_names = [
-            i
-            for i in os.listdir(images_dir_path)
-            if i.lower().endswith(".jpg") or i.lower().endswith(".jpeg")
-        ]
-        images_files_paths = [
-            os.path.join(images_dir_path, i) for i in images_files_names
-        ]
-        images_files_paths = sorted(images_files_paths)
-
-        X.extend(images_files_paths)
-        y += [label] * len(images_files_paths)
+    # images are stored as <DATA_DIR>/<label>/<file>, sorted by label then file name
+    for images_file_path, _, _ in files:
+        label_dir = os.path.dirname(images_file_path)
+        if os.path.dirname(label_dir) == data_dir:
+            X.append(images_file_path)
+            y.append(Path(label_dir).name)
 
     return X, y
 
 
-def create_split_json_file(X_train, X_test):
-    train_files = [Path(i).name for i in X_train]
-    test_files = [Path(i).name for i in X_test]
-    data = {"train": train_files, "test": test_files}
-    with open(TRAIN_TEST_SPLIT_FILE, "w") as file:
-        json.dump(data, file)
+def create_split_json_file(X, split_idx):
+    write_split_json(TRAIN_TEST_SPLIT_FILE, X, split_idx, SPLIT_FILE_NAMES)
 
     print("train_test_split.json created successfully!")
 
 
-def copy_file(file_path, split_name, class_label):
-    destination_path = f"{PROCESSED_DIR}/{split_name}/{class_label}"
-    os.makedirs(destination_path, exist_ok=True)
-    shutil.copy(file_path, destination_path)
+def get_split_idx(X, y, resplit=False):
+    """
+    Returns the split index of every image and whether the split is new.
+
+    The committed train_test_split.json (which the published test key was built from)
+    is kept as long as it covers every image; a new split is only computed with
+    `resplit` or when images are missing from it.
+    """
+    if not resplit and os.path.exists(TRAIN_TEST_SPLIT_FILE):
+        split_idx = read_split_json(TRAIN_TEST_SPLIT_FILE, X, SPLIT_FILE_NAMES)
+        if split_idx is not None:
+            print("Keeping the split of train_test_split.json")
+            return split_idx, False
+        print("train_test_split.json does not cover every image, creating a new split")
+
+    # stratified by class; every image is its own group, keyed by its file name
+    split_idx = grouped_stratified_split(
+        y,
+        ratios=(1 - TEST_SIZE, TEST_SIZE),
+        seed=42,
+        ids=[os.path.basename(file_path) for file_path in X],
+    )
+    return split_idx, True
 
 
 if __name__ == "__main__":
-
-    X, y = get_file_names_and_labels()
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=TEST_SIZE, stratify=y, random_state=42
+    parser = argparse.ArgumentParser(
+        description="Splits CUB-200-2011 into the processed training and testing directories."
     )
+    parser.add_argument(
+        "--resplit",
+        action="store_true",
+        help="compute a new split instead of keeping train_test_split.json",
+    )
+    args = parser.parse_args()
 
-    for file_path, label in tqdm(zip(X_train, y_train), desc="Copying train files..."):
-        copy_file(file_path=file_path, split_name="training", class_label=label)
-
-    for file_path, label in tqdm(zip(X_test, y_test), desc="Copying test files..."):
-        copy_file(file_path=file_path, split_name="testing", class_label=label)
-
-    create_split_json_file(X_train, X_test)
+    X, y = get_file_names_and_labels()
+    split_idx, is_new_split = get_split_idx(X, y, resplit=args.resplit)
+
+    with Materializer(PROCESSED_DIR, mode=MATERIALIZE_MODE) as materializer:
+        for split_name in SPLIT_NAMES:
+            split_files = [
+                (file_path, label)
+                for file_path, label, idx in zip(X, y, split_idx)
+                if SPLIT_NAMES[idx] == split_name
+            ]
+            for file_path, label in tqdm(
+                split_files, desc=f"Materializing {split_name} files..."
+            ):
+                materializer.add(file_path, split_name=split_name, class_label=label)
+
+    if is_new_split:
+        create_split_json_file(X, split_idx)
@@ -1,9 +1,19 @@
 import os
+import sys
 
+# make the repository level modules (paths, materialize, ...) importable when the
+# scripts are run from this directory
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
 
-# root directory where raw and processed data is stored for all datasets
-RAW_DIR = os.path.join(".", "..", "..", "raw")
-PROCESSED_DIR = os.path.join(".", "..", "..", "processed")
+import paths  # noqa: E402
+
+
+# root directory where raw and processed data is stored for all datasets; resolved from
+# the repository root so the scripts work from any working directory
+RAW_DIR = paths.RAW_DIR
+PROCESSED_DIR = paths.PROCESSED_DIR
 
 
 # URL from where the data is downloaded
@@ -13,9 +23,25 @@ BASE_URL = 'https://lesc.dinfo.unifi.it/VISION/dataset/'
 # the directory structure of the dataset
 FOLDER_MAP_FILE = os.path.join(RAW_DIR, "vision", "folder_map.txt")
 
+# sqlite index of every image file listed in the folder map, built from FOLDER_MAP_FILE
+# and used to plan downloads, splits and counts without re-parsing or re-walking
+FILE_INDEX_FILE = os.path.join(RAW_DIR, "vision", "file_index.sqlite")
+
 # directory where raw Vision data is downloaded from the BASE _URL above
 RAW_DATA_DIR = os.path.join(RAW_DIR, "vision", "data")
 
+# file recording the size and checksum of every completed download, so interrupted
+# downloads can be resumed without fetching the same files again
+DOWNLOAD_MANIFEST_FILE = os.path.join(RAW_DATA_DIR, ".download_manifest.csv")
+
+# number of concurrent downloads (and pooled HTTP connections)
+DOWNLOAD_WORKERS = 16
+
+# attempts per file before giving up, and the base delay (seconds) of the exponential
+# backoff between attempts
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 1.0
+
 # directories where processed data is stored
 AI_GENERATED_DIR_NAMES = ["G01_Photoshop_Generative"]
 
@@ -34,6 +60,10 @@ VALIDATION_SIZE = 0.1
 # effectively, we get 70%/10%/20% split for train/valid/test.
 TEST_SIZE = 2 / 9
 
+# how images are placed into the processed split directories:
+# copy, hardlink, symlink, reflink or manifest (see materialize.py)
+MATERIALIZE_MODE = "hardlink"
+
 # file where the list of image files that go into each split is saved
 TRAIN_TEST_SPLIT_FILE = os.path.join(RAW_DIR, "vision", "train_test_split.json")
 TRAIN_TEST_SPLIT_CSV_FILE = os.path.join(RAW_DIR, "vision", "train_test_split.csv")
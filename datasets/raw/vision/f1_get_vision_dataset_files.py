@@ -1,76 +1,267 @@
 import os
+import csv
+import time
 import shutil
-import requests
+import hashlib
+import itertools
+import threading
+import urllib.parse
 import concurrent.futures
-import time
 
-from constants import BASE_URL, RAW_DATA_DIR, FOLDER_MAP_FILE
+import requests
+from requests.adapters import HTTPAdapter
 
+from constants import (
+    BASE_URL,
+    RAW_DATA_DIR,
+    DOWNLOAD_MANIFEST_FILE,
+    DOWNLOAD_WORKERS,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_BACKOFF,
+)
+from folder_map import iter_folder_map, query_file_index
+from instrumentation import track_stage
+from verify_images import check_markers
+
+CHUNK_SIZE = 1024 * 1024
 
-def is_image_file(line):
-    """ Check if the line represents an image file. """
-    return line.strip().endswith('.jpg')
 
 def create_directory(path):
     """ Create a directory if it does not exist. """
     if not os.path.exists(path):
         os.makedirs(path)
 
-def download_file(url, path):
-    """ Download a file from a given URL to a specified path. """
+
+def create_session(pool_size=DOWNLOAD_WORKERS):
+    """ Create an HTTP session whose connection pool can serve `pool_size` threads. """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class DownloadManifest:
+    """
+    Append-only record of completed downloads (relative path, size and sha256).
+
+    Every completed file is written and flushed immediately, so an interrupted run
+    can be resumed from the manifest.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(file_path):
+            with open(file_path, 'r', newline='') as file:
+                for row in csv.DictReader(file):
+                    self.entries[row['relative_path']] = (int(row['size']), row['sha256'])
+        create_directory(os.path.dirname(file_path))
+        is_new_file = not os.path.exists(file_path)
+        self._file = open(file_path, 'a', newline='')
+        self._writer = csv.writer(self._file)
+        if is_new_file:
+            self._writer.writerow(['relative_path', 'size', 'sha256'])
+            self._file.flush()
+
+    def is_complete(self, relative_path, path, verify_checksum=False):
+        """ Check if a file was downloaded before and is still intact on disk. """
+        entry = self.entries.get(relative_path)
+        if entry is None or not os.path.exists(path):
+            return False
+        size, sha256 = entry
+        if os.path.getsize(path) != size:
+            return False
+        return not verify_checksum or file_sha256(path) == sha256
+
+    def add(self, relative_path, size, sha256):
+        with self._lock:
+            self.entries[relative_path] = (size, sha256)
+            self._writer.writerow([relative_path, size, sha256])
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def file_sha256(path):
+    """ Compute the sha256 checksum of a file. """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_file(session, url, path, retries=DOWNLOAD_RETRIES, backoff=DOWNLOAD_BACKOFF):
+    """
+    Download a file from a given URL to a specified path.
+
+    The file is streamed into a temporary `.part` file which is only renamed to `path`
+    once it is complete and its JPEG markers are intact (see verify_images.py). Failed
+    attempts are retried with exponential backoff.
+
+    Returns:
+        Tuple[int, str]: The size and the sha256 checksum of the downloaded file.
+    """
+    tmp_path = f"{path}.part"
+    for attempt in range(retries):
+        try:
+            with session.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                expected_size = int(response.headers.get('content-length', -1))
+                digest = hashlib.sha256()
+                size = 0
+                with open(tmp_path, 'wb') as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        file.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            if expected_size >= 0 and size != expected_size:
+                raise IOError(f"Incomplete download: {size} of {expected_size} bytes")
+            if path.lower().endswith(('.jpg', '.jpeg')):
+                status = check_markers(tmp_path)
+                if status != 'ok':
+                    raise IOError(f"Downloaded image is {status}")
+            os.replace(tmp_path, path)
+            return size, digest.hexdigest()
+        except (requests.RequestException, IOError) as e:
+            is_client_error = (
+                isinstance(e, requests.HTTPError)
+                and e.response is not None
+                and 400 <= e.response.status_code < 500
+                and e.response.status_code != 429
+            )
+            if is_client_error or attempt == retries - 1:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def adopt_existing_file(session, url, path):
+    """
+    Check if a file that is on disk but not in the manifest (e.g. downloaded before the
+    manifest existed) is complete: its size must match the server's Content-Length and
+    a JPEG must have intact markers.
+
+    Returns:
+        Optional[Tuple[int, str]]: The size and sha256 checksum of the file, or None if
+                                   it has to be downloaded again.
+    """
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with open(path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=32768):
-                    file.write(chunk)
-            return f"Downloaded {url}"
+        with session.head(url, allow_redirects=True, timeout=60) as response:
+            response.raise_for_status()
+            expected_size = int(response.headers.get('content-length', -1))
+    except (requests.RequestException, ValueError):
+        return None
+    size = os.path.getsize(path)
+    if expected_size < 0 or size != expected_size:
+        return None
+    if path.lower().endswith(('.jpg', '.jpeg')) and check_markers(path) != 'ok':
+        return None
+    return size, file_sha256(path)
+
+
+def download_files(
+    download_tasks,
+    save_path,
+    manifest_file=DOWNLOAD_MANIFEST_FILE,
+    workers=DOWNLOAD_WORKERS,
+    retries=DOWNLOAD_RETRIES,
+    backoff=DOWNLOAD_BACKOFF,
+    verify_checksums=False,
+):
+    """
+    Download files concurrently, skipping the ones already recorded in the manifest.
+
+    Files on disk without a manifest entry are checked against the server's
+    Content-Length (see `adopt_existing_file`) and recorded instead of downloaded again
+    when they are complete.
+
+    Args:
+        download_tasks (List[Tuple[str, str]]): (url, relative path) of each file.
+        save_path (str): Directory under which the relative paths are saved.
+        manifest_file (str): Path of the manifest of completed downloads.
+        workers (int): Number of concurrent downloads.
+        retries (int): Attempts per file before giving up.
+        backoff (float): Base delay in seconds between attempts.
+        verify_checksums (bool): Re-hash files found in the manifest instead of only
+                                 comparing their size.
+
+    Returns:
+        Tuple[int, int, List[str]]: Number of downloaded files, number of skipped
+                                    files and the URLs that failed.
+    """
+    manifest = DownloadManifest(manifest_file)
+    pending = []
+    skipped = 0
+    for url, relative_path in download_tasks:
+        path = os.path.join(save_path, *relative_path.split('/'))
+        if manifest.is_complete(relative_path, path, verify_checksum=verify_checksums):
+            skipped += 1
         else:
-            return f"Error {response.status_code} at {url}"
-    except Exception as e:
-        return f"Exception downloading {url}: {e}"
+            pending.append((url, relative_path, path))
+
+    for directory in {os.path.dirname(path) for _, _, path in pending}:
+        create_directory(directory)
 
+    def download(url, relative_path, path):
+        if relative_path not in manifest.entries and os.path.exists(path):
+            existing = adopt_existing_file(session, url, path)
+            if existing is not None:
+                manifest.add(relative_path, *existing)
+                stage.skip()
+                return False
+        size, sha256 = download_file(session, url, path, retries=retries, backoff=backoff)
+        manifest.add(relative_path, size, sha256)
+        stage.add(bytes_written=size)
+        return True
 
-def process_folder_map(file_path, base_url, save_path, max_files=500):
+    downloaded = 0
+    failed = []
+    session = create_session(pool_size=workers)
+    try:
+        with track_stage("vision.download", total=len(pending), progress=True) as stage:
+            stage.skip(skipped)
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                future_to_url = {
+                    executor.submit(download, url, relative_path, path): url
+                    for url, relative_path, path in pending
+                }
+                for future in concurrent.futures.as_completed(future_to_url):
+                    url = future_to_url[future]
+                    try:
+                        if future.result():
+                            downloaded += 1
+                        else:
+                            skipped += 1
+                    except Exception as e:
+                        failed.append(url)
+                        stage.error()
+                        print(f"Error downloading {url}: {e}")
+    finally:
+        session.close()
+        manifest.close()
+
+    print(f"Downloaded {downloaded} files, skipped {skipped}, failed {len(failed)}")
+    return downloaded, skipped, failed
+
+
+def build_download_tasks(records, base_url, max_files=None):
+    """ Returns the (url, relative path) download task of each folder map record. """
+    records = itertools.islice(records, max_files)
+    return [
+        (urllib.parse.urljoin(base_url, record.relative_path), record.relative_path)
+        for record in records
+    ]
+
+
+def process_folder_map(file_path, base_url, save_path, max_files=500, **download_kwargs):
     """ Process the folder map and download images using multithreading. """
-    current_path = []
-    download_tasks = []
-    with open(file_path, 'r') as file:
-        for line in file:
-            if '|--' in line:
-                depth = line.index('|--') // 2
-                folder_name = line.split('--')[-1].strip()
-                current_path = current_path[:depth] + [folder_name]
-
-                if 'videos' in line:  # Skip processing video folders and their contents
-                    current_path = current_path[:-1]
-        
-            if is_image_file(line):
-                relative_file_path = os.path.join(*current_path)
-                full_url = os.path.join(base_url, relative_file_path)
-                full_url = full_url.replace("\\", "/")
-                    
-                full_path = os.path.join(save_path, relative_file_path)
-                create_directory(os.path.dirname(full_path))
-                download_tasks.append((full_url, full_path))
-                if len(download_tasks) >= max_files:
-                    break
-                else:
-                    current_path = current_path[:depth] + [folder_name]
-
-    # Download files using multiple threads
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_url = {executor.submit(download_file, url, path): url for url, path in download_tasks}
-        for future in concurrent.futures.as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                result = future.result()
-                if result.startswith("Error"):
-                    print(result)
-                else:
-                    print(f"{result} downloaded")
-            except Exception as e:
-                print(f"Error downloading {url}: {e}")
+    download_tasks = build_download_tasks(iter_folder_map(file_path), base_url, max_files)
+    return download_files(download_tasks, save_path, **download_kwargs)
 
 
 def clear_data_folders(dir_path: str) -> None:
@@ -93,19 +284,32 @@ def clear_data_folders(dir_path: str) -> None:
         print(f"Created {dir_path} directory.")
 
 
-def download_vision_data(max_files=500):
-    """ Download the vision data from the specified URL. """
-    # Create the data directory if it does not exist
-    clear_data_folders(RAW_DATA_DIR)
+def download_vision_data(
+    max_files=500, workers=DOWNLOAD_WORKERS, clean=False, devices=None, sub_folders=None
+):
+    """
+    Download the vision data from the specified URL.
+
+    Files already recorded in the download manifest are skipped, so an interrupted run
+    resumes where it stopped. Pass `clean=True` to wipe the data directory first.
+    The files to download are selected from the folder map index, optionally restricted
+    to some `devices` and `sub_folders` (e.g. ["flat", "nat"]).
+
+    Returns:
+        Tuple[int, int, List[str]]: See `download_files`.
+    """
+    if clean:
+        clear_data_folders(RAW_DATA_DIR)
+    else:
+        create_directory(RAW_DATA_DIR)
+
+    records = query_file_index(devices=devices, sub_folders=sub_folders, limit=max_files)
+    download_tasks = build_download_tasks(records, BASE_URL)
 
-    # Download the vision data
-    start_time = time.time()  # Start timer
-    process_folder_map(FOLDER_MAP_FILE, BASE_URL, RAW_DATA_DIR, max_files=max_files)
-    end_time = time.time()  # End timer
-    elapsed_time = end_time - start_time
-    print(f"Time taken: {elapsed_time / 60:.2f} minutes")
+    # Download the vision data (timed by the "vision.download" stage)
+    return download_files(download_tasks, RAW_DATA_DIR, workers=workers)
 
 
-if __name__ == "__main__":    
+if __name__ == "__main__":
     max_files = 500000 # this was used during testing of this script with a small number of files
-    download_vision_data(max_files=max_files)
\ No newline at end of file
+    download_vision_data(max_files=max_files)
@@ -4,32 +4,53 @@ This script is used to generate the train, validation and test splits for the Vi
 For images in "nat", "natFBH", "natFBL", and "natWA" - we ensured that the original image 
 from "nat" and its three variations in "natFBH", "natFBL", "natWA" are always retained 
 within the same split. This is done to avoid training data leakage into validation and testing 
-splits.
+splits. All five sub-folders are split together by `splitter.grouped_stratified_split`,
+using the name of the "nat" original as the group key of each variation.
 
 The images in "flat" are split randomly into three sets (i.e. there is no special handling
 for them). 
+
+When a previous split exists (train_test_split.csv), the script runs incrementally by
+default: images that were already assigned keep their split, new images follow their group
+or are assigned deterministically from a hash of their group key, and only the files whose
+assignment or source changed are added, removed, moved or updated in the processed
+directory.
 """
 
 import os
+import csv
 import shutil
-import random
-from pathlib import Path
+import hashlib
 
 from tqdm import tqdm
-from sklearn.model_selection import train_test_split
 
 from constants import (
     RAW_DATA_DIR,
     PROCESSED_VISION_DIR,
     VALIDATION_SIZE,
     TEST_SIZE,
-    TRAIN_TEST_SPLIT_CSV_FILE
+    TRAIN_TEST_SPLIT_CSV_FILE,
+    MATERIALIZE_MODE,
 )
+from file_cache import get_file_cache
+from folder_map import list_downloaded_files, list_indexed_devices
+from instrumentation import track_stage
+from materialize import Materializer, sync_split_dirs
+from splitter import grouped_stratified_split, vision_group_key, write_split_csv
+
+SPLIT_NAMES = ["training", "validation", "testing"]
 
-random.seed(42)
+# 70/10/20 for train/valid/test, see constants.py
+SPLIT_RATIOS = (
+    (1 - VALIDATION_SIZE) * (1 - TEST_SIZE),
+    VALIDATION_SIZE,
+    (1 - VALIDATION_SIZE) * TEST_SIZE,
+)
 
+IMAGE_SUB_DIRS = ["flat", "nat", "natFBH", "natFBL", "natWA"]
 
-def get_file_names_and_labels():
+
+def get_file_names_and_labels(sub_dirs=IMAGE_SUB_DIRS):
     class_labels = [
         i
         for i in os.listdir(RAW_DATA_DIR)
@@ -37,23 +58,36 @@ def get_file_names_and_labels():
     ]
     class_labels = sorted(class_labels)
 
+    # devices listed in folder_map.txt are read from the file index; folders added by
+    # hand (e.g. the AI generated images) are listed through the shared file cache
+    indexed_devices = set(list_indexed_devices())
+    indexed_labels = [i for i in class_labels if i in indexed_devices]
+    indexed_files = {}
+    for record in list_downloaded_files(RAW_DATA_DIR, indexed_labels, sub_dirs):
+        path = os.path.join(RAW_DATA_DIR, *record.relative_path.split("/"))
+        indexed_files.setdefault(record.device, []).append(path)
+
+    file_cache = get_file_cache()
+
     X = []
     y = []
 
     for label in class_labels:
-        images_dir_path = os.path.join(RAW_DATA_DIR, label, "images")
+        if label in indexed_devices:
+            images_files_paths = indexed_files.get(label, [])
+            X.extend(images_files_paths)
+            y += [label] * len(images_files_paths)
+            continue
 
-        sub_dirs = ["flat", "nat"]
+        images_dir_path = os.path.join(RAW_DATA_DIR, label, "images")
 
         sub_dirs_paths = [os.path.join(images_dir_path, i) for i in sub_dirs]
         for path in sub_dirs_paths:
-            images_files_names = [
-                i
-                for i in os.listdir(path)
-                if i.lower().endswith(".jpg") or i.lower().endswith(".jpeg")
+            images_files_paths = [
+                file_path
+                for file_path, _, _ in file_cache.list_files(path, suffixes=(".jpg", ".jpeg"))
+                if os.path.dirname(file_path) == os.path.abspath(path)
             ]
-            images_files_paths = [os.path.join(path, i) for i in images_files_names]
-            images_files_paths = sorted(images_files_paths)
 
             X.extend(images_files_paths)
             y += [label] * len(images_files_paths)
@@ -61,75 +95,7 @@ def get_file_names_and_labels():
     return X, y
 
 
-def is_segment_in_path(segment, path):
-    """
-    Check if the specified segment is a part of the given path.
-
-    Parameters:
-    - segment (str): The directory segment to check.
-    - path (str): The full path to check against.
-
-    Returns:
-    - bool: True if the segment is part of the path, False otherwise.
-    """
-    # Create a Path object for the path
-    path_obj = Path(path)
-
-    # Iterate through each part of the path to check if the segment exists
-    return segment in path_obj.parts
-
-
-def replace_segment_in_path(original_path, old_segment, new_segment):
-    """
-    Replace an old segment with a new segment in the given path.
-
-    Parameters:
-    - original_path (str): The original path as a string.
-    - old_segment (str): The path segment to be replaced.
-    - new_segment (str): The new segment to replace the old one.
-
-    Returns:
-    - str: The modified path with the segment replaced.
-    """
-    # Break down the original path into its components
-    parts = list(Path(original_path).parts)
-
-    # Replace the old segment with the new segment where found
-    modified_parts = [new_segment if part == old_segment else part for part in parts]
-
-    # Reconstruct the path from the modified parts
-    # Use Path() to handle different OS path separators automatically
-    modified_path = Path(*modified_parts)
-
-    # Convert the Path object back to a string representation
-    return str(modified_path)
-
-
-def add_image_variations(X, y):
-    variations = ["natFBH", "natFBL", "natWA"]
-    for img_path, label in zip(X, y):
-        if is_segment_in_path("nat", img_path):
-            for v in variations:
-                variation_path = replace_segment_in_path(img_path, "nat", v)
-                variation_path = variation_path.replace("_nat_", f"_{v}_")
-                X.append(variation_path)
-                y.append(label)
-    return X, y
-
-
-def move_file(file_path, split_name, class_label):
-    destination_path = f"{PROCESSED_VISION_DIR}/{split_name}/{class_label}"
-    os.makedirs(destination_path, exist_ok=True)
-    shutil.move(file_path, destination_path)
-
-
-def copy_file(file_path, split_name, class_label):
-    destination_path = f"{PROCESSED_VISION_DIR}/{split_name}/{class_label}"
-    os.makedirs(destination_path, exist_ok=True)
-    shutil.copy(file_path, destination_path)
-
-
-def clear_data_folders(base_dir: str, split_name: str) -> None:
+def clear_data_folders(base_dir: str, split_name: str, recreate: bool = True) -> None:
     """
     Clears the contents of the training and testing directories within the specified base
     directory.
@@ -138,6 +104,9 @@ def clear_data_folders(base_dir: str, split_name: str) -> None:
         base_dir (str): The path to the base directory containing 'training', 'validation'
                         and 'testing' subdirectories.
         split_name (str): Training, validation, or testing.
+        recreate (bool): Create the (empty) directory again. Off in "manifest" mode, where
+                         the splits only exist in the manifest and an empty directory
+                         would be taken for an empty split.
 
     Returns:
         None: This function does not return a value but clears specified directories.
@@ -147,59 +116,116 @@ def clear_data_folders(base_dir: str, split_name: str) -> None:
     if os.path.exists(dir_path):
         # Remove the directory and its contents, then recreate the directory
         shutil.rmtree(dir_path)
-        os.makedirs(dir_path, exist_ok=True)
+        if recreate:
+            os.makedirs(dir_path, exist_ok=True)
         print(f"Cleared {split_name} directory.")
-    else:
+    elif recreate:
         # If the directory does not exist, create it
         os.makedirs(dir_path, exist_ok=True)
         print(f"Created {split_name} directory.")
 
 
-def write_split_file_names_to_csv(X, y, type_, new_file=False):
-    open_type = "w" if new_file else "a"
-    with open(TRAIN_TEST_SPLIT_CSV_FILE, open_type) as file:
-        if new_file:
-            file.write("file_name,label,type\n")
-        for file_name_and_path, label in zip(X, y):
-            file_name = filename = os.path.basename(file_name_and_path)
-            file.write(f"{file_name},{label},{type_}\n")
+def read_split_file_names_from_csv():
+    """Returns {file_name: split_name} from the split CSV file, or {} if it does not exist."""
+    if not os.path.exists(TRAIN_TEST_SPLIT_CSV_FILE):
+        return {}
+    with open(TRAIN_TEST_SPLIT_CSV_FILE, "r", newline="") as file:
+        return {row["file_name"]: row["type"] for row in csv.DictReader(file)}
+
 
-def create_train_valid_test_splits():
+def hash_split(group_key, seed=42):
+    """
+    Deterministically assigns a group to a split from a hash of its key, with the same
+    70/10/20 proportions as the full split. The assignment of a group never depends on
+    the other files, so adding images does not reshuffle existing ones.
+    """
+    digest = hashlib.md5(f"{seed}:{group_key}".encode()).digest()
+    fraction = int.from_bytes(digest[:8], "big") / 2 ** 64
+    if fraction < SPLIT_RATIOS[1]:
+        return "validation"
+    if fraction < SPLIT_RATIOS[1] + SPLIT_RATIOS[2]:
+        return "testing"
+    return "training"
+
+
+def assign_splits(X, y, previous_splits=None):
+    """
+    Returns the split index (into SPLIT_NAMES) of every file.
+
+    Without a previous split, all files are split by label, grouped by their "nat"
+    original. Otherwise files keep their previous split, new files join the split of
+    their group and files of new groups are hash-assigned.
+    """
+    groups = [vision_group_key(os.path.basename(file_path)) for file_path in X]
+    if not previous_splits:
+        return grouped_stratified_split(y, groups, ratios=SPLIT_RATIOS, seed=42)
+
+    group_splits = {}
+    for file_path, group in zip(X, groups):
+        previous_split = previous_splits.get(os.path.basename(file_path))
+        if previous_split is not None:
+            group_splits.setdefault(group, previous_split)
+    split_idx = []
+    for file_path, group in zip(X, groups):
+        split_name = (
+            previous_splits.get(os.path.basename(file_path))
+            or group_splits.get(group)
+            or hash_split(group)
+        )
+        split_idx.append(SPLIT_NAMES.index(split_name))
+    return split_idx
+
+
+def create_train_valid_test_splits(incremental=True):
 
     print("Reading image file names...")
     X, y = get_file_names_and_labels()
 
+    previous_splits = read_split_file_names_from_csv() if incremental else {}
+
     print("Performing train/valid/test splits of file names...")
-    X_train, X_valid, y_train, y_valid = train_test_split(
-        X, y, test_size=VALIDATION_SIZE, stratify=y, random_state=42
-    )
-
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_train, y_train, test_size=TEST_SIZE, stratify=y_train, random_state=42
-    )
-
-    X_train, y_train = add_image_variations(X_train, y_train)
-    X_valid, y_valid = add_image_variations(X_valid, y_valid)
-    X_test, y_test = add_image_variations(X_test, y_test)
-
-    splits = {
-        "training": (X_train, y_train),
-        "validation": (X_valid, y_valid),
-        "testing": (X_test, y_test),
-    }
-
-    for split_name, (X, y) in splits.items():
-        # Save file names to CSV file
-        new_file = True if split_name == "training" else False
-        write_split_file_names_to_csv(X, y, split_name, new_file=new_file)
-
-        # clear processed folders
-        print(f"Clearing previous processed {split_name} data (if any)...")
-        clear_data_folders(PROCESSED_VISION_DIR, split_name)
-
-        # copy files into processed folders
-        for file_path, label in tqdm(zip(X, y), desc=f"Copying {split_name} files..."):
-            copy_file(file_path=file_path, split_name=split_name, class_label=label)
+    split_idx = assign_splits(X, y, previous_splits)
+
+    # Save file names to CSV file
+    write_split_csv(TRAIN_TEST_SPLIT_CSV_FILE, X, y, split_idx, SPLIT_NAMES)
+
+    rows = [
+        (os.path.basename(file_path), label, SPLIT_NAMES[idx], file_path)
+        for file_path, label, idx in zip(X, y, split_idx)
+    ]
+
+    if previous_splits:
+        print("Synchronizing processed data with the new splits...")
+        with track_stage("vision.sync_splits", total=len(rows)) as stage:
+            counts = sync_split_dirs(PROCESSED_VISION_DIR, rows, mode=MATERIALIZE_MODE)
+            stage.add(
+                counts["added"] + counts["removed"] + counts["moved"] + counts["updated"]
+            )
+            stage.skip(counts["unchanged"])
+        print(
+            f"Added {counts['added']}, removed {counts['removed']}, moved {counts['moved']}, "
+            f"updated {counts['updated']} and kept {counts['unchanged']} files."
+        )
+    else:
+        with track_stage("vision.materialize", total=len(rows)) as stage, Materializer(
+            PROCESSED_VISION_DIR, mode=MATERIALIZE_MODE
+        ) as materializer:
+            for split_name in SPLIT_NAMES:
+                # clear processed folders
+                print(f"Clearing previous processed {split_name} data (if any)...")
+                clear_data_folders(
+                    PROCESSED_VISION_DIR,
+                    split_name,
+                    recreate=MATERIALIZE_MODE != "manifest",
+                )
+
+                # place files into processed folders
+                split_rows = [row for row in rows if row[2] == split_name]
+                for _, label, _, file_path in tqdm(
+                    split_rows, desc=f"Materializing {split_name} files..."
+                ):
+                    materializer.add(file_path, split_name=split_name, class_label=label)
+                    stage.add()
 
     print("Train, valid, and test splits performed successfully.")
 
@@ -4,6 +4,11 @@ It was used to verify that we get the same splits when the script is re-run.
 
 Also, the contents of the JSON file (actual splits) can be compared with the contents of the 
 CSV file (original intended splits). 
+
+The split lists are taken from the processed tree, so they record where the files
+actually are. When the processed dataset also has a split table (split_table.py), the
+tree is compared against it and differences are reported. Only a dataset materialized
+in "manifest" mode, which has no files to list, is read from the table.
 """
 
 import os
@@ -15,15 +20,13 @@ from constants import (
     RAW_DIR,
     PROCESSED_VISION_DIR
 )
+from file_cache import get_file_cache
+from split_table import SplitTable, get_split_table_dir, has_split_table
 
 
 def list_jpg_paths(directory):
-    paths = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith(".jpg"):
-                paths.append(os.path.join(root, file))
-    return paths
+    files = get_file_cache().list_files(directory, suffixes=(".jpg",))
+    return [path for path, _, _ in files if path.endswith(".jpg")]
 
 
 def file_info(file_path):
@@ -34,11 +37,42 @@ def file_info(file_path):
     return file_name, upper_dir
 
 
+def compare_with_split_table(files_info, table_info):
+    """Prints the files whose split in the processed tree differs from the split table."""
+    tree_splits = dict(files_info)
+    table_splits = dict(table_info)
+    differences = [
+        (file, tree_splits.get(file), table_splits.get(file))
+        for file in sorted(set(tree_splits) | set(table_splits))
+        if tree_splits.get(file) != table_splits.get(file)
+    ]
+    if not differences:
+        print("The processed tree matches the split table")
+        return
+    print(f"{len(differences)} files differ between the processed tree and split table:")
+    for file, tree_split, table_split in differences[:10]:
+        print(
+            f"  {file}: {tree_split or 'missing'} in the tree, "
+            f"{table_split or 'missing'} in the table"
+        )
+
+
 def generate_data_split_file():
+    data = {"training": [], "validation": [], "testing": []}
+
     file_paths = list_jpg_paths(PROCESSED_VISION_DIR)
     files_info = [file_info(file) for file in file_paths]
-
-    data = {"training": [], "validation": [], "testing": []}
+    files_info = [(file, dir) for file, dir in files_info if dir in data]
+
+    if has_split_table(PROCESSED_VISION_DIR):
+        table = SplitTable(get_split_table_dir(PROCESSED_VISION_DIR))
+        table_info = [(file, split) for split in data for file in table.ids(split=split)]
+        if files_info:
+            compare_with_split_table(files_info, table_info)
+        else:
+            # "manifest" mode: the split only exists in the manifest and its table
+            print("No files in the processed tree, reading the splits from the table")
+            files_info = table_info
 
     for file, dir in files_info:
         if dir == "training":
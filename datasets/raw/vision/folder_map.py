@@ -0,0 +1,188 @@
+"""
+Streaming parser for folder_map.txt and a persisted sqlite index of the VISION tree.
+
+The folder map lists the remote directory tree, one entry per line, indented by two
+spaces per level:
+
+    |-- D01_Samsung_GalaxyS3Mini
+      |-- images
+        |-- flat
+          |-- D01_I_flat_0001.jpg
+
+`iter_folder_map` yields one record per image file. `build_file_index` stores all records
+in a small sqlite database, so downloading, splitting and counting can select files by
+device or sub-folder with a single query instead of re-parsing the map or walking the
+downloaded tree.
+"""
+
+import os
+import csv
+import sqlite3
+from collections import namedtuple
+
+from constants import FOLDER_MAP_FILE, FILE_INDEX_FILE, DOWNLOAD_MANIFEST_FILE
+
+FolderMapRecord = namedtuple("FolderMapRecord", ["device", "sub_folder", "relative_path"])
+
+# top-level folders whose contents are never downloaded
+SKIPPED_FOLDERS = {"videos"}
+
+
+def iter_folder_map(file_path=FOLDER_MAP_FILE):
+    """
+    Yields a FolderMapRecord for every image file listed in the folder map.
+
+    Args:
+        file_path (str): Path to the folder map file.
+
+    Yields:
+        FolderMapRecord: The device, the sub-folder (e.g. "flat", "nat") and the path of
+                         the image relative to the dataset root, using "/" separators.
+    """
+    current_path = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            marker = line.find("|--")
+            if marker < 0:
+                continue
+            depth = marker // 2
+            name = line[marker + 3:].strip()
+            current_path = current_path[:depth]
+            if name.lower().endswith(".jpg"):
+                if depth < 2 or SKIPPED_FOLDERS.intersection(current_path):
+                    continue
+                yield FolderMapRecord(
+                    device=current_path[0],
+                    sub_folder=current_path[-1],
+                    relative_path="/".join(current_path + [name]),
+                )
+            else:
+                current_path.append(name)
+
+
+def build_file_index(folder_map_file=FOLDER_MAP_FILE, index_file=FILE_INDEX_FILE):
+    """ Parses the folder map into a fresh sqlite index and returns the number of files. """
+    tmp_file = f"{index_file}.tmp"
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    with connection:
+        connection.execute(
+            "CREATE TABLE files ("
+            "relative_path TEXT PRIMARY KEY, device TEXT NOT NULL, sub_folder TEXT NOT NULL)"
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO files (device, sub_folder, relative_path) VALUES (?, ?, ?)",
+            iter_folder_map(folder_map_file),
+        )
+        connection.execute("CREATE INDEX files_device ON files (device, sub_folder)")
+        connection.execute("CREATE INDEX files_sub_folder ON files (sub_folder)")
+    count = connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    connection.close()
+    os.replace(tmp_file, index_file)
+    return count
+
+
+def open_file_index(folder_map_file=FOLDER_MAP_FILE, index_file=FILE_INDEX_FILE):
+    """ Opens the file index, (re)building it first if it is older than the folder map. """
+    if not os.path.exists(index_file) or (
+        os.path.getmtime(index_file) < os.path.getmtime(folder_map_file)
+    ):
+        build_file_index(folder_map_file, index_file)
+    return sqlite3.connect(index_file)
+
+
+def _where_clause(devices=None, sub_folders=None):
+    conditions = []
+    params = []
+    for column, values in (("device", devices), ("sub_folder", sub_folders)):
+        if values is not None:
+            values = list(values)
+            conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+
+def query_file_index(devices=None, sub_folders=None, limit=None, **index_kwargs):
+    """
+    Returns the indexed image files, optionally restricted to some devices/sub-folders.
+
+    Records are in the order of the folder map, so `limit` selects the first files of
+    the map.
+
+    Args:
+        devices (Optional[List[str]]): Device folder names to keep, e.g. ["D01_Samsung_GalaxyS3Mini"].
+        sub_folders (Optional[List[str]]): Sub-folders to keep, e.g. ["flat", "nat"].
+        limit (Optional[int]): Maximum number of records to return.
+
+    Returns:
+        List[FolderMapRecord]: The matching records.
+    """
+    where, params = _where_clause(devices, sub_folders)
+    query = (
+        f"SELECT device, sub_folder, relative_path FROM files{where} "
+        # rows are inserted while the map is parsed, so the rowid is the map order
+        "ORDER BY rowid"
+    )
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(int(limit))
+    connection = open_file_index(**index_kwargs)
+    try:
+        return [FolderMapRecord(*row) for row in connection.execute(query, params)]
+    finally:
+        connection.close()
+
+
+def count_indexed_files(devices=None, sub_folders=None, **index_kwargs):
+    """ Returns the number of indexed image files per device. """
+    where, params = _where_clause(devices, sub_folders)
+    connection = open_file_index(**index_kwargs)
+    try:
+        rows = connection.execute(
+            f"SELECT device, COUNT(*) FROM files{where} GROUP BY device ORDER BY device",
+            params,
+        )
+        return dict(rows.fetchall())
+    finally:
+        connection.close()
+
+
+def list_indexed_devices(**index_kwargs):
+    """ Returns the names of all devices in the index. """
+    return list(count_indexed_files(**index_kwargs))
+
+
+def read_downloaded_paths(manifest_file=DOWNLOAD_MANIFEST_FILE):
+    """
+    Returns the relative paths recorded in the download manifest, or None when no
+    manifest exists (e.g. the data was downloaded before manifests were recorded).
+    """
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r", newline="") as file:
+        return {row["relative_path"] for row in csv.DictReader(file)}
+
+
+def list_downloaded_files(data_dir, devices=None, sub_folders=None, manifest_file=DOWNLOAD_MANIFEST_FILE):
+    """
+    Returns the indexed records whose files have been downloaded into `data_dir`.
+
+    The download manifest is used when it exists; otherwise each indexed file is checked
+    on disk.
+    """
+    records = query_file_index(devices=devices, sub_folders=sub_folders)
+    downloaded = read_downloaded_paths(manifest_file)
+    if downloaded is None:
+        return [
+            r for r in records if os.path.exists(os.path.join(data_dir, r.relative_path))
+        ]
+    return [r for r in records if r.relative_path in downloaded]
+
+
+if __name__ == "__main__":
+    num_files = build_file_index()
+    print(f"Indexed {num_files} image files into {FILE_INDEX_FILE}")
+    for device, count in count_indexed_files().items():
+        print(f"{device}: {count}")
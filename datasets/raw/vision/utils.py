@@ -1,18 +1,35 @@
-import glob
+from constants import PROCESSED_VISION_DIR, RAW_DATA_DIR
+from file_cache import get_file_cache
+from folder_map import count_indexed_files, list_downloaded_files
 
 
 def get_img_file_count(data_dir):
-    path = f'{data_dir}/**/*.jpg'
-    jpg_files = glob.glob(path, recursive=True)
-    image_count = len(jpg_files)
+    jpg_files = get_file_cache().list_files(data_dir, suffixes=(".jpg",))
+    image_count = sum(1 for path, _, _ in jpg_files if path.endswith(".jpg"))
     return image_count
 
 
+def get_indexed_img_file_count(devices=None, sub_folders=None, downloaded_only=False):
+    """
+    Count image files from the folder map index instead of walking the directory tree.
+
+    With `downloaded_only=True` only files that have been downloaded into RAW_DATA_DIR
+    are counted.
+    """
+    if downloaded_only:
+        return len(list_downloaded_files(RAW_DATA_DIR, devices, sub_folders))
+    return sum(count_indexed_files(devices, sub_folders).values())
+
+
 if __name__ == "__main__":
+    # indexed
+    indexed_img_count = get_indexed_img_file_count()
+    print(f"Indexed image count: {indexed_img_count}")
+
     # raw
-    raw_img_count = get_img_file_count(data_dir="./data")
+    raw_img_count = get_indexed_img_file_count(downloaded_only=True)
     print(f"Raw image count: {raw_img_count}")
     
     # processed
-    processed_img_count = get_img_file_count(data_dir="./../../processed/vision")
-    print(f"Processed image count: {processed_img_count}")
\ No newline at end of file
+    processed_img_count = get_img_file_count(data_dir=PROCESSED_VISION_DIR)
+    print(f"Processed image count: {processed_img_count}")
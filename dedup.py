@@ -0,0 +1,237 @@
+"""
+Duplicate and near-duplicate detection across the splits of a processed dataset.
+
+Every image gets an exact content hash (sha1) and a 64-bit perceptual difference hash
+(dHash). Hashes are computed in a process pool and kept in the shared file cache
+(file_cache.py). Every file is re-statted before its cached hashes are used, and they are
+dropped as soon as its size or mtime differ, so re-running on an unchanged tree costs one
+stat per file and hashes nothing.
+
+Exact duplicates are grouped by content hash. Near-duplicates are found with a banded
+index: the 64-bit dHash is cut into `max_distance + 1` bands, and by the pigeonhole
+principle two hashes within `max_distance` bits of each other agree on at least one band,
+so only images sharing a band value are compared instead of all pairs. Near-uniform
+images (e.g. MNIST backgrounds, Vision "flat") can share a band value by the thousands;
+buckets larger than `max_bucket_size` are skipped, and their images are only compared
+through their other bands.
+
+Only pairs whose images are in different splits (training/validation/testing) are
+reported, since those leak evaluation data into training:
+
+    python dedup.py vision --max-distance 3
+"""
+
+import os
+import csv
+import hashlib
+import argparse
+import itertools
+import concurrent.futures
+from collections import defaultdict, namedtuple
+
+from dataset_files import get_dataset_path, list_split_names
+from file_cache import FILE_CACHE_FILE, FileCache
+from image_formats import open_image
+from instrumentation import track_stage
+
+LEAKAGE_REPORT_FILE_NAME = "leakage_report.csv"
+
+DEFAULT_MAX_DISTANCE = 3
+
+# larger band buckets are skipped, comparing all their pairs is quadratic
+DEFAULT_MAX_BUCKET_SIZE = 1000
+
+ImageRecord = namedtuple("ImageRecord", ["path", "split", "label", "sha1", "dhash"])
+
+
+def compute_dhash(image) -> int:
+    """Returns the 64-bit difference hash of a PIL image."""
+    from PIL import Image
+
+    # let the JPEG decoder downscale while decoding, the hash only needs 9x8 pixels
+    image.draft("L", (64, 64))
+    pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hash_image(path: str):
+    """Computes the (sha1, dhash) of an image file. Runs in a worker process."""
+    with open(path, "rb") as file:
+        sha1 = hashlib.sha1(file.read()).hexdigest()
+    with open_image(path) as image:
+        dhash = compute_dhash(image)
+    return sha1, dhash
+
+
+def hash_dataset(dataset_path: str, cache: FileCache, workers=None):
+    """
+    Hashes every image of every split of a dataset, reusing cached hashes.
+
+    Returns:
+        List[ImageRecord]: One record per image.
+    """
+    files = []
+    for split_name in list_split_names(dataset_path):
+        # re-stat every file: a file rewritten in place keeps its directory's mtime
+        X, y = cache.list_split_files(dataset_path, split_name, stat_files=True)
+        files.extend((path, split_name, label) for path, label in zip(X, y))
+
+    hashes = cache.get_hashes(path for path, _, _ in files)
+    missing = [path for path, _, _ in files if path not in hashes]
+
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    with track_stage(f"{dataset_name}.hash", total=len(missing), progress=True) as stage:
+        stage.skip(len(hashes))
+        if missing:
+            print(f"Hashing {len(missing)} images ({len(hashes)} cached)...")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(
+                    hash_image, missing, chunksize=max(1, len(missing) // 256)
+                )
+                new_rows = []
+                for path, (sha1, dhash) in zip(missing, results):
+                    hashes[path] = (sha1, dhash)
+                    new_rows.append((path, sha1, dhash))
+                    stage.add()
+            cache.set_hashes(new_rows)
+
+    return [
+        ImageRecord(path, split, label, *hashes[path]) for path, split, label in files
+    ]
+
+
+def find_exact_duplicates(records):
+    """Returns the (record, record) pairs with identical content in different splits."""
+    by_sha1 = defaultdict(list)
+    for record in records:
+        by_sha1[record.sha1].append(record)
+    pairs = []
+    for group in by_sha1.values():
+        for a, b in itertools.combinations(group, 2):
+            if a.split != b.split:
+                pairs.append((a, b))
+    return pairs
+
+
+def find_near_duplicates(
+    records,
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    max_bucket_size: int = DEFAULT_MAX_BUCKET_SIZE,
+):
+    """
+    Returns (record, record, distance) for images in different splits whose dHashes are
+    within `max_distance` bits, excluding exact duplicates. Band buckets with more than
+    `max_bucket_size` images are not compared (see module docstring).
+    """
+    num_bands = max_distance + 1
+    band_bits = 64 // num_bands
+    band_mask = (1 << band_bits) - 1
+
+    buckets = defaultdict(list)
+    for idx, record in enumerate(records):
+        for band in range(num_bands):
+            band_value = (record.dhash >> (band * band_bits)) & band_mask
+            buckets[(band, band_value)].append(idx)
+
+    seen_pairs = set()
+    pairs = []
+    skipped = 0
+    for bucket in buckets.values():
+        if len(bucket) > max_bucket_size:
+            skipped += 1
+            continue
+        for i, j in itertools.combinations(bucket, 2):
+            a, b = records[i], records[j]
+            if a.split == b.split or a.sha1 == b.sha1 or (i, j) in seen_pairs:
+                continue
+            distance = (a.dhash ^ b.dhash).bit_count()
+            if distance <= max_distance:
+                seen_pairs.add((i, j))
+                pairs.append((a, b, distance))
+    if skipped:
+        print(
+            f"Skipped {skipped} dHash band buckets with more than {max_bucket_size} "
+            "images (near-uniform images)"
+        )
+    return pairs
+
+
+def write_leakage_report(report_path: str, exact_pairs, near_pairs) -> None:
+    """Writes the cross-split duplicate pairs to a CSV file."""
+    with open(report_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(
+            ["kind", "distance", "id_a", "split_a", "label_a", "id_b", "split_b", "label_b"]
+        )
+        rows = [("exact", 0, a, b) for a, b in exact_pairs]
+        rows += [("near", distance, a, b) for a, b, distance in near_pairs]
+        for kind, distance, a, b in rows:
+            writer.writerow(
+                [
+                    kind,
+                    distance,
+                    os.path.basename(a.path),
+                    a.split,
+                    a.label,
+                    os.path.basename(b.path),
+                    b.split,
+                    b.label,
+                ]
+            )
+
+
+def check_dataset_leakage(
+    dataset_path: str,
+    max_distance: int = DEFAULT_MAX_DISTANCE,
+    workers=None,
+    cache_file: str = FILE_CACHE_FILE,
+    max_bucket_size: int = DEFAULT_MAX_BUCKET_SIZE,
+):
+    """
+    Reports exact and near duplicates crossing split boundaries in a processed dataset.
+
+    The report is written to `<dataset>/leakage_report.csv`.
+
+    Returns:
+        Tuple[list, list]: The exact duplicate pairs and the near duplicate pairs.
+    """
+    cache = FileCache(cache_file)
+    try:
+        records = hash_dataset(dataset_path, cache, workers=workers)
+    finally:
+        cache.close()
+    exact_pairs = find_exact_duplicates(records)
+    near_pairs = find_near_duplicates(
+        records, max_distance=max_distance, max_bucket_size=max_bucket_size
+    )
+    write_leakage_report(
+        os.path.join(dataset_path, LEAKAGE_REPORT_FILE_NAME), exact_pairs, near_pairs
+    )
+    print(
+        f"{os.path.basename(os.path.normpath(dataset_path))}: {len(records)} images, "
+        f"{len(exact_pairs)} exact and {len(near_pairs)} near duplicate pairs across splits"
+    )
+    return exact_pairs, near_pairs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detect duplicates across splits.")
+    parser.add_argument("datasets", nargs="+", help="Dataset names.")
+    parser.add_argument("--max-distance", type=int, default=DEFAULT_MAX_DISTANCE)
+    parser.add_argument("--max-bucket-size", type=int, default=DEFAULT_MAX_BUCKET_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for dataset_name in args.datasets:
+        check_dataset_leakage(
+            get_dataset_path(dataset_name),
+            max_distance=args.max_distance,
+            workers=args.workers,
+            max_bucket_size=args.max_bucket_size,
+        )
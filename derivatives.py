@@ -0,0 +1,172 @@
+"""
+Pre-resized derivatives of the processed image datasets.
+
+For every configured resolution, each image of the processed split trees is resized (and
+by default center-cropped to a square) and stored alongside the originals with the same
+file name, so the `*_test_key.csv` ids stay valid:
+
+    processed/<dataset>/resized/<size>/<split>/<label>/<id>        # center cropped
+    processed/<dataset>/resized/<size>_fit/<split>/<label>/<id>    # aspect ratio kept
+
+JPEG sources are decoded in PIL's draft mode, which lets the decoder downscale by a power
+of two while decoding, so full camera-resolution images are never fully decoded. Builds
+are incremental: an output newer than its source is skipped, and outputs whose source
+disappeared are removed.
+
+    python derivatives.py cub_200_2011 vision --sizes 64 128 224
+"""
+
+import os
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+from dataset_files import get_dataset_path, list_split_names, list_split_files
+from image_formats import format_from_path, open_image, write_image
+from instrumentation import track_stage
+
+RESIZED_DIR_NAME = "resized"
+
+DEFAULT_SIZES = (64, 128, 224)
+
+JPEG_QUALITY = 95
+
+
+def get_resized_dir(dataset_path: str, size: int, crop: bool = True) -> str:
+    """Returns the directory holding the derivatives of a dataset at one resolution."""
+    return os.path.join(dataset_path, RESIZED_DIR_NAME, str(size) if crop else f"{size}_fit")
+
+
+def resize_image(src: str, dst: str, size: int, crop: bool = True) -> None:
+    """
+    Writes a resized copy of an image, in the format of its file extension.
+
+    Args:
+        src (str): Source image path.
+        dst (str): Destination image path.
+        size (int): Target size in pixels. With `crop` the output is size x size, otherwise
+                    the longer side is `size` and the aspect ratio is kept.
+        crop (bool): Resize the shorter side to `size` and center crop to a square.
+    """
+    from PIL import Image
+
+    with open_image(src) as image:
+        width, height = image.size
+        scale = size / min(width, height) if crop else size / max(width, height)
+        target = (max(1, round(width * scale)), max(1, round(height * scale)))
+        # JPEG only: decode directly at a reduced scale no smaller than the target
+        image.draft(image.mode if image.mode in ("L", "RGB") else "RGB", target)
+        image = image.convert("L" if image.mode == "L" else "RGB")
+        image = image.resize(target, Image.BILINEAR, reducing_gap=2.0)
+        if crop:
+            left = (image.width - size) // 2
+            top = (image.height - size) // 2
+            image = image.crop((left, top, left + size, top + size))
+        tmp_path = f"{dst}.tmp"
+        write_image(
+            np.asarray(image), tmp_path, format_from_path(dst), quality=JPEG_QUALITY
+        )
+    os.replace(tmp_path, dst)
+
+
+def _resize_chunk(tasks, crop: bool) -> int:
+    """Resizes a chunk of (src, dst, size) tasks. Runs in a worker process."""
+    for src, dst, size in tasks:
+        resize_image(src, dst, size, crop=crop)
+    return len(tasks)
+
+
+def _is_up_to_date(src: str, dst: str) -> bool:
+    try:
+        return os.stat(dst).st_mtime_ns >= os.stat(src).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+
+def _remove_orphans(resized_dir: str, expected_paths: set) -> int:
+    removed = 0
+    for root, _, files in os.walk(resized_dir):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            if path not in expected_paths:
+                os.remove(path)
+                removed += 1
+    return removed
+
+
+def build_derivatives(
+    dataset_path: str,
+    sizes=DEFAULT_SIZES,
+    crop: bool = True,
+    workers=None,
+    chunk_size: int = 64,
+) -> dict:
+    """
+    Builds (or updates) the resized derivatives of every split of a processed dataset.
+
+    Args:
+        dataset_path (str): Path to the processed dataset directory.
+        sizes (Tuple[int]): Target resolutions.
+        crop (bool): Center crop to squares (see `resize_image`).
+        workers (Optional[int]): Number of worker processes. Defaults to the CPU count.
+        chunk_size (int): Number of images handed to a worker at a time.
+
+    Returns:
+        dict: The number of resized, up-to-date and removed images.
+    """
+    tasks = []
+    up_to_date = 0
+    expected = {size: set() for size in sizes}
+    created_dirs = set()
+    for split_name in list_split_names(dataset_path):
+        X, y = list_split_files(dataset_path, split_name)
+        for size in sizes:
+            resized_dir = get_resized_dir(dataset_path, size, crop)
+            for src, label in zip(X, y):
+                dst_dir = os.path.join(resized_dir, split_name, label)
+                dst = os.path.join(dst_dir, os.path.basename(src))
+                expected[size].add(dst)
+                if _is_up_to_date(src, dst):
+                    up_to_date += 1
+                    continue
+                if dst_dir not in created_dirs:
+                    os.makedirs(dst_dir, exist_ok=True)
+                    created_dirs.add(dst_dir)
+                tasks.append((src, dst, size))
+
+    removed = sum(
+        _remove_orphans(get_resized_dir(dataset_path, size, crop), expected[size])
+        for size in sizes
+    )
+
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    chunks = [tasks[i:i + chunk_size] for i in range(0, len(tasks), chunk_size)]
+    with track_stage(f"{dataset_name}.derivatives", total=len(tasks), quiet=True) as stage:
+        stage.skip(up_to_date)
+        if chunks:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_resize_chunk, chunk, crop) for chunk in chunks]
+                for future in concurrent.futures.as_completed(futures):
+                    stage.add(future.result())
+    resized = stage.files
+
+    print(f"{dataset_name}: resized {resized}, {up_to_date} up to date, removed {removed}")
+    return {"resized": resized, "up_to_date": up_to_date, "removed": removed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build resized dataset derivatives.")
+    parser.add_argument("datasets", nargs="+", help="Dataset names.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--no-crop", action="store_true", help="Keep the aspect ratio.")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    for dataset_name in args.datasets:
+        build_derivatives(
+            get_dataset_path(dataset_name),
+            sizes=args.sizes,
+            crop=not args.no_crop,
+            workers=args.workers,
+        )
@@ -0,0 +1,341 @@
+"""
+Shared on-disk metadata cache of the dataset trees.
+
+Every pipeline stage used to walk the raw and processed trees on its own. The cache
+records, in one sqlite file, the path, size and mtime of every file (plus optional
+checksums) and the mtime of every directory. `refresh` only lists directories whose
+mtime changed since the last refresh; unchanged directories are skipped entirely, so
+after the first walk a refresh costs one stat per directory.
+
+Because a directory's mtime only changes when entries are added, removed or renamed,
+files rewritten in place are only picked up with `refresh(root, stat_files=True)`, which
+also re-stats every cached file of the unchanged directories (one stat per file, no
+listing), or `refresh(root, full=True)`. Consumers that cache results per file (hashes,
+verification results) must use `stat_files=True`.
+
+Timestamps have a limited resolution, so a directory or file changed within one tick of
+the moment it was scanned can keep the mtime that was recorded ("racy" timestamps).
+Directories with an mtime that recent are stored as dirty and listed again on the next
+refresh, and hashes and verification results of files with such a recent mtime are not
+stored.
+
+    from file_cache import get_file_cache
+
+    cache = get_file_cache()
+    X, y = cache.list_split_files(dataset_path, "testing")
+"""
+
+import os
+import time
+import sqlite3
+import threading
+
+import paths
+
+FILE_CACHE_FILE = os.path.join(paths.DATASETS_DIR, ".file_cache.sqlite")
+
+# upper bound of the mtime resolution of the filesystems in use (FAT has 2 s)
+MTIME_RESOLUTION_NS = 2_000_000_000
+
+
+def _racy_cutoff_ns() -> int:
+    """mtimes at or after this may still change without the mtime changing."""
+    return time.time_ns() - MTIME_RESOLUTION_NS
+
+
+def _prefix_range(directory: str):
+    """Bounds of the paths strictly under `directory`, for an indexed range query."""
+    prefix = directory.rstrip(os.sep) + os.sep
+    return prefix, prefix[:-1] + chr(ord(os.sep) + 1)
+
+
+def _to_signed64(value):
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _to_unsigned64(value):
+    return None if value is None else value & 0xFFFFFFFFFFFFFFFF
+
+
+class FileCache:
+    """
+    sqlite cache of file metadata (path, directory, size, mtime, sha1, dhash, verify).
+
+    A single instance can be shared between threads.
+    """
+
+    def __init__(self, cache_file: str = FILE_CACHE_FILE):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        self.cache_file = cache_file
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS dirs ("
+                "path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, dir TEXT NOT NULL, name TEXT NOT NULL, "
+                "size INTEGER, mtime_ns INTEGER, sha1 TEXT, dhash INTEGER, verify TEXT)"
+            )
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(files)")]
+            if "verify" not in columns:
+                # caches created before image verification was added
+                self.connection.execute("ALTER TABLE files ADD COLUMN verify TEXT")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+
+    def _forget_dir(self, directory: str) -> None:
+        low, high = _prefix_range(directory)
+        self.connection.execute("DELETE FROM files WHERE path > ? AND path < ?", (low, high))
+        self.connection.execute(
+            "DELETE FROM dirs WHERE path = ? OR (path > ? AND path < ?)",
+            (directory, low, high),
+        )
+
+    def _rescan_dir(self, directory: str, mtime_ns: int):
+        """Lists one directory and updates its file rows; returns its sub-directories."""
+        # a racy directory mtime is not recorded, so the next refresh lists it again
+        if mtime_ns >= _racy_cutoff_ns():
+            mtime_ns = None
+        current_files = {}
+        sub_dirs = []
+        for entry in os.scandir(directory):
+            if entry.is_dir(follow_symlinks=False):
+                sub_dirs.append(entry.path)
+            elif entry.is_file():
+                stat = entry.stat()
+                current_files[entry.path] = (entry.name, stat.st_size, stat.st_mtime_ns)
+
+        cached_files = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self.connection.execute(
+                "SELECT path, size, mtime_ns FROM files WHERE dir = ?", (directory,)
+            )
+        }
+        self.connection.executemany(
+            "DELETE FROM files WHERE path = ?",
+            [(path,) for path in cached_files if path not in current_files],
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO files (path, dir, name, size, mtime_ns) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (path, directory, name, size, file_mtime_ns)
+                for path, (name, size, file_mtime_ns) in current_files.items()
+                if cached_files.get(path) != (size, file_mtime_ns)
+            ],
+        )
+
+        cached_sub_dirs = [
+            row[0]
+            for row in self.connection.execute(
+                "SELECT path FROM dirs WHERE parent = ?", (directory,)
+            )
+        ]
+        for sub_dir in set(cached_sub_dirs) - set(sub_dirs):
+            self._forget_dir(sub_dir)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)",
+            (directory, os.path.dirname(directory), mtime_ns),
+        )
+        return sub_dirs
+
+    def _restat_files(self, directory: str) -> None:
+        """Re-stats the cached files of an unchanged directory, updating changed rows."""
+        rows = self.connection.execute(
+            "SELECT path, name, size, mtime_ns FROM files WHERE dir = ?", (directory,)
+        ).fetchall()
+        removed, changed = [], []
+        for path, name, size, mtime_ns in rows:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                removed.append((path,))
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                changed.append((path, directory, name, stat.st_size, stat.st_mtime_ns))
+        self.connection.executemany("DELETE FROM files WHERE path = ?", removed)
+        # replacing the row clears its hashes and verification result
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO files (path, dir, name, size, mtime_ns) "
+            "VALUES (?, ?, ?, ?, ?)",
+            changed,
+        )
+
+    def refresh(self, root: str, full: bool = False, stat_files: bool = False) -> None:
+        """
+        Brings the cached metadata of the tree under `root` up to date.
+
+        Args:
+            root (str): The directory to refresh.
+            full (bool): Re-list every directory (and re-stat every file) instead of only
+                         the directories whose mtime changed.
+            stat_files (bool): Also re-stat the files of unchanged directories, so files
+                               rewritten in place are detected.
+        """
+        root = os.path.abspath(root)
+        with self._lock, self.connection:
+            stack = [root]
+            while stack:
+                directory = stack.pop()
+                try:
+                    mtime_ns = os.stat(directory).st_mtime_ns
+                except FileNotFoundError:
+                    self._forget_dir(directory)
+                    continue
+                row = self.connection.execute(
+                    "SELECT mtime_ns FROM dirs WHERE path = ?", (directory,)
+                ).fetchone()
+                if not full and row is not None and row[0] == mtime_ns:
+                    if stat_files:
+                        self._restat_files(directory)
+                    stack.extend(
+                        r[0]
+                        for r in self.connection.execute(
+                            "SELECT path FROM dirs WHERE parent = ?", (directory,)
+                        )
+                    )
+                else:
+                    stack.extend(self._rescan_dir(directory, mtime_ns))
+
+    def list_files(
+        self, root: str, suffixes=None, refresh: bool = True, stat_files: bool = False
+    ):
+        """
+        Returns the cached (path, size, mtime_ns) of every file under `root`, sorted by path.
+
+        Args:
+            root (str): The directory to list.
+            suffixes (Optional[Tuple[str]]): Only keep files ending with one of these
+                                             (case insensitive), e.g. (".jpg", ".jpeg").
+            refresh (bool): Refresh the tree before listing.
+            stat_files (bool): Re-stat every file when refreshing (see `refresh`).
+        """
+        root = os.path.abspath(root)
+        if refresh:
+            self.refresh(root, stat_files=stat_files)
+        low, high = _prefix_range(root)
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT path, name, size, mtime_ns FROM files "
+                "WHERE path > ? AND path < ? ORDER BY path",
+                (low, high),
+            ).fetchall()
+        return [
+            (path, size, mtime_ns)
+            for path, name, size, mtime_ns in rows
+            if suffixes is None or name.lower().endswith(suffixes)
+        ]
+
+    def count_files(self, root: str, suffixes=None, refresh: bool = True) -> int:
+        """Returns the number of files under `root`."""
+        return len(self.list_files(root, suffixes=suffixes, refresh=refresh))
+
+    def list_split_files(
+        self, dataset_path: str, split_name: str, suffixes=None, stat_files: bool = False
+    ):
+        """
+        Lists the files of one split of a processed dataset (`<split>/<label>/<file>`).
+        With `stat_files`, files rewritten in place are detected too (see `refresh`).
+
+        Returns:
+            Tuple[List[str], List[str]]: The file paths and their labels, sorted by label
+                                         and file name.
+        """
+        from dataset_files import IMAGE_EXTENSIONS
+
+        split_path = os.path.join(os.path.abspath(dataset_path), split_name)
+        rows = self.list_files(
+            split_path, suffixes=suffixes or IMAGE_EXTENSIONS, stat_files=stat_files
+        )
+        entries = []
+        for path, _, _ in rows:
+            label_dir = os.path.dirname(path)
+            # only files directly inside a label directory belong to the split
+            if os.path.dirname(label_dir) == split_path:
+                entries.append((os.path.basename(label_dir), os.path.basename(path), path))
+        entries.sort()
+        X = [path for _, _, path in entries]
+        y = [label for label, _, _ in entries]
+        return X, y
+
+    def get_hashes(self, file_paths):
+        """
+        Returns {path: (sha1, dhash)} for the given files whose hashes are cached.
+
+        Hashes are cleared whenever a refresh sees a file's size or mtime change, so the
+        returned hashes are current as of the last refresh if it used `stat_files`.
+        """
+        hashes = {}
+        with self._lock:
+            for path in file_paths:
+                row = self.connection.execute(
+                    "SELECT sha1, dhash FROM files WHERE path = ?", (os.path.abspath(path),)
+                ).fetchone()
+                if row is not None and row[0] is not None:
+                    hashes[path] = (row[0], _to_unsigned64(row[1]))
+        return hashes
+
+    def set_hashes(self, rows) -> None:
+        """
+        Stores (path, sha1, dhash) rows for files already in the cache, except for files
+        with a racy mtime (see module docstring).
+        """
+        cutoff = _racy_cutoff_ns()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE files SET sha1 = ?, dhash = ? WHERE path = ? AND mtime_ns < ?",
+                [
+                    (sha1, _to_signed64(dhash), os.path.abspath(path), cutoff)
+                    for path, sha1, dhash in rows
+                ],
+            )
+
+    def get_verify_results(self, file_paths):
+        """
+        Returns {path: result} for the given files whose verification result is cached.
+
+        Like the hashes, results are cleared whenever a refresh sees the file change.
+        """
+        results = {}
+        with self._lock:
+            for path in file_paths:
+                row = self.connection.execute(
+                    "SELECT verify FROM files WHERE path = ?", (os.path.abspath(path),)
+                ).fetchone()
+                if row is not None and row[0] is not None:
+                    results[path] = row[0]
+        return results
+
+    def set_verify_results(self, rows) -> None:
+        """
+        Stores (path, result) rows for files already in the cache, except for files with
+        a racy mtime (see module docstring).
+        """
+        cutoff = _racy_cutoff_ns()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE files SET verify = ? WHERE path = ? AND mtime_ns < ?",
+                [(result, os.path.abspath(path), cutoff) for path, result in rows],
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+_file_cache = None
+_file_cache_lock = threading.Lock()
+
+
+def get_file_cache() -> FileCache:
+    """Returns the process-wide FileCache backed by FILE_CACHE_FILE."""
+    global _file_cache
+    with _file_cache_lock:
+        if _file_cache is None:
+            _file_cache = FileCache(FILE_CACHE_FILE)
+        return _file_cache
@@ -0,0 +1,244 @@
+"""
+Exports in-memory image arrays into the processed folder layout.
+
+This is the importable version of the `save_images` function of the dataset notebooks
+(MNIST, Fashion-MNIST, mini-MNIST, CIFAR-10 and CIFAR-100). The arrays are cut into
+chunks which are encoded and written by a pool of worker processes, and the label
+directories are created once instead of once per image. Sources are consumed as a
+stream of chunks with a bounded number in flight, so memory use does not grow with the
+dataset size:
+
+    from image_export import clear_data_folders, save_images
+
+    clear_data_folders(output_dir)
+    save_images(x_train, y_train, output_dir, "training", idx_to_label=idx_to_label)
+
+    # or straight from the source files, without loading the arrays (as the notebooks do)
+    from dataset_readers import iter_cifar10_chunks
+
+    save_image_chunks(iter_cifar10_chunks("train"), output_dir, "training")
+"""
+
+import os
+import time
+import shutil
+import concurrent.futures
+
+import numpy as np
+
+from image_formats import DEFAULT_IMAGE_FORMAT, IMAGE_FORMATS, write_image
+from instrumentation import track_stage
+
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def clear_data_folders(base_dir: str, split_names=("training", "testing")) -> None:
+    """
+    Clears the contents of the split directories within the specified base directory.
+
+    Args:
+        base_dir (str): The path to the base directory containing the split subdirectories.
+        split_names (Tuple[str]): The split subdirectories to clear.
+
+    Returns:
+        None: This function does not return a value but clears specified directories.
+    """
+    for dataset_type in split_names:
+        dir_path = os.path.join(base_dir, dataset_type)
+        # Check if the directory exists
+        if os.path.exists(dir_path):
+            # Remove the directory and its contents, then recreate the directory
+            shutil.rmtree(dir_path)
+            os.makedirs(dir_path, exist_ok=True)
+            print(f"Cleared {dataset_type} directory.")
+        else:
+            # If the directory does not exist, create it
+            os.makedirs(dir_path, exist_ok=True)
+            print(f"Created {dataset_type} directory.")
+
+
+def _save_chunk(split_dir: str, images: np.ndarray, label_names, indices, image_format):
+    """
+    Encodes and writes one chunk of images. Runs in a worker process.
+
+    Returns:
+        Tuple[int, int]: The number of images and bytes written.
+    """
+    extension = IMAGE_FORMATS[image_format]
+    num_bytes = 0
+    for image, label, idx in zip(images, label_names, indices):
+        image_file = os.path.join(split_dir, label, f"{idx}{extension}")
+        write_image(image, image_file, image_format)
+        num_bytes += os.path.getsize(image_file)
+    return len(images), num_bytes
+
+
+def iter_array_chunks(images, labels, indices=None, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Yields (images, labels, indices) slices of in-memory or memory-mapped arrays.
+
+    Slicing a memory-mapped array (np.memmap, np.load(..., mmap_mode="r")) only reads
+    the rows of the slice, so exporting it never loads the whole array.
+    """
+    labels = np.asarray(labels).reshape(-1)
+    for start in range(0, len(images), chunk_size):
+        stop = min(start + chunk_size, len(images))
+        chunk_indices = np.arange(start, stop) if indices is None else indices[start:stop]
+        yield images[start:stop], labels[start:stop], chunk_indices
+
+
+def save_image_chunks(
+    chunks,
+    output_dir: str,
+    dataset_type: str,
+    idx_to_label=None,
+    workers=None,
+    image_format: str = DEFAULT_IMAGE_FORMAT,
+    total=None,
+    max_pending=None,
+) -> dict:
+    """
+    Saves images from a stream of chunks, with a fixed memory ceiling.
+
+    At most `max_pending` chunks are in flight (read but not yet written) at any time,
+    so memory use depends on the chunk size and not on the size of the dataset: a
+    source that reads its chunks lazily (see dataset_readers.py) can export datasets
+    larger than RAM.
+
+    Args:
+        chunks (Iterable[Tuple]): (images, labels) or (images, labels, indices) chunks.
+                                  Without indices, images are numbered by their position
+                                  in the stream.
+        output_dir (str): The processed dataset directory.
+        dataset_type (str): Training or testing.
+        idx_to_label (Optional[dict]): Maps integer labels to label names. Defaults to
+                                       the label itself.
+        workers (Optional[int]): Number of worker processes. Defaults to the CPU count;
+                                 1 writes in the current process.
+        image_format (str): jpeg, png, webp or raw (see image_formats.py).
+        total (Optional[int]): Expected number of images, for progress reporting.
+        max_pending (Optional[int]): Maximum number of chunks in flight. Defaults to
+                                     twice the number of workers.
+
+    Returns:
+        dict: The number of images written, the elapsed seconds, the throughput, the
+              peak RSS of this process during the export and the growth of the peak
+              RSS of the worker processes, in MiB.
+    """
+    start_time = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    split_dir = os.path.join(output_dir, dataset_type)
+    created_labels = set()
+    position = 0
+
+    def prepare(chunk):
+        # resolve label names and create each label directory once
+        nonlocal position
+        images, labels = chunk[0], np.asarray(chunk[1]).reshape(-1)
+        if len(chunk) > 2:
+            indices = chunk[2]
+        else:
+            indices = np.arange(position, position + len(images))
+        position += len(images)
+        label_names = np.array(
+            [str(idx_to_label[l] if idx_to_label else l) for l in labels.tolist()],
+            dtype=object,
+        )
+        for label in set(label_names.tolist()) - created_labels:
+            os.makedirs(os.path.join(split_dir, label), exist_ok=True)
+            created_labels.add(label)
+        return split_dir, images, label_names, indices, image_format
+
+    num_images = "all" if total is None else total
+    print(f"Processing {num_images} images from {dataset_type} set...")
+    stage_name = f"{os.path.basename(os.path.normpath(output_dir))}.export.{dataset_type}"
+    with track_stage(stage_name, total=total, quiet=True) as stage:
+        if workers == 1:
+            for chunk in chunks:
+                num_images, num_bytes = _save_chunk(*prepare(chunk))
+                stage.add(num_images, bytes_written=num_bytes)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                for chunk in chunks:
+                    if len(pending) >= max_pending:
+                        done, pending = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            num_images, num_bytes = future.result()
+                            stage.add(num_images, bytes_written=num_bytes)
+                    pending.add(executor.submit(_save_chunk, *prepare(chunk)))
+                for future in concurrent.futures.as_completed(pending):
+                    num_images, num_bytes = future.result()
+                    stage.add(num_images, bytes_written=num_bytes)
+    num_saved = stage.files
+
+    elapsed = time.perf_counter() - start_time
+    images_per_second = num_saved / elapsed if elapsed > 0 else float("inf")
+    # ru_maxrss is a lifetime peak: report the peak sampled during the export instead
+    record = stage.to_dict()
+    rss_mb = record["stage_peak_rss_mb"]
+    if rss_mb is None:
+        rss_mb = record["peak_rss_mb"]
+    workers_rss_mb = record["peak_workers_rss_growth_mb"]
+    print(
+        f"Done processing {num_saved} images in {dataset_type} set "
+        f"in {elapsed:.2f}s ({images_per_second:.0f} images/s, "
+        f"peak RSS {rss_mb:.0f} MiB, workers +{workers_rss_mb:.0f} MiB)"
+    )
+    return {
+        "images": num_saved,
+        "seconds": elapsed,
+        "images_per_second": images_per_second,
+        "peak_rss_mb": rss_mb,
+        "peak_workers_rss_growth_mb": workers_rss_mb,
+    }
+
+
+def save_images(
+    images: np.ndarray,
+    labels: np.ndarray,
+    output_dir: str,
+    dataset_type: str,
+    idx_to_label=None,
+    indices=None,
+    workers=None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    image_format: str = DEFAULT_IMAGE_FORMAT,
+) -> dict:
+    """
+    Saves images to disk, organized in directories corresponding to their labels.
+
+    Files are written to `<output_dir>/<dataset_type>/<label>/<idx>.jpg`, the same layout
+    and names the notebooks produced (or `.png`, `.webp`, `.npy` for the other formats).
+    The arrays are streamed to the workers chunk by chunk (see `save_image_chunks`).
+
+    Args:
+        images (np.ndarray): uint8 images of shape (N, H, W) or (N, H, W, C). May be
+                             memory-mapped.
+        labels (np.ndarray): Integer labels of shape (N,).
+        output_dir (str): The processed dataset directory.
+        dataset_type (str): Training or testing.
+        idx_to_label (Optional[dict]): Maps integer labels to label names. Defaults to
+                                       the label itself.
+        indices (Optional[np.ndarray]): Index used to name each image file. Defaults to
+                                        the position of the image in `images`.
+        workers (Optional[int]): Number of worker processes. Defaults to the CPU count;
+                                 1 writes in the current process.
+        chunk_size (int): Number of images handed to a worker at a time.
+        image_format (str): jpeg, png, webp or raw (see image_formats.py).
+
+    Returns:
+        dict: See `save_image_chunks`.
+    """
+    return save_image_chunks(
+        iter_array_chunks(images, labels, indices, chunk_size),
+        output_dir,
+        dataset_type,
+        idx_to_label=idx_to_label,
+        workers=workers,
+        image_format=image_format,
+        total=len(images),
+    )
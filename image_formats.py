@@ -0,0 +1,225 @@
+"""
+Image file formats of the exported datasets.
+
+    jpeg  - `<idx>.jpg`, lossy, the original format of every dataset
+    png   - `<idx>.png`, lossless
+    webp  - `<idx>.webp`, WebP in lossless mode (grayscale images are stored as RGB)
+    raw   - `<idx>.npy`, the uint8 array itself (NumPy .npy), no encoding at all
+
+The format of each exported dataset is set in DATASET_IMAGE_FORMATS. The file extension
+identifies the format, so the readers (data_loader.py, tensor_cache.py, verify_images.py,
+...) and the test keys work with any of them. Note that the test key ids include the
+extension, so changing the format of a dataset changes its ids.
+
+Compare size and decode speed of the formats on a sample of a processed dataset:
+
+    python image_formats.py mnist cifar10 --sample-size 2000
+"""
+
+import io
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from dataset_files import get_dataset_path, list_split_files
+
+IMAGE_FORMATS = {
+    "jpeg": ".jpg",
+    "png": ".png",
+    "webp": ".webp",
+    "raw": ".npy",
+}
+
+DEFAULT_IMAGE_FORMAT = "jpeg"
+
+# format of each exported dataset
+DATASET_IMAGE_FORMATS = {
+    "mnist": "jpeg",
+    "fashion_mnist": "jpeg",
+    "mini_mnist": "jpeg",
+    "cifar10": "jpeg",
+    "cifar100": "jpeg",
+}
+
+NPY_MAGIC = b"\x93NUMPY"
+
+_EXTENSION_FORMATS = {
+    ".jpg": "jpeg",
+    ".jpeg": "jpeg",
+    ".png": "png",
+    ".webp": "webp",
+    ".npy": "raw",
+}
+
+
+def get_image_format(dataset_name: str) -> str:
+    """Returns the export format of a dataset."""
+    return DATASET_IMAGE_FORMATS.get(dataset_name, DEFAULT_IMAGE_FORMAT)
+
+
+def format_from_path(file_path: str) -> str:
+    """Returns the format of an image file from its extension."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension not in _EXTENSION_FORMATS:
+        raise ValueError(f"Unknown image file extension '{extension}' of {file_path}")
+    return _EXTENSION_FORMATS[extension]
+
+
+def write_image(image: np.ndarray, file_path: str, image_format=None, quality=None) -> None:
+    """
+    Writes a uint8 image array to a file.
+
+    Args:
+        image (np.ndarray): Image of shape (H, W) or (H, W, C).
+        file_path (str): Destination path.
+        image_format (Optional[str]): One of IMAGE_FORMATS. Defaults to the format of
+                                      the file extension.
+        quality (Optional[int]): JPEG quality. Defaults to PIL's default.
+    """
+    from PIL import Image
+
+    image_format = image_format or format_from_path(file_path)
+    if image_format == "raw":
+        with open(file_path, "wb") as file:
+            np.save(file, np.ascontiguousarray(image, dtype=np.uint8))
+    elif image_format == "jpeg":
+        options = {} if quality is None else {"quality": quality}
+        Image.fromarray(image).save(file_path, "JPEG", **options)
+    elif image_format == "png":
+        Image.fromarray(image).save(file_path, "PNG")
+    elif image_format == "webp":
+        Image.fromarray(image).save(file_path, "WEBP", lossless=True)
+    else:
+        raise ValueError(
+            f"Unknown image format '{image_format}', expected one of {list(IMAGE_FORMATS)}"
+        )
+
+
+def open_image(source):
+    """Opens an image file (path or encoded bytes) of any format as a PIL image."""
+    from PIL import Image
+
+    if isinstance(source, bytes):
+        if source.startswith(NPY_MAGIC):
+            return Image.fromarray(np.load(io.BytesIO(source)))
+        return Image.open(io.BytesIO(source))
+    if source.lower().endswith(".npy"):
+        return Image.fromarray(np.load(source))
+    return Image.open(source)
+
+
+def read_image(source) -> np.ndarray:
+    """Decodes an image file (path or encoded bytes) of any format into a uint8 array."""
+    if isinstance(source, bytes):
+        if source.startswith(NPY_MAGIC):
+            return np.load(io.BytesIO(source))
+    elif source.lower().endswith(".npy"):
+        return np.load(source)
+    with open_image(source) as image:
+        return np.asarray(image)
+
+
+def _same_pixels(original: np.ndarray, decoded: np.ndarray) -> bool:
+    # WebP has no grayscale mode: a grayscale image comes back as three equal channels
+    if decoded.ndim == original.ndim + 1:
+        decoded = decoded[..., 0]
+    return np.array_equal(original, decoded)
+
+
+def compare_image_formats(images, formats=tuple(IMAGE_FORMATS), work_dir=None) -> list:
+    """
+    Writes the same images in every format and measures size and encode/decode speed.
+
+    Args:
+        images (List[np.ndarray]): Sample of uint8 images.
+        formats (Tuple[str]): Formats to compare.
+        work_dir (Optional[str]): Scratch directory. Defaults to a temporary directory.
+
+    Returns:
+        List[dict]: Per format: bytes per image, encode and decode throughput (images/s)
+                    and whether every image was decoded exactly.
+
+    Raises:
+        ValueError: If there are no images or no formats to compare.
+    """
+    images = list(images)
+    if not images:
+        raise ValueError("No images to compare the formats on")
+    if not formats:
+        raise ValueError("No image formats to compare")
+    scratch_dir = tempfile.mkdtemp(dir=work_dir)
+    results = []
+    try:
+        for image_format in formats:
+            format_dir = os.path.join(scratch_dir, image_format)
+            os.makedirs(format_dir)
+            file_paths = [
+                os.path.join(format_dir, f"{idx}{IMAGE_FORMATS[image_format]}")
+                for idx in range(len(images))
+            ]
+
+            start_time = time.perf_counter()
+            for image, file_path in zip(images, file_paths):
+                write_image(image, file_path, image_format)
+            encode_seconds = time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            decoded = [read_image(file_path) for file_path in file_paths]
+            decode_seconds = time.perf_counter() - start_time
+
+            total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+            results.append(
+                {
+                    "format": image_format,
+                    "images": len(images),
+                    "bytes": total_bytes,
+                    "bytes_per_image": total_bytes / len(images),
+                    "encode_images_per_second": len(images) / encode_seconds,
+                    "decode_images_per_second": len(images) / decode_seconds,
+                    "lossless": all(_same_pixels(a, b) for a, b in zip(images, decoded)),
+                }
+            )
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    return results
+
+
+def print_format_report(dataset_name: str, results) -> None:
+    if not results:
+        raise ValueError(f"No format results for {dataset_name}")
+    print(f"\n{dataset_name}: {results[0]['images']} images")
+    print(f"{'format':<8}{'bytes/image':>14}{'encode/s':>12}{'decode/s':>12}  lossless")
+    for result in results:
+        print(
+            f"{result['format']:<8}{result['bytes_per_image']:>14.0f}"
+            f"{result['encode_images_per_second']:>12.0f}"
+            f"{result['decode_images_per_second']:>12.0f}  {result['lossless']}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare image formats on datasets.")
+    parser.add_argument("datasets", nargs="+", help="Processed dataset names.")
+    parser.add_argument("--sample-size", type=int, default=2000)
+    parser.add_argument("--output", default=None, help="Save the results as JSON.")
+    args = parser.parse_args()
+
+    report = {}
+    for dataset_name in args.datasets:
+        X, _ = list_split_files(get_dataset_path(dataset_name), "training")
+        step = max(1, len(X) // args.sample_size)
+        if not X:
+            print(f"\n{dataset_name}: no training images, skipped")
+            continue
+        sample = [read_image(file_path) for file_path in X[::step][:args.sample_size]]
+        report[dataset_name] = compare_image_formats(sample)
+        print_format_report(dataset_name, report[dataset_name])
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
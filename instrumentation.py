@@ -0,0 +1,410 @@
+"""
+Stage-level instrumentation for the pipeline scripts.
+
+Each unit of work (a download, an export, a copy, the key creation of a dataset, ...) is
+tracked as a stage that counts files, bytes read and written, skipped files and errors:
+
+    from instrumentation import track_stage
+
+    with track_stage("vision.download", total=len(tasks), progress=True) as stage:
+        for task in tasks:
+            ...
+            stage.add(bytes_written=size)
+
+When a stage ends, a summary is printed and its metrics are appended as one JSON line to
+the metrics log (`datasets/metrics.jsonl`, or $RT_METRICS_LOG). If $RT_PROMETHEUS_FILE is
+set, the metrics of every stage finished by the process are also written to that file in
+the Prometheus text format, e.g. for the node_exporter textfile collector.
+
+Every record also carries memory figures, to check that streaming stages run within a
+fixed memory ceiling. `ru_maxrss` is the peak of the whole process lifetime, so on its
+own it only shows the largest stage run so far; the resident set size is therefore also
+sampled in a background thread while the stage runs (`stage_peak_rss_mb`), and the
+growth of the lifetime peaks of the process and of its finished worker processes during
+the stage is reported (`peak_rss_growth_mb`, `peak_workers_rss_growth_mb`).
+
+`Stage.add` only increments counters under a lock; with `progress=True` the clock is read
+once every `PROGRESS_CHECK_EVERY` updates and a progress line with rate and ETA is printed
+at most every `PROGRESS_INTERVAL` seconds, so tracking tight per-file loops is cheap.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import tempfile
+import contextlib
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import paths
+
+METRICS_LOG_FILE = os.environ.get(
+    "RT_METRICS_LOG", os.path.join(paths.DATASETS_DIR, "metrics.jsonl")
+)
+
+PROMETHEUS_FILE = os.environ.get("RT_PROMETHEUS_FILE")
+
+PROGRESS_INTERVAL = 10.0
+
+PROGRESS_CHECK_EVERY = 256
+
+RSS_SAMPLE_INTERVAL = 0.05
+
+METRIC_PREFIX = "rt_pipeline_stage"
+
+RUSAGE_SELF = getattr(resource, "RUSAGE_SELF", 0)
+
+RUSAGE_CHILDREN = getattr(resource, "RUSAGE_CHILDREN", -1)
+
+# metrics exported per stage: (field, prometheus suffix, type, help text)
+_PROMETHEUS_METRICS = [
+    ("seconds", "seconds", "gauge", "Wall time of the stage in seconds."),
+    ("files", "files_total", "counter", "Files processed by the stage."),
+    (
+        "skipped",
+        "skipped_total",
+        "counter",
+        "Files skipped by the stage (already up to date).",
+    ),
+    ("bytes_read", "bytes_read_total", "counter", "Bytes read by the stage."),
+    ("bytes_written", "bytes_written_total", "counter", "Bytes written by the stage."),
+    ("errors", "errors_total", "counter", "Errors raised while processing the stage."),
+    (
+        "peak_rss_bytes",
+        "peak_rss_bytes",
+        "gauge",
+        "Peak resident set size of the process lifetime in bytes.",
+    ),
+    (
+        "stage_peak_rss_bytes",
+        "stage_peak_rss_bytes",
+        "gauge",
+        "Peak resident set size of the process while the stage ran, in bytes.",
+    ),
+]
+
+_finished_stages = {}
+_finished_lock = threading.Lock()
+
+
+def _format_bytes(num_bytes: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1000:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1000
+    return f"{num_bytes:.1f} TB"
+
+
+def peak_rss_bytes(who=RUSAGE_SELF) -> int:
+    """
+    Peak resident set size in bytes of this process (RUSAGE_SELF) or of its terminated
+    child processes (RUSAGE_CHILDREN, the largest one). 0 where `getrusage` is not
+    available (Windows).
+    """
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def peak_rss_mb(who=RUSAGE_SELF) -> float:
+    """Peak resident set size in MiB, see `peak_rss_bytes`."""
+    return peak_rss_bytes(who) / (1024 * 1024)
+
+
+def current_rss_bytes():
+    """Current resident set size of this process in bytes, or None without /proc."""
+    try:
+        with open("/proc/self/statm", "rb") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RSSSampler:
+    """
+    Measures the peak resident set size of the process over one stage.
+
+    The current RSS is sampled every `interval` seconds in a daemon thread. If the
+    lifetime peak (`ru_maxrss`) grew during the stage, that new peak was reached during
+    the stage and is used as well, so short spikes between samples are not missed.
+    Without /proc (e.g. macOS) only the lifetime peak growth is available.
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_peak = peak_rss_bytes()
+        self.start_workers_peak = peak_rss_bytes(RUSAGE_CHILDREN)
+        self.sampled_peak = current_rss_bytes()
+        self.end_peak = None
+        self.end_workers_peak = None
+        self._stop_event = threading.Event()
+        self._thread = None
+        if self.sampled_peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _sample(self) -> None:
+        rss = current_rss_bytes()
+        if rss is not None and rss > self.sampled_peak:
+            self.sampled_peak = rss
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def stop(self) -> None:
+        """Stops sampling and reads the lifetime peaks at the end of the stage."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+            self._sample()
+        self.end_peak = peak_rss_bytes()
+        self.end_workers_peak = peak_rss_bytes(RUSAGE_CHILDREN)
+
+    @property
+    def peak_growth(self) -> int:
+        """Growth of the lifetime peak RSS of the process during the stage, in bytes."""
+        return self.end_peak - self.start_peak
+
+    @property
+    def workers_peak_growth(self) -> int:
+        """Growth of the largest finished worker process peak RSS, in bytes."""
+        return self.end_workers_peak - self.start_workers_peak
+
+    @property
+    def stage_peak(self):
+        """Peak RSS during the stage in bytes, or None if it cannot be measured."""
+        peaks = [self.sampled_peak] if self.sampled_peak is not None else []
+        if self.peak_growth > 0:
+            peaks.append(self.end_peak)
+        return max(peaks) if peaks else None
+
+
+class Stage:
+    """Counters of one pipeline stage. Safe to update from several threads."""
+
+    def __init__(self, name: str, total=None, progress: bool = False):
+        self.name = name
+        self.total = total
+        self.progress = progress
+        self.files = 0
+        self.skipped = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.status = "running"
+        self.started_at = time.time()
+        self._start_time = time.perf_counter()
+        self._end_time = None
+        self._lock = threading.Lock()
+        self._countdown = PROGRESS_CHECK_EVERY
+        self._last_report = self._start_time
+        self._rss = RSSSampler()
+
+    def add(self, files: int = 1, bytes_read: int = 0, bytes_written: int = 0) -> None:
+        """Records processed files and the bytes they read and wrote."""
+        with self._lock:
+            self.files += files
+            self.bytes_read += bytes_read
+            self.bytes_written += bytes_written
+            if self.progress:
+                self._countdown -= 1
+                if self._countdown <= 0:
+                    self._countdown = PROGRESS_CHECK_EVERY
+                    self._maybe_report()
+
+    def skip(self, files: int = 1) -> None:
+        """Records files that did not need processing."""
+        with self._lock:
+            self.skipped += files
+
+    def error(self, count: int = 1) -> None:
+        """Records failed files or operations."""
+        with self._lock:
+            self.errors += count
+
+    @property
+    def seconds(self) -> float:
+        end_time = self._end_time if self._end_time is not None else time.perf_counter()
+        return end_time - self._start_time
+
+    @property
+    def files_per_second(self) -> float:
+        seconds = self.seconds
+        return self.files / seconds if seconds > 0 else 0.0
+
+    def _maybe_report(self) -> None:
+        now = time.perf_counter()
+        if now - self._last_report < PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        rate = self.files_per_second
+        message = f"[{self.name}] {self.files}"
+        if self.total:
+            message += f"/{self.total} files ({100 * self.files / self.total:.0f}%)"
+            if rate > 0:
+                message += f", ETA {(self.total - self.files) / rate:.0f}s"
+        else:
+            message += " files"
+        print(f"{message}, {rate:.0f} files/s")
+
+    def finish(self, status: str = "ok") -> None:
+        self._end_time = time.perf_counter()
+        self.status = status
+        self._rss.stop()
+
+    def to_dict(self) -> dict:
+        seconds = self.seconds
+        if self._rss.end_peak is None:
+            self._rss.stop()
+        stage_peak = self._rss.stage_peak
+        return {
+            "stage": self.name,
+            "status": self.status,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started_at)),
+            "seconds": round(seconds, 6),
+            "total": self.total,
+            "files": self.files,
+            "skipped": self.skipped,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "errors": self.errors,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "peak_workers_rss_mb": round(peak_rss_mb(RUSAGE_CHILDREN), 1),
+            "stage_peak_rss_mb": (
+                round(stage_peak / (1024 * 1024), 1) if stage_peak is not None else None
+            ),
+            "stage_peak_rss_bytes": stage_peak,
+            "peak_rss_growth_mb": round(self._rss.peak_growth / (1024 * 1024), 1),
+            "peak_workers_rss_growth_mb": round(
+                self._rss.workers_peak_growth / (1024 * 1024), 1
+            ),
+            "files_per_second": round(self.files_per_second, 3),
+            "bytes_per_second": round(
+                (self.bytes_read + self.bytes_written) / seconds if seconds > 0 else 0.0, 3
+            ),
+        }
+
+    def summary(self) -> str:
+        parts = [f"{self.files} files"]
+        if self.skipped:
+            parts.append(f"{self.skipped} skipped")
+        if self.bytes_read:
+            parts.append(f"{_format_bytes(self.bytes_read)} read")
+        if self.bytes_written:
+            parts.append(f"{_format_bytes(self.bytes_written)} written")
+        parts.append(f"{self.errors} errors")
+        return (
+            f"[{self.name}] {', '.join(parts)} in {self.seconds:.2f}s "
+            f"({self.files_per_second:.0f} files/s)"
+        )
+
+
+def append_metrics_log(record: dict, log_file=METRICS_LOG_FILE) -> None:
+    """
+    Appends one JSON record to the metrics log. Like the Prometheus export, a failed
+    write is reported but never raised.
+    """
+    if not log_file:
+        return
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        with open(log_file, "a") as file:
+            file.write(json.dumps(record) + "\n")
+    except OSError as e:
+        print(f"Could not append the stage metrics to {log_file}: {e}")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(records) -> str:
+    """Formats stage records in the Prometheus text exposition format."""
+    lines = []
+    for field, suffix, metric_type, help_text in _PROMETHEUS_METRICS:
+        metric = f"{METRIC_PREFIX}_{suffix}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        for record in records:
+            if record[field] is None:
+                continue
+            labels = f'stage="{_escape_label(record["stage"])}",status="{record["status"]}"'
+            lines.append(f"{metric}{{{labels}}} {record[field]}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(prometheus_file=PROMETHEUS_FILE) -> None:
+    """
+    Writes the metrics of every finished stage to a Prometheus text file.
+
+    The file is written to a unique temporary file in the same directory and moved into
+    place, so the collector never sees a partial file and concurrent processes do not
+    write to the same temporary file. A failed export is reported but never raised, it
+    must not fail (or hide the error of) the stage.
+    """
+    if not prometheus_file:
+        return
+    with _finished_lock:
+        records = list(_finished_stages.values())
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{os.path.basename(prometheus_file)}.",
+            suffix=".tmp",
+            dir=os.path.dirname(os.path.abspath(prometheus_file)),
+        )
+        with os.fdopen(fd, "w") as file:
+            file.write(format_prometheus(records))
+        os.replace(tmp_path, prometheus_file)
+    except OSError as e:
+        print(f"Could not write the Prometheus metrics to {prometheus_file}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_finished_stages() -> list:
+    """Returns the records of the stages finished by this process."""
+    with _finished_lock:
+        return list(_finished_stages.values())
+
+
+@contextlib.contextmanager
+def track_stage(name: str, total=None, progress: bool = False, quiet: bool = False):
+    """
+    Tracks a pipeline stage and records its metrics when it ends.
+
+    Args:
+        name (str): Stage name, conventionally "<dataset>.<step>".
+        total (Optional[int]): Expected number of files, used for progress and ETA.
+        progress (bool): Print periodic progress lines while the stage runs.
+        quiet (bool): Do not print the summary line.
+
+    Yields:
+        Stage: The counters of the stage.
+    """
+    stage = Stage(name, total=total, progress=progress)
+    try:
+        yield stage
+    except BaseException:
+        stage.finish("failed")
+        raise
+    else:
+        stage.finish("ok")
+    finally:
+        record = stage.to_dict()
+        with _finished_lock:
+            _finished_stages[name] = record
+        if not quiet:
+            print(stage.summary())
+        append_metrics_log(record)
+        write_prometheus_file()
@@ -0,0 +1,321 @@
+"""
+Strategies for placing source images into the processed split directories.
+
+    copy      - a full copy of the file (the original behaviour)
+    hardlink  - a second directory entry for the same file, no extra space
+    symlink   - a symbolic link to the absolute source path
+    reflink   - a copy-on-write clone (btrfs, xfs, ...), no extra space until modified
+    manifest  - nothing is written under the split directories; the assignment is only
+                recorded in the split manifest
+
+Link and clone modes fall back to a plain copy when the filesystem does not support them
+(e.g. hardlinks across devices), so every mode always produces a usable layout.
+
+Every materialized file is also recorded in `<dataset>/split_manifest.csv`
+(id,label,split,source_path), which `create_test_key.py` can read instead of walking the
+split directories. Next to it, `<dataset>/split_table/` holds the same id, label and
+split columns as a dictionary-encoded table that can be queried by split and label
+without reading the whole manifest (see split_table.py). The mode the files were placed
+with is recorded in `<dataset>/materialize_mode.txt`, so `sync_split_dirs` can tell when
+the mode changed.
+"""
+
+import os
+import csv
+import stat
+import shutil
+
+from split_table import SPLIT_TABLE_DIR_NAME, write_split_table
+
+MATERIALIZE_MODES = ["copy", "hardlink", "symlink", "reflink", "manifest"]
+
+SPLIT_MANIFEST_FILE_NAME = "split_manifest.csv"
+
+SPLIT_MANIFEST_COLUMNS = ["id", "label", "split", "source_path"]
+
+MATERIALIZE_MODE_FILE_NAME = "materialize_mode.txt"
+
+# FICLONE ioctl request number on Linux
+_FICLONE = 0x40049409
+
+
+def reflink_file(src: str, dst: str) -> None:
+    """Creates a copy-on-write clone of `src` at `dst` (Linux FICLONE)."""
+    import fcntl
+
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError:
+            dst_file.close()
+            os.remove(dst)
+            raise
+
+
+def _materialize(src: str, dst: str, mode: str) -> None:
+    if mode == "copy":
+        shutil.copy(src, dst)
+    elif mode == "hardlink":
+        os.link(src, dst)
+    elif mode == "symlink":
+        os.symlink(os.path.abspath(src), dst)
+    elif mode == "reflink":
+        reflink_file(src, dst)
+    else:
+        raise ValueError(f"Unknown materialize mode '{mode}'")
+
+
+def materialize_file(src: str, dst: str, mode: str = "copy") -> str:
+    """
+    Places `src` at `dst` using the given mode, falling back to a copy if needed.
+
+    Args:
+        src (str): Path of the source file.
+        dst (str): Destination file path. An existing file at `dst` is replaced.
+        mode (str): One of copy, hardlink, symlink or reflink.
+
+    Returns:
+        str: The mode that was actually used.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode != "copy":
+        try:
+            _materialize(src, dst, mode)
+            return mode
+        except (OSError, NotImplementedError, ImportError):
+            # not supported by this filesystem/platform: fall back to a copy
+            if os.path.lexists(dst):
+                os.remove(dst)
+    _materialize(src, dst, "copy")
+    return "copy"
+
+
+class Materializer:
+    """
+    Materializes files into `<dataset_dir>/<split>/<label>/` and records a split manifest.
+
+    Label directories are created once, and the number of files placed with each mode is
+    counted so fallbacks are visible:
+
+        with Materializer(dataset_dir, mode="hardlink") as materializer:
+            materializer.add(file_path, "training", label)
+    """
+
+    def __init__(self, dataset_dir: str, mode: str = "copy", manifest_file=None):
+        if mode not in MATERIALIZE_MODES:
+            raise ValueError(
+                f"Unknown materialize mode '{mode}', expected one of {MATERIALIZE_MODES}"
+            )
+        self.dataset_dir = dataset_dir
+        self.mode = mode
+        self.manifest_file = manifest_file or os.path.join(
+            dataset_dir, SPLIT_MANIFEST_FILE_NAME
+        )
+        self.counts = {}
+        self._created_dirs = set()
+        self._rows = []
+
+    def add(self, file_path: str, split_name: str, class_label: str, file_id=None) -> str:
+        """Places one file into its split/label directory and returns its id."""
+        file_id = file_id or os.path.basename(file_path)
+        self._rows.append([file_id, class_label, split_name, os.path.abspath(file_path)])
+        if self.mode == "manifest":
+            used_mode = "manifest"
+        else:
+            destination_dir = os.path.join(self.dataset_dir, split_name, class_label)
+            if destination_dir not in self._created_dirs:
+                os.makedirs(destination_dir, exist_ok=True)
+                self._created_dirs.add(destination_dir)
+            used_mode = materialize_file(
+                file_path, os.path.join(destination_dir, file_id), self.mode
+            )
+        self.counts[used_mode] = self.counts.get(used_mode, 0) + 1
+        return file_id
+
+    def close(self) -> None:
+        """Writes the split manifest and records the materialize mode."""
+        write_split_manifest(self.manifest_file, self._rows)
+        write_materialize_mode(self.dataset_dir, self.mode)
+        if self.counts:
+            summary = ", ".join(f"{n} {m}" for m, n in sorted(self.counts.items()))
+            print(f"Materialized files into {self.dataset_dir}: {summary}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a failed run must not replace the manifest with a partial one
+        if exc_type is None:
+            self.close()
+
+
+def write_split_manifest(manifest_file: str, rows) -> None:
+    """
+    Writes (id, label, split, source_path) rows to a split manifest CSV file and the
+    split table next to it.
+    """
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    os.makedirs(manifest_dir, exist_ok=True)
+    with open(manifest_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(SPLIT_MANIFEST_COLUMNS)
+        writer.writerows(rows)
+    ids, labels, splits = ([row[i] for row in rows] for i in range(3))
+    write_split_table(os.path.join(manifest_dir, SPLIT_TABLE_DIR_NAME), ids, labels, splits)
+
+
+def read_materialize_mode(dataset_dir: str):
+    """Returns the mode the split directories were materialized with, None if unknown."""
+    try:
+        with open(os.path.join(dataset_dir, MATERIALIZE_MODE_FILE_NAME), "r") as file:
+            return file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_materialize_mode(dataset_dir: str, mode: str) -> None:
+    """Records the mode the split directories were materialized with."""
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(os.path.join(dataset_dir, MATERIALIZE_MODE_FILE_NAME), "w") as file:
+        file.write(mode)
+
+
+def read_split_manifest(manifest_file: str, split_name=None):
+    """
+    Reads the rows of a split manifest CSV file.
+
+    Args:
+        manifest_file (str): Path to the split manifest.
+        split_name (Optional[str]): Only return rows of this split.
+
+    Returns:
+        List[dict]: One dict per row with the keys id, label, split and source_path.
+    """
+    with open(manifest_file, "r", newline="") as file:
+        rows = csv.DictReader(file)
+        return [r for r in rows if split_name is None or r["split"] == split_name]
+
+
+def scan_split_dirs(dataset_dir: str, split_names=("training", "validation", "testing")):
+    """Returns {id: (split, label)} for the files currently under the split directories."""
+    current = {}
+    for split_name in split_names:
+        split_dir = os.path.join(dataset_dir, split_name)
+        if not os.path.isdir(split_dir):
+            continue
+        for label_entry in os.scandir(split_dir):
+            if not label_entry.is_dir():
+                continue
+            for file_entry in os.scandir(label_entry.path):
+                if not file_entry.name.startswith("."):
+                    current[file_entry.name] = (split_name, label_entry.name)
+    return current
+
+
+def is_materialized_current(source_path: str, destination: str) -> bool:
+    """
+    Checks whether a materialized file still reflects its source.
+
+    A symlink must point to the source path and a hardlink must share the source's inode.
+    A copy or clone must have the size of the source and must not be older than it
+    (copies get the time they were made as their mtime). A missing source counts as
+    current, there is nothing to materialize the file from again.
+    """
+    try:
+        source_stat = os.stat(source_path)
+    except FileNotFoundError:
+        return True
+    destination_stat = os.lstat(destination)
+    if stat.S_ISLNK(destination_stat.st_mode):
+        return os.readlink(destination) == os.path.abspath(source_path)
+    if (destination_stat.st_dev, destination_stat.st_ino) == (
+        source_stat.st_dev,
+        source_stat.st_ino,
+    ):
+        return True
+    return (
+        destination_stat.st_size == source_stat.st_size
+        and destination_stat.st_mtime_ns >= source_stat.st_mtime_ns
+    )
+
+
+def _remove_empty_dirs(dir_paths) -> None:
+    for dir_path in dir_paths:
+        if os.path.isdir(dir_path) and not os.listdir(dir_path):
+            os.rmdir(dir_path)
+
+
+def sync_split_dirs(dataset_dir: str, rows, mode: str = "copy") -> dict:
+    """
+    Brings the split directories in line with a target assignment, touching only the
+    files whose assignment or source changed.
+
+    Files missing from the split directories are materialized, files no longer in the
+    assignment are removed and files assigned to another split or label are moved.
+    Files whose source changed since they were materialized (see
+    `is_materialized_current`) are materialized again, and label directories left
+    empty are removed. If the recorded mode differs from `mode`, every kept file is
+    materialized again with the new mode; switching to "manifest" removes the files
+    from the split directories. The split manifest and the mode are only written once
+    the split directories are in line, so a failed sync leaves the previous ones.
+
+    Args:
+        dataset_dir (str): The processed dataset directory.
+        rows (List[Tuple[str, str, str, str]]): (id, label, split, source_path) of every file.
+        mode (str): Materialize mode.
+
+    Returns:
+        dict: The number of added, removed, moved, updated and unchanged files.
+    """
+    if mode not in MATERIALIZE_MODES:
+        raise ValueError(
+            f"Unknown materialize mode '{mode}', expected one of {MATERIALIZE_MODES}"
+        )
+    rows = [tuple(row) for row in rows]
+    counts = {"added": 0, "removed": 0, "moved": 0, "updated": 0, "unchanged": 0}
+    previous_mode = read_materialize_mode(dataset_dir)
+    # without a recorded mode the files are assumed to match the requested one
+    mode_changed = previous_mode is not None and previous_mode != mode
+
+    split_names = sorted({row[2] for row in rows} | {"training", "validation", "testing"})
+    current = scan_split_dirs(dataset_dir, split_names)
+    target = {row[0]: row for row in rows}
+    vacated_dirs = set()
+
+    for file_id, (split_name, label) in current.items():
+        if file_id not in target or mode == "manifest":
+            os.remove(os.path.join(dataset_dir, split_name, label, file_id))
+            vacated_dirs.add(os.path.join(dataset_dir, split_name, label))
+            counts["removed"] += 1
+
+    created_dirs = set()
+    for file_id, label, split_name, source_path in rows:
+        if mode == "manifest":
+            counts["unchanged"] += 1
+            continue
+        destination_dir = os.path.join(dataset_dir, split_name, label)
+        destination = os.path.join(destination_dir, file_id)
+        if destination_dir not in created_dirs:
+            os.makedirs(destination_dir, exist_ok=True)
+            created_dirs.add(destination_dir)
+        if file_id not in current:
+            materialize_file(source_path, destination, mode)
+            counts["added"] += 1
+            continue
+        moved = current[file_id] != (split_name, label)
+        if moved:
+            old_split, old_label = current[file_id]
+            os.replace(os.path.join(dataset_dir, old_split, old_label, file_id), destination)
+            vacated_dirs.add(os.path.join(dataset_dir, old_split, old_label))
+            counts["moved"] += 1
+        if mode_changed or not is_materialized_current(source_path, destination):
+            materialize_file(source_path, destination, mode)
+            counts["updated"] += 1
+        elif not moved:
+            counts["unchanged"] += 1
+    _remove_empty_dirs(vacated_dirs)
+
+    write_split_manifest(os.path.join(dataset_dir, SPLIT_MANIFEST_FILE_NAME), rows)
+    write_materialize_mode(dataset_dir, mode)
+    return counts
@@ -0,0 +1,378 @@
+"""
+Single entry point that builds the processed datasets.
+
+Every dataset is described as a small DAG of stages (download, extract, export, split,
+materialize, test key, ...). A stage is skipped when its fingerprint matches the one
+recorded by its last successful run and its outputs still exist. The fingerprint covers:
+
+    - the content of the stage's input files (scripts, notebooks, split files, ...),
+    - the path, size and mtime of every file under the stage's input directories,
+    - the fingerprints of the stages it depends on,
+
+so editing a script, adding downloaded images or re-running an upstream stage re-runs
+exactly the stages downstream of the change. Datasets are independent of each other and
+are built concurrently, each in its own worker process:
+
+    python pipeline.py                       # build (or update) every dataset
+    python pipeline.py mnist vision --jobs 2
+    python pipeline.py --dry-run             # show which stages would run
+    python pipeline.py cifar10 --force       # re-run every stage of cifar10
+
+The notebook datasets are built by executing the code cells of their notebooks, the
+Vision and CUB-200-2011 datasets by calling the functions of their scripts.
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import importlib
+import traceback
+import concurrent.futures
+from collections import namedtuple
+from graphlib import TopologicalSorter
+
+import paths
+from instrumentation import track_stage
+
+PIPELINE_STATE_FILE = os.path.join(paths.DATASETS_DIR, ".pipeline_state.json")
+
+VISION_DIR = os.path.join(paths.RAW_DIR, "vision")
+CUB_DIR = os.path.join(paths.RAW_DIR, "cub_200_2011")
+
+# used by f1_get_vision_dataset_files.py when run as a script
+VISION_MAX_FILES = 500000
+
+# notebook that exports each of the small datasets, relative to the raw directory
+NOTEBOOKS = {
+    "mnist": os.path.join("mnist", "process_mnist_data.ipynb"),
+    "fashion_mnist": os.path.join("fashion_mnist", "process_fashion_mnist_data.ipynb"),
+    "mini_mnist": os.path.join("mini_mnist", "process_mini_mnist_dataset.ipynb"),
+    "cifar10": os.path.join("cifar10", "process_cifar10_data.ipynb"),
+    "cifar100": os.path.join("cifar100", "process_cifar100_data.ipynb"),
+}
+
+DATASET_NAMES = ["vision", "cub_200_2011"] + list(NOTEBOOKS)
+
+# name: stage name, unique within its dataset
+# run: callable executing the stage; raises on failure
+# deps: names of the stages that must run first
+# inputs: files (hashed by content) and directories (hashed by file metadata)
+# outputs: paths that must exist for the stage to be considered done
+Stage = namedtuple("Stage", ["name", "run", "deps", "inputs", "outputs"])
+
+
+def _root_file(file_name: str) -> str:
+    return os.path.join(paths.ROOT_DIR, file_name)
+
+
+def _import_from(directory: str, module_name: str):
+    """Imports a script module from a dataset directory (e.g. the Vision f1_...f4_)."""
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    return importlib.import_module(module_name)
+
+
+def run_notebook(notebook_file: str) -> None:
+    """
+    Executes the code cells of a notebook in order, from the notebook's directory.
+
+    Cells run in one shared namespace, as in a kernel. IPython magics and shell escapes
+    are not supported (the dataset notebooks do not use any).
+    """
+    with open(notebook_file, "r", encoding="utf-8") as file:
+        notebook = json.load(file)
+    namespace = {"__name__": "__main__", "__file__": notebook_file}
+    previous_dir = os.getcwd()
+    os.chdir(os.path.dirname(os.path.abspath(notebook_file)))
+    try:
+        for idx, cell in enumerate(notebook["cells"]):
+            if cell["cell_type"] != "code":
+                continue
+            source = "".join(cell["source"])
+            exec(compile(source, f"{notebook_file}:cell{idx}", "exec"), namespace)
+    finally:
+        os.chdir(previous_dir)
+
+
+def _test_key_stage(dataset_path: str, deps) -> Stage:
+    from create_test_key import create_dataset_test_keys
+
+    dataset_name = os.path.basename(dataset_path)
+    return Stage(
+        name="test_key",
+        run=lambda: create_dataset_test_keys(dataset_path),
+        deps=deps,
+        inputs=[
+            _root_file("create_test_key.py"),
+            _root_file("split_table.py"),
+            os.path.join(dataset_path, "testing"),
+        ],
+        outputs=[os.path.join(dataset_path, f"{dataset_name}_test_key.csv")],
+    )
+
+
+def _split_dirs(dataset_path: str, split_names=("training", "testing")):
+    return [os.path.join(dataset_path, split_name) for split_name in split_names]
+
+
+def vision_stages():
+    constants = _import_from(VISION_DIR, "constants")
+    script = lambda name: os.path.join(VISION_DIR, f"{name}.py")
+
+    def download():
+        f1 = _import_from(VISION_DIR, "f1_get_vision_dataset_files")
+        _, _, failed = f1.download_vision_data(max_files=VISION_MAX_FILES)
+        if failed:
+            raise RuntimeError(f"{len(failed)} Vision files could not be downloaded")
+
+    def split():
+        _import_from(VISION_DIR, "f3_train_test_split").create_train_valid_test_splits()
+
+    def split_file():
+        _import_from(VISION_DIR, "f4_create_split_file").generate_data_split_file()
+
+    processed_dir = constants.PROCESSED_VISION_DIR
+    return [
+        Stage(
+            name="download",
+            run=download,
+            deps=[],
+            inputs=[
+                constants.FOLDER_MAP_FILE,
+                script("f1_get_vision_dataset_files"),
+                script("folder_map"),
+            ],
+            outputs=[constants.RAW_DATA_DIR],
+        ),
+        Stage(
+            name="split",
+            run=split,
+            deps=["download"],
+            inputs=[
+                constants.RAW_DATA_DIR,
+                script("f3_train_test_split"),
+                _root_file("splitter.py"),
+                _root_file("materialize.py"),
+                _root_file("split_table.py"),
+            ],
+            outputs=[constants.TRAIN_TEST_SPLIT_CSV_FILE]
+            + _split_dirs(processed_dir, ("training", "validation", "testing")),
+        ),
+        Stage(
+            name="split_file",
+            run=split_file,
+            deps=["split"],
+            inputs=[script("f4_create_split_file"), _root_file("split_table.py")],
+            outputs=[constants.TRAIN_TEST_SPLIT_FILE],
+        ),
+        _test_key_stage(processed_dir, deps=["split"]),
+    ]
+
+
+def cub_200_2011_stages():
+    stream_extract = _import_from(CUB_DIR, "stream_extract")
+    # archive downloaded by get_files.py, streamed from the URL when absent
+    archive_file = os.path.join(CUB_DIR, "data", "cub_200_2011.tgz")
+    source = archive_file if os.path.exists(archive_file) else stream_extract.URL
+
+    return [
+        Stage(
+            name="extract",
+            run=lambda: stream_extract.stream_dataset(source),
+            deps=[],
+            inputs=[
+                stream_extract.TRAIN_TEST_SPLIT_FILE,
+                os.path.join(CUB_DIR, "stream_extract.py"),
+                _root_file("materialize.py"),
+                _root_file("split_table.py"),
+            ]
+            + ([archive_file] if source == archive_file else []),
+            outputs=_split_dirs(stream_extract.PROCESSED_DIR),
+        ),
+        _test_key_stage(stream_extract.PROCESSED_DIR, deps=["extract"]),
+    ]
+
+
+def notebook_stages(dataset_name: str):
+    notebook_file = os.path.join(paths.RAW_DIR, NOTEBOOKS[dataset_name])
+    dataset_path = os.path.join(paths.PROCESSED_DIR, dataset_name)
+    return [
+        Stage(
+            name="export",
+            run=lambda: run_notebook(notebook_file),
+            deps=[],
+            inputs=[
+                notebook_file,
+                _root_file("dataset_readers.py"),
+                _root_file("image_export.py"),
+                _root_file("image_formats.py"),
+            ],
+            outputs=_split_dirs(dataset_path),
+        ),
+        _test_key_stage(dataset_path, deps=["export"]),
+    ]
+
+
+def get_dataset_stages(dataset_name: str):
+    """Returns the stages of a dataset."""
+    if dataset_name == "vision":
+        return vision_stages()
+    if dataset_name == "cub_200_2011":
+        return cub_200_2011_stages()
+    if dataset_name in NOTEBOOKS:
+        return notebook_stages(dataset_name)
+    raise ValueError(f"Unknown dataset '{dataset_name}', expected one of {DATASET_NAMES}")
+
+
+def _update_with_tree(digest, dir_path: str) -> None:
+    for root, dirs, files in os.walk(dir_path):
+        dirs.sort()
+        for file_name in sorted(files):
+            if file_name.startswith("."):
+                continue
+            file_path = os.path.join(root, file_name)
+            stat = os.stat(file_path)
+            relative_path = os.path.relpath(file_path, dir_path)
+            digest.update(f"{relative_path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+
+
+def _update_with_file(digest, file_path: str) -> None:
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+
+def fingerprint(stage: Stage, dep_fingerprints) -> str:
+    """Fingerprint of a stage's inputs and of the stages it depends on."""
+    digest = hashlib.sha256(stage.name.encode())
+    for dep_fingerprint in dep_fingerprints:
+        digest.update(dep_fingerprint.encode())
+    for input_path in stage.inputs:
+        digest.update(f"\0{os.path.relpath(input_path, paths.ROOT_DIR)}\0".encode())
+        if os.path.isdir(input_path):
+            _update_with_tree(digest, input_path)
+        elif os.path.isfile(input_path):
+            _update_with_file(digest, input_path)
+        else:
+            digest.update(b"<missing>")
+    return digest.hexdigest()
+
+
+def run_dataset(dataset_name: str, state: dict, force: bool = False, dry_run: bool = False):
+    """
+    Runs the stages of one dataset in dependency order, skipping up-to-date ones.
+
+    Args:
+        dataset_name (str): Name of the dataset.
+        state (dict): {stage name: fingerprint} of the last successful runs.
+        force (bool): Run every stage.
+        dry_run (bool): Only report which stages would run.
+
+    Returns:
+        dict: The updated state, the outcome of every stage and the error, if any.
+    """
+    stages = {stage.name: stage for stage in get_dataset_stages(dataset_name)}
+    order = TopologicalSorter({name: stage.deps for name, stage in stages.items()})
+    state = dict(state)
+    fingerprints = {}
+    outcomes = {}
+    error = None
+    for name in order.static_order():
+        stage = stages[name]
+        if error is not None:
+            outcomes[name] = "not run"
+            continue
+        stage_fingerprint = fingerprint(stage, [fingerprints[dep] for dep in stage.deps])
+        fingerprints[name] = stage_fingerprint
+        if (
+            not force
+            and state.get(name) == stage_fingerprint
+            and all(os.path.exists(path) for path in stage.outputs)
+        ):
+            outcomes[name] = "up to date"
+            continue
+        if dry_run:
+            outcomes[name] = "would run"
+            continue
+        print(f"[{dataset_name}] running stage '{name}'...")
+        try:
+            with track_stage(f"pipeline.{dataset_name}.{name}", quiet=True):
+                stage.run()
+        except Exception:
+            error = traceback.format_exc()
+            outcomes[name] = "failed"
+            state.pop(name, None)
+            continue
+        outcomes[name] = "done"
+        state[name] = stage_fingerprint
+    return {"dataset": dataset_name, "state": state, "outcomes": outcomes, "error": error}
+
+
+def load_state(state_file: str = PIPELINE_STATE_FILE) -> dict:
+    """Returns {dataset: {stage: fingerprint}} of the last successful stage runs."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, "r") as file:
+        return json.load(file)
+
+
+def save_state(state: dict, state_file: str = PIPELINE_STATE_FILE) -> None:
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, state_file)
+
+
+def run_pipeline(dataset_names=DATASET_NAMES, jobs=None, force=False, dry_run=False):
+    """
+    Builds several datasets concurrently, one worker process per dataset.
+
+    Each worker is used for a single dataset, so the working directory and module state
+    of one dataset's scripts never leak into another's.
+
+    Returns:
+        bool: Whether every stage succeeded.
+    """
+    unknown = [name for name in dataset_names if name not in DATASET_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown datasets {unknown}, expected some of {DATASET_NAMES}")
+    state = load_state()
+    jobs = jobs or min(len(dataset_names), os.cpu_count() or 1)
+    success = True
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, max_tasks_per_child=1
+    ) as executor:
+        futures = [
+            executor.submit(run_dataset, name, state.get(name, {}), force, dry_run)
+            for name in dataset_names
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            dataset_name = result["dataset"]
+            if not dry_run:
+                state[dataset_name] = result["state"]
+                save_state(state)
+            outcomes = ", ".join(f"{n}: {o}" for n, o in result["outcomes"].items())
+            print(f"[{dataset_name}] {outcomes}")
+            if result["error"]:
+                success = False
+                print(f"[{dataset_name}] failed:\n{result['error']}")
+    return success
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the processed datasets.")
+    parser.add_argument(
+        "datasets", nargs="*", help=f"Datasets to build (default: all of {DATASET_NAMES})."
+    )
+    parser.add_argument("--jobs", type=int, default=None, help="Datasets built at once.")
+    parser.add_argument("--force", action="store_true", help="Ignore the fingerprints.")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the stages to run.")
+    args = parser.parse_args()
+
+    ok = run_pipeline(
+        args.datasets or DATASET_NAMES, jobs=args.jobs, force=args.force, dry_run=args.dry_run
+    )
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,377 @@
+"""
+Scores prediction files against the test keys (`<dataset>/<dataset>_test_key.csv`).
+
+The test key is loaded once into an array of class indices aligned with the sorted ids
+and cached as `<dataset>_test_key.npz` next to the CSV; the cache is rebuilt whenever
+the CSV changes. A prediction file is a CSV with an `id` column and either
+
+    - one label column (hard labels):           id,label
+    - one probability column per class:          id,<class 1>,<class 2>,...
+
+Probability columns are matched to the classes by name, in any order. All metrics are
+computed with vectorized NumPy over the aligned arrays:
+
+    accuracy, top-k accuracy (probabilities only), macro-F1, log-loss (probabilities
+    only) and the confusion matrix (rows: true class, columns: predicted class).
+
+Test ids missing from a prediction file count as wrong (and as a uniform probability
+for the log-loss); ids that are not in the test key are ignored and counted.
+
+    python scoring.py cifar100 submissions/*.csv --top-k 1 5 --output scores.csv
+"""
+
+import os
+import csv
+import argparse
+import functools
+import concurrent.futures
+
+import numpy as np
+
+from dataset_files import get_dataset_path
+
+TEST_KEY_CACHE_SUFFIX = ".npz"
+
+DEFAULT_TOP_K = (1, 5)
+
+LOG_LOSS_EPS = 1e-15
+
+SCORE_COLUMNS = [
+    "submission",
+    "accuracy",
+    "macro_f1",
+    "log_loss",
+    "missing",
+    "unknown",
+    "error",
+]
+
+
+class TestKey:
+    """Test key as arrays: sorted `ids`, `targets` (class indices) and `class_names`."""
+
+    def __init__(self, ids: np.ndarray, targets: np.ndarray, class_names):
+        self.ids = ids
+        self.targets = targets
+        self.class_names = list(class_names)
+        self._class_index = {name: i for i, name in enumerate(self.class_names)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def num_classes(self) -> int:
+        return len(self.class_names)
+
+    def class_indices(self, class_names) -> np.ndarray:
+        """Returns the class index of each name; unknown names get -1."""
+        unique, inverse = np.unique(np.asarray(class_names, dtype=str), return_inverse=True)
+        codes = np.array(
+            [self._class_index.get(name, -1) for name in unique], dtype=np.int64
+        )
+        return codes[inverse]
+
+    def align(self, ids) -> tuple:
+        """
+        Maps prediction ids to rows of the test key.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: The test key row of each prediction and a mask
+                                           of the predictions whose id is in the key.
+        """
+        ids = np.asarray(ids, dtype=str)
+        if len(self.ids) == 0:
+            return np.zeros(len(ids), dtype=np.int64), np.zeros(len(ids), dtype=bool)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return rows, self.ids[rows] == ids
+
+
+def get_test_key_file(dataset_path: str) -> str:
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    return os.path.join(dataset_path, f"{dataset_name}_test_key.csv")
+
+
+def _read_test_key_csv(key_file: str) -> TestKey:
+    with open(key_file, "r", newline="") as file:
+        reader = csv.reader(file)
+        if next(reader, None) is None:
+            raise ValueError(f"Empty test key {key_file}")
+        rows = list(reader)
+    ids = np.array([row[0] for row in rows], dtype=str)
+    class_names, targets = np.unique(
+        np.array([row[1] for row in rows], dtype=str), return_inverse=True
+    )
+    order = np.argsort(ids, kind="stable")
+    if len(ids) and np.any(ids[order][1:] == ids[order][:-1]):
+        raise ValueError(f"Duplicate ids in test key {key_file}")
+    return TestKey(ids[order], targets[order].astype(np.int32), class_names.tolist())
+
+
+def load_test_key(key_file: str, use_cache: bool = True) -> TestKey:
+    """
+    Loads a test key CSV file, using (and refreshing) its binary cache.
+
+    Args:
+        key_file (str): Path to `<dataset>_test_key.csv`.
+        use_cache (bool): Read and write `<dataset>_test_key.npz`.
+
+    Returns:
+        TestKey: The test key.
+    """
+    stat = os.stat(key_file)
+    source = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+    cache_file = os.path.splitext(key_file)[0] + TEST_KEY_CACHE_SUFFIX
+    if use_cache and os.path.exists(cache_file):
+        with np.load(cache_file) as cached:
+            if np.array_equal(cached["source"], source):
+                return TestKey(
+                    cached["ids"], cached["targets"], cached["class_names"].tolist()
+                )
+
+    test_key = _read_test_key_csv(key_file)
+    if use_cache:
+        tmp_file = f"{cache_file}.tmp"
+        with open(tmp_file, "wb") as file:
+            np.savez(
+                file,
+                ids=test_key.ids,
+                targets=test_key.targets,
+                class_names=np.array(test_key.class_names, dtype=str),
+                source=source,
+            )
+        os.replace(tmp_file, cache_file)
+    return test_key
+
+
+# each worker process loads a test key once
+_load_test_key_cached = functools.lru_cache(maxsize=None)(load_test_key)
+
+
+def read_predictions(prediction_file: str, test_key: TestKey):
+    """
+    Reads a prediction file.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The ids and either the predicted class indices
+                                       (N,) or the probabilities (N, num_classes).
+    """
+    with open(prediction_file, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader, None)
+        if header is None:
+            raise ValueError(f"Empty prediction file {prediction_file}")
+        rows = list(reader)
+    ids = np.array([row[0] for row in rows], dtype=str)
+    if len(header) == 2 and header[1] not in test_key.class_names:
+        return ids, test_key.class_indices([row[1] for row in rows])
+
+    columns = test_key.class_indices(header[1:])
+    if np.any(columns < 0):
+        unknown = [name for name, i in zip(header[1:], columns) if i < 0]
+        raise ValueError(f"Unknown class columns in {prediction_file}: {unknown[:5]}")
+    values = np.array([row[1:] for row in rows], dtype=np.float64).reshape(len(rows), -1)
+    probabilities = np.zeros((len(rows), test_key.num_classes))
+    probabilities[:, columns] = values
+    return ids, probabilities
+
+
+def confusion_matrix(targets: np.ndarray, predictions: np.ndarray, num_classes: int):
+    """
+    Returns the (num_classes, num_classes) confusion matrix. Predictions of -1 (missing
+    or unknown labels) are not counted in any column.
+    """
+    valid = predictions >= 0
+    flat = targets[valid].astype(np.int64) * num_classes + predictions[valid]
+    return np.bincount(flat, minlength=num_classes * num_classes).reshape(
+        num_classes, num_classes
+    )
+
+
+def macro_f1(confusion: np.ndarray, support: np.ndarray) -> float:
+    """Macro-averaged F1 over the classes present in the test key."""
+    true_positives = np.diag(confusion).astype(np.float64)
+    predicted = confusion.sum(axis=0)
+    denominator = predicted + support
+    f1 = np.divide(
+        2 * true_positives,
+        denominator,
+        out=np.zeros_like(true_positives),
+        where=denominator > 0,
+    )
+    return float(f1[support > 0].mean()) if np.any(support > 0) else 0.0
+
+
+def top_k_accuracy(probabilities: np.ndarray, targets: np.ndarray, k: int, present=None):
+    """
+    Fraction of rows whose target is among the k most probable classes. Rows not in
+    `present` (missing predictions) count as wrong.
+    """
+    k = min(k, probabilities.shape[1])
+    top_k = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    hits = np.any(top_k == targets[:, None], axis=1)
+    if present is not None:
+        hits &= present
+    return float(np.mean(hits)) if len(hits) else 0.0
+
+
+def log_loss(probabilities: np.ndarray, targets: np.ndarray) -> float:
+    """Mean negative log-probability of the targets; rows are normalized to sum to 1."""
+    totals = probabilities.sum(axis=1, keepdims=True)
+    probabilities = np.divide(
+        probabilities,
+        totals,
+        out=np.full_like(probabilities, 1.0 / probabilities.shape[1]),
+        where=totals > 0,
+    )
+    target_probabilities = probabilities[np.arange(len(targets)), targets]
+    return float(-np.mean(np.log(np.clip(target_probabilities, LOG_LOSS_EPS, 1.0))))
+
+
+def score_arrays(test_key: TestKey, ids, predictions, top_k=DEFAULT_TOP_K, confusion=False):
+    """
+    Scores predictions that are already in memory.
+
+    Args:
+        test_key (TestKey): The test key.
+        ids (np.ndarray): Prediction ids.
+        predictions (np.ndarray): Class indices (N,) or probabilities (N, num_classes).
+        top_k (Tuple[int]): k values of the top-k accuracies (probabilities only).
+        confusion (bool): Include the confusion matrix in the result.
+
+    Returns:
+        dict: The metrics, the number of missing and unknown ids and, optionally, the
+              confusion matrix.
+    """
+    rows, known = test_key.align(ids)
+    if len(np.unique(rows[known])) < int(known.sum()):
+        raise ValueError("Duplicate ids in the predictions")
+
+    # scatter the predictions onto the test key rows; missing rows stay "no prediction"
+    is_probabilities = predictions.ndim == 2
+    if is_probabilities:
+        num_classes = test_key.num_classes
+        aligned = np.full((len(test_key), num_classes), 1.0 / num_classes)
+    else:
+        aligned = np.full(len(test_key), -1, dtype=np.int64)
+    aligned[rows[known]] = predictions[known]
+    present = np.zeros(len(test_key), dtype=bool)
+    present[rows[known]] = True
+
+    targets = test_key.targets
+    if is_probabilities:
+        predicted = np.where(present, np.argmax(aligned, axis=1), -1)
+    else:
+        predicted = aligned
+    matrix = confusion_matrix(targets, predicted, test_key.num_classes)
+    support = np.bincount(targets, minlength=test_key.num_classes)
+
+    result = {
+        "accuracy": float(np.mean(predicted == targets)) if len(targets) else 0.0,
+        "macro_f1": macro_f1(matrix, support),
+        "log_loss": log_loss(aligned, targets) if is_probabilities else None,
+        "missing": int(len(test_key) - present.sum()),
+        "unknown": int((~known).sum()),
+    }
+    if is_probabilities:
+        for k in top_k:
+            result[f"top_{k}_accuracy"] = top_k_accuracy(aligned, targets, k, present)
+    if confusion:
+        result["confusion_matrix"] = matrix
+    return result
+
+
+def score_file(key_file: str, prediction_file: str, top_k=DEFAULT_TOP_K, confusion=False):
+    """Scores one prediction file against a test key CSV file."""
+    test_key = _load_test_key_cached(key_file)
+    ids, predictions = read_predictions(prediction_file, test_key)
+    return score_arrays(test_key, ids, predictions, top_k=top_k, confusion=confusion)
+
+
+def _score_submission(key_file: str, prediction_file: str, top_k) -> dict:
+    """Scores one submission. Runs in a worker process; errors are reported, not raised."""
+    try:
+        result = score_file(key_file, prediction_file, top_k=top_k)
+        result["error"] = ""
+    except (OSError, ValueError, IndexError, csv.Error) as e:
+        result = {"error": str(e)}
+    result["submission"] = prediction_file
+    return result
+
+
+def score_submissions(key_file: str, prediction_files, top_k=DEFAULT_TOP_K, workers=None):
+    """
+    Scores many prediction files against one test key with a process pool.
+
+    The test key cache is refreshed once up front, so every worker only loads the
+    binary cache (once per process).
+
+    Returns:
+        List[dict]: The results, in the order of `prediction_files`.
+    """
+    load_test_key(key_file)
+    prediction_files = list(prediction_files)
+    chunksize = max(1, len(prediction_files) // (4 * (workers or os.cpu_count() or 1)))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                _score_submission,
+                [key_file] * len(prediction_files),
+                prediction_files,
+                [tuple(top_k)] * len(prediction_files),
+                chunksize=chunksize,
+            )
+        )
+
+
+def write_scores(output_file: str, results, top_k=DEFAULT_TOP_K) -> None:
+    columns = SCORE_COLUMNS[:3] + [f"top_{k}_accuracy" for k in top_k] + SCORE_COLUMNS[3:]
+    with open(output_file, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=columns, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score prediction files.")
+    parser.add_argument("dataset", help="Processed dataset name or test key CSV path.")
+    parser.add_argument("predictions", nargs="+", help="Prediction CSV files.")
+    parser.add_argument("--top-k", type=int, nargs="+", default=list(DEFAULT_TOP_K))
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write the scores to a CSV file.")
+    parser.add_argument(
+        "--confusion",
+        default=None,
+        help="Save the confusion matrix of a single prediction file as .npy.",
+    )
+    args = parser.parse_args()
+
+    key_file = (
+        args.dataset
+        if args.dataset.endswith(".csv")
+        else get_test_key_file(get_dataset_path(args.dataset))
+    )
+    if len(args.predictions) == 1:
+        result = score_file(
+            key_file, args.predictions[0], top_k=args.top_k, confusion=bool(args.confusion)
+        )
+        if args.confusion:
+            np.save(args.confusion, result.pop("confusion_matrix"))
+        result["submission"] = args.predictions[0]
+        results = [result]
+    else:
+        results = score_submissions(
+            key_file, args.predictions, top_k=args.top_k, workers=args.workers
+        )
+
+    for result in results:
+        if result.get("error"):
+            print(f"{result['submission']}: {result['error']}")
+            continue
+        metrics = ", ".join(
+            f"{name}={value:.4f}"
+            for name, value in result.items()
+            if isinstance(value, float)
+        )
+        print(f"{result['submission']}: {metrics} (missing {result['missing']})")
+    if args.output:
+        write_scores(args.output, results, top_k=args.top_k)
@@ -0,0 +1,303 @@
+"""
+Packed shard format for the processed datasets.
+
+Instead of one image file per sample, each split is written as a few large shard files
+holding the encoded image bytes back to back. Every shard has a small index with the
+offset and length of each sample, and each split has a label table, so any sample can be
+fetched with a single positioned read:
+
+    processed/<dataset>/shards/<split>/
+        labels.json              # label table, label index -> label name
+        shard_00000.bin          # concatenated image bytes
+        shard_00000.index.csv    # id,label_idx,offset,length for each sample in the shard
+        ...
+        fingerprint.txt          # fingerprint of the split files that were packed
+
+Existing processed datasets can be converted with `python shards.py [dataset ...]`.
+`is_shards_fresh` compares the recorded fingerprint with the split's current files (see
+`dataset_files.split_fingerprint`), so outdated shards are not served.
+"""
+
+import os
+import csv
+import sys
+import json
+import bisect
+import shutil
+
+import paths
+from dataset_files import (
+    get_dataset_path,
+    list_dataset_names,
+    list_split_names,
+    list_split_files,
+    split_fingerprint,
+)
+from image_formats import open_image
+
+SHARDS_DIR_NAME = "shards"
+
+LABELS_FILE_NAME = "labels.json"
+
+FINGERPRINT_FILE_NAME = "fingerprint.txt"
+
+# target size of one shard file
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+
+
+def get_shards_dir(dataset_path: str, split_name: str) -> str:
+    """Returns the directory holding the shards of one split of a dataset."""
+    return os.path.join(dataset_path, SHARDS_DIR_NAME, split_name)
+
+
+def shard_file_name(shard_idx: int) -> str:
+    return f"shard_{shard_idx:05d}.bin"
+
+
+def shard_index_file_name(shard_idx: int) -> str:
+    return f"shard_{shard_idx:05d}.index.csv"
+
+
+class ShardWriter:
+    """
+    Writes samples into consecutive shard files of roughly `shard_size` bytes.
+
+    Use as a context manager so the last shard and the label table are flushed:
+
+        with ShardWriter(shards_dir) as writer:
+            writer.add("0.jpg", "cat", image_bytes)
+
+    The shards are written to `<shards_dir>.tmp` and only swapped in for the existing
+    shards on `close`: the existing shards are renamed to `<shards_dir>.old`, the new
+    ones renamed into place and only then the old ones deleted, so readers never see a
+    half-written split and a crash never loses both. If the block raises, the partial
+    shards are discarded and the existing shards are kept.
+    """
+
+    def __init__(
+        self, shards_dir: str, shard_size: int = DEFAULT_SHARD_SIZE, fingerprint=None
+    ):
+        self.shards_dir = shards_dir
+        self.shard_size = shard_size
+        self.fingerprint = fingerprint
+        self.labels = []
+        self._label_to_idx = {}
+        self._shard_idx = -1
+        self._shard_file = None
+        self._index_file = None
+        self._index_writer = None
+        self._offset = 0
+        self.num_samples = 0
+        self._tmp_dir = f"{shards_dir.rstrip(os.sep)}.tmp"
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+
+    def _open_next_shard(self):
+        self._close_shard()
+        self._shard_idx += 1
+        self._offset = 0
+        self._shard_file = open(
+            os.path.join(self._tmp_dir, shard_file_name(self._shard_idx)), "wb"
+        )
+        self._index_file = open(
+            os.path.join(self._tmp_dir, shard_index_file_name(self._shard_idx)),
+            "w",
+            newline="",
+        )
+        self._index_writer = csv.writer(self._index_file)
+        self._index_writer.writerow(["id", "label_idx", "offset", "length"])
+
+    def _close_shard(self):
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._index_file.close()
+            self._shard_file = None
+            self._index_file = None
+
+    def add(self, sample_id: str, label: str, data: bytes) -> None:
+        """Appends one encoded sample to the current shard."""
+        if self._shard_file is None or (
+            self._offset > 0 and self._offset + len(data) > self.shard_size
+        ):
+            self._open_next_shard()
+        label_idx = self._label_to_idx.get(label)
+        if label_idx is None:
+            label_idx = len(self.labels)
+            self._label_to_idx[label] = label_idx
+            self.labels.append(label)
+        self._shard_file.write(data)
+        self._index_writer.writerow([sample_id, label_idx, self._offset, len(data)])
+        self._offset += len(data)
+        self.num_samples += 1
+
+    def close(self) -> None:
+        """Writes the label table and swaps the new shards in for the existing ones."""
+        self._close_shard()
+        with open(os.path.join(self._tmp_dir, LABELS_FILE_NAME), "w") as file:
+            json.dump(self.labels, file)
+        if self.fingerprint is not None:
+            with open(os.path.join(self._tmp_dir, FINGERPRINT_FILE_NAME), "w") as file:
+                file.write(self.fingerprint)
+        # move the old shards aside rather than deleting them first: until the new ones
+        # are in place, the old ones are never gone (only renamed)
+        old_dir = f"{self.shards_dir.rstrip(os.sep)}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(self.shards_dir):
+            os.replace(self.shards_dir, old_dir)
+        os.replace(self._tmp_dir, self.shards_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    def discard(self) -> None:
+        """Removes the shards written so far, keeping the existing shards."""
+        self._close_shard()
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ShardReader:
+    """
+    Random access reader over the shards of one split.
+
+    The shard indexes are loaded once when the reader is created; afterwards every
+    sample is fetched with a single positioned read into its shard file.
+    """
+
+    def __init__(self, shards_dir: str):
+        self.shards_dir = shards_dir
+        with open(os.path.join(shards_dir, LABELS_FILE_NAME), "r") as file:
+            self.labels = json.load(file)
+
+        self.ids = []
+        self.label_idxs = []
+        self.offsets = []
+        self.lengths = []
+        # global index of the first sample of each shard
+        self._shard_starts = []
+        self._fds = []
+        shard_idx = 0
+        while os.path.exists(os.path.join(shards_dir, shard_file_name(shard_idx))):
+            self._shard_starts.append(len(self.ids))
+            index_path = os.path.join(shards_dir, shard_index_file_name(shard_idx))
+            with open(index_path, "r", newline="") as file:
+                for row in csv.DictReader(file):
+                    self.ids.append(row["id"])
+                    self.label_idxs.append(int(row["label_idx"]))
+                    self.offsets.append(int(row["offset"]))
+                    self.lengths.append(int(row["length"]))
+            self._fds.append(
+                os.open(
+                    os.path.join(shards_dir, shard_file_name(shard_idx)),
+                    os.O_RDONLY | getattr(os, "O_BINARY", 0),
+                )
+            )
+            shard_idx += 1
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _shard_of(self, idx: int) -> int:
+        return bisect.bisect_right(self._shard_starts, idx) - 1
+
+    def read(self, idx: int):
+        """
+        Returns the encoded bytes and the label of the sample at `idx`.
+
+        Args:
+            idx (int): Position of the sample within the split.
+
+        Returns:
+            Tuple[bytes, str]: The encoded image and its label.
+        """
+        if idx < 0:
+            idx += len(self.ids)
+        if not 0 <= idx < len(self.ids):
+            raise IndexError(f"Sample index {idx} out of range")
+        fd = self._fds[self._shard_of(idx)]
+        offset, length = self.offsets[idx], self.lengths[idx]
+        if hasattr(os, "pread"):
+            data = os.pread(fd, length, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, length)
+        return data, self.labels[self.label_idxs[idx]]
+
+    def read_image(self, idx: int):
+        """Returns the decoded PIL image and the label of the sample at `idx`."""
+        data, label = self.read(idx)
+        return open_image(data), label
+
+    def close(self) -> None:
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_split_shards(
+    dataset_path: str, split_name: str, shard_size: int = DEFAULT_SHARD_SIZE
+) -> int:
+    """
+    Packs the image files of one split of a processed dataset into shards.
+
+    Args:
+        dataset_path (str): Path to the processed dataset directory.
+        split_name (str): Training, validation, or testing.
+        shard_size (int): Target size in bytes of one shard file.
+
+    Returns:
+        int: The number of samples written.
+    """
+    # fingerprint first: a change during the packing then shows as a mismatch
+    fingerprint = split_fingerprint(dataset_path, split_name)
+    X, y = list_split_files(dataset_path, split_name)
+    shards_dir = get_shards_dir(dataset_path, split_name)
+    with ShardWriter(shards_dir, shard_size, fingerprint=fingerprint) as writer:
+        for file_path, label in zip(X, y):
+            with open(file_path, "rb") as file:
+                writer.add(os.path.basename(file_path), label, file.read())
+    return writer.num_samples
+
+
+def is_shards_fresh(dataset_path: str, split_name: str) -> bool:
+    """
+    Check if the shards of a split match the split's files. Shards of a split without a
+    folder tree cannot be checked and count as fresh.
+    """
+    fingerprint = split_fingerprint(dataset_path, split_name)
+    if fingerprint is None:
+        return True
+    fingerprint_path = os.path.join(
+        get_shards_dir(dataset_path, split_name), FINGERPRINT_FILE_NAME
+    )
+    if not os.path.exists(fingerprint_path):
+        return False
+    with open(fingerprint_path, "r") as file:
+        return file.read().strip() == fingerprint
+
+
+def convert_dataset_to_shards(
+    dataset_path: str, shard_size: int = DEFAULT_SHARD_SIZE
+) -> None:
+    """Packs every split of a processed dataset into shards."""
+    for split_name in list_split_names(dataset_path):
+        num_samples = write_split_shards(dataset_path, split_name, shard_size)
+        print(f"Packed {num_samples} {split_name} samples of {dataset_path}")
+
+
+if __name__ == "__main__":
+    dataset_names = sys.argv[1:] or list_dataset_names(paths.PROCESSED_DIR)
+    for dataset_name in dataset_names:
+        convert_dataset_to_shards(get_dataset_path(dataset_name))
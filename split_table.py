@@ -0,0 +1,268 @@
+"""
+Column-oriented split tables.
+
+A split table records the id, label and split of every sample of a dataset as
+dictionary-encoded columns, one .npy file per column:
+
+    <table_dir>/
+        meta.json      number of rows, split names, label names and rows per split
+        split.npy      split code of every row (index into meta["splits"])
+        label.npy      label code of every row (index into meta["labels"])
+        id.npy         the ids as fixed-width UTF-8 bytes
+
+Rows are sorted by (split, label, id), so the rows of one split, or of one label within
+a split, are a contiguous range found by binary search over the memory-mapped code
+columns. Queries never load the whole table: only the ids of the requested range are
+read and decoded.
+
+Every materialized dataset gets a table at `<dataset>/split_table/` next to its
+split_manifest.csv (see materialize.py). Tables can also be converted from the existing
+train_test_split.json/.csv files and split manifests:
+
+    python split_table.py datasets/raw/vision/train_test_split.csv vision_table
+    python split_table.py datasets/raw/cub_200_2011/train_test_split.json cub_table \\
+        --labels datasets/processed/cub_200_2011/split_manifest.csv
+"""
+
+import os
+import csv
+import json
+import shutil
+import argparse
+
+import numpy as np
+
+SPLIT_TABLE_DIR_NAME = "split_table"
+
+META_FILE_NAME = "meta.json"
+
+# split names used by the train_test_split files -> processed split directory names
+SPLIT_NAME_ALIASES = {"train": "training", "valid": "validation", "test": "testing"}
+
+SPLIT_ORDER = ["training", "validation", "testing"]
+
+
+def _code_dtype(num_values: int):
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if num_values <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.uint64
+
+
+def _sorted_names(names, order=()):
+    # known names first in their usual order, then the others alphabetically
+    known = [name for name in order if name in names]
+    return known + sorted(set(names) - set(known))
+
+
+def write_split_table(table_dir: str, ids, labels, splits) -> int:
+    """
+    Writes a split table.
+
+    Args:
+        table_dir (str): Destination directory. An existing table is replaced.
+        ids (List[str]): Sample ids (file names).
+        labels (List[str]): Label of every sample.
+        splits (List[str]): Split of every sample.
+
+    Returns:
+        int: The number of rows written.
+    """
+    splits = [SPLIT_NAME_ALIASES.get(split, split) for split in splits]
+    split_names = _sorted_names(set(splits), SPLIT_ORDER)
+    label_names = _sorted_names(set(labels))
+    split_to_code = {name: code for code, name in enumerate(split_names)}
+    label_to_code = {name: code for code, name in enumerate(label_names)}
+    split_codes = np.fromiter((split_to_code[s] for s in splits), np.int64, len(splits))
+    label_codes = np.fromiter((label_to_code[l] for l in labels), np.int64, len(labels))
+    encoded_ids = np.array([i.encode("utf-8") for i in ids], dtype=bytes)
+    if len(encoded_ids) == 0:
+        encoded_ids = np.zeros(0, dtype="S1")
+
+    order = np.lexsort((encoded_ids, label_codes, split_codes))
+    counts = np.bincount(split_codes, minlength=len(split_names))
+
+    tmp_dir = f"{table_dir.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(
+        os.path.join(tmp_dir, "split.npy"),
+        split_codes[order].astype(_code_dtype(len(split_names))),
+    )
+    np.save(
+        os.path.join(tmp_dir, "label.npy"),
+        label_codes[order].astype(_code_dtype(len(label_names))),
+    )
+    np.save(os.path.join(tmp_dir, "id.npy"), encoded_ids[order])
+    with open(os.path.join(tmp_dir, META_FILE_NAME), "w") as file:
+        json.dump(
+            {
+                "num_rows": len(order),
+                "splits": split_names,
+                "labels": label_names,
+                "split_counts": dict(zip(split_names, counts.tolist())),
+            },
+            file,
+            indent=2,
+        )
+    # swap the complete table in, so readers never see a half-written one
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.replace(tmp_dir, table_dir)
+    return len(order)
+
+
+class SplitTable:
+    """
+    Lazy, read-only view over a split table.
+
+        table = SplitTable(table_dir)
+        test_ids = table.ids(split="testing")
+        for id, label, split in table.iter_rows(split="testing", label="cat"):
+            ...
+    """
+
+    def __init__(self, table_dir: str):
+        self.table_dir = table_dir
+        with open(os.path.join(table_dir, META_FILE_NAME), "r") as file:
+            self.meta = json.load(file)
+        self.split_names = self.meta["splits"]
+        self.label_names = self.meta["labels"]
+        self._split_codes = np.load(os.path.join(table_dir, "split.npy"), mmap_mode="r")
+        self._label_codes = np.load(os.path.join(table_dir, "label.npy"), mmap_mode="r")
+        self._ids = np.load(os.path.join(table_dir, "id.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.meta["num_rows"]
+
+    def rows(self, split=None, label=None) -> slice:
+        """Returns the row range of a split, optionally restricted to one label."""
+        if split is None:
+            if label is not None:
+                raise ValueError("Querying a label requires a split")
+            return slice(0, len(self))
+        split = SPLIT_NAME_ALIASES.get(split, split)
+        if split not in self.split_names:
+            return slice(0, 0)
+        code = self.split_names.index(split)
+        start = int(np.searchsorted(self._split_codes, code, side="left"))
+        stop = int(np.searchsorted(self._split_codes, code, side="right"))
+        if label is None:
+            return slice(start, stop)
+        if label not in self.label_names:
+            return slice(0, 0)
+        code = self.label_names.index(label)
+        label_codes = self._label_codes[start:stop]
+        return slice(
+            start + int(np.searchsorted(label_codes, code, side="left")),
+            start + int(np.searchsorted(label_codes, code, side="right")),
+        )
+
+    def ids(self, split=None, label=None):
+        """Returns the ids of a split (and label), sorted by label then id."""
+        return [i.decode("utf-8") for i in self._ids[self.rows(split, label)].tolist()]
+
+    def label_codes(self, split=None, label=None) -> np.ndarray:
+        """Returns the label codes (indices into `label_names`) of a split (and label)."""
+        return np.asarray(self._label_codes[self.rows(split, label)])
+
+    def labels(self, split=None, label=None):
+        """Returns the label names of a split (and label)."""
+        return [self.label_names[code] for code in self.label_codes(split, label).tolist()]
+
+    def iter_rows(self, split=None, label=None):
+        """Yields (id, label, split) rows."""
+        rows = self.rows(split, label)
+        split_codes = self._split_codes[rows].tolist()
+        for id, label_code, split_code in zip(
+            self.ids(split, label), self.label_codes(split, label).tolist(), split_codes
+        ):
+            yield id, self.label_names[label_code], self.split_names[split_code]
+
+    def counts(self) -> dict:
+        """Returns {split: {label: number of rows}}."""
+        counts = {}
+        for code, split in enumerate(self.split_names):
+            rows = self.rows(split)
+            label_counts = np.bincount(
+                self._label_codes[rows], minlength=len(self.label_names)
+            )
+            counts[split] = {
+                self.label_names[i]: int(n) for i, n in enumerate(label_counts) if n
+            }
+        return counts
+
+
+def get_split_table_dir(dataset_path: str) -> str:
+    """Returns the split table directory of a processed dataset."""
+    return os.path.join(dataset_path, SPLIT_TABLE_DIR_NAME)
+
+
+def has_split_table(dataset_path: str) -> bool:
+    return os.path.exists(os.path.join(get_split_table_dir(dataset_path), META_FILE_NAME))
+
+
+def read_split_json(json_file: str):
+    """Returns (ids, splits) from a train_test_split.json file ({split: [id, ...]})."""
+    with open(json_file, "r") as file:
+        data = json.load(file)
+    ids, splits = [], []
+    for split, split_ids in data.items():
+        ids.extend(split_ids)
+        splits.extend([split] * len(split_ids))
+    return ids, splits
+
+
+def read_split_csv(csv_file: str):
+    """
+    Returns (ids, labels, splits) from a split CSV file: the Vision train_test_split.csv
+    (file_name,label,type) or a split manifest (id,label,split,source_path).
+    """
+    with open(csv_file, "r", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        id_col = header.index("file_name" if "file_name" in header else "id")
+        split_col = header.index("type" if "type" in header else "split")
+        label_col = header.index("label")
+        ids, labels, splits = [], [], []
+        for row in reader:
+            ids.append(row[id_col])
+            labels.append(row[label_col])
+            splits.append(row[split_col])
+    return ids, labels, splits
+
+
+def convert_to_split_table(source_file: str, table_dir: str, labels_file=None) -> int:
+    """
+    Converts a train_test_split.json/.csv file or a split manifest to a split table.
+
+    Args:
+        source_file (str): The JSON or CSV file to convert.
+        table_dir (str): Destination table directory.
+        labels_file (Optional[str]): For JSON files, which have no labels: a split CSV
+                                     file providing the label of each id. Ids without a
+                                     label get an empty label.
+
+    Returns:
+        int: The number of rows written.
+    """
+    if source_file.endswith(".json"):
+        ids, splits = read_split_json(source_file)
+        id_labels = {}
+        if labels_file is not None:
+            label_ids, label_names, _ = read_split_csv(labels_file)
+            id_labels = dict(zip(label_ids, label_names))
+        labels = [id_labels.get(i, "") for i in ids]
+    else:
+        ids, labels, splits = read_split_csv(source_file)
+    return write_split_table(table_dir, ids, labels, splits)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert split files to a split table.")
+    parser.add_argument("source", help="train_test_split.json/.csv or split_manifest.csv")
+    parser.add_argument("table_dir", help="Destination split table directory.")
+    parser.add_argument("--labels", default=None, help="Split CSV with the labels (JSON).")
+    args = parser.parse_args()
+
+    num_rows = convert_to_split_table(args.source, args.table_dir, labels_file=args.labels)
+    print(f"Wrote {num_rows} rows to {args.table_dir}")
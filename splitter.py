@@ -0,0 +1,140 @@
+"""
+Grouped, stratified, multi-way splitting of file records.
+
+Records that share a group key (e.g. a Vision "nat" image and its natFBH/natFBL/natWA
+variations) always land in the same split, and every stratum (class label) is divided
+according to the requested ratios. The split is computed in one vectorized NumPy pass:
+
+    1. labels and group keys are factorized into integer codes,
+    2. each group gets a pseudo-random sort key derived from the seed and the group key,
+    3. groups are ordered by (stratum, sort key) and each group is assigned the split in
+       which the midpoint of its records falls along the stratum's cumulative size.
+
+Sort keys only depend on the seed and the group key itself, so the result is
+deterministic and independent of the record order. Without groups every record is its own
+group keyed by its sample id (`ids`), so the same holds as long as ids are passed.
+
+    split_idx = grouped_stratified_split(labels, groups, ratios=(0.7, 0.1, 0.2))
+"""
+
+import os
+import csv
+import json
+import hashlib
+
+import numpy as np
+
+
+def vision_group_key(file_name: str) -> str:
+    """Maps Vision natFBH/natFBL/natWA variations to the name of their "nat" original."""
+    for variation in ("_natFBH_", "_natFBL_", "_natWA_"):
+        file_name = file_name.replace(variation, "_nat_")
+    return file_name
+
+
+def group_sort_keys(group_names, seed: int) -> np.ndarray:
+    """Returns a uniform pseudo-random uint64 per group, derived from seed and group key."""
+    seed_bytes = str(seed).encode()
+    digests = b"".join(
+        hashlib.blake2b(str(name).encode(), digest_size=8, key=seed_bytes).digest()
+        for name in group_names
+    )
+    return np.frombuffer(digests, dtype=">u8").astype(np.uint64)
+
+
+def grouped_stratified_split(
+    labels, groups=None, ratios=(0.7, 0.1, 0.2), seed: int = 42, ids=None
+):
+    """
+    Assigns every record to a split, keeping groups together and stratifying by label.
+
+    Args:
+        labels (array-like): Class label of each record.
+        groups (Optional[array-like]): Group key of each record. Records with the same key
+                                       are kept in the same split. Defaults to one group
+                                       per record. A group is stratified by the label of
+                                       its first record.
+        ratios (Tuple[float]): Relative size of each split, e.g. (0.7, 0.1, 0.2).
+        seed (int): Seed of the pseudo-random group order.
+        ids (Optional[array-like]): Sample id of each record (e.g. its file name), hashed
+                                    into the sort key of its own group when `groups` is
+                                    None. Without ids the record position is hashed, so
+                                    the split then depends on the record order.
+
+    Returns:
+        np.ndarray: The split index (position in `ratios`) of each record.
+    """
+    labels = np.asarray(labels)
+    num_records = len(labels)
+    if num_records == 0:
+        return np.zeros(0, dtype=np.int64)
+    if groups is None:
+        group_names = np.arange(num_records) if ids is None else np.asarray(ids)
+        group_codes = np.arange(num_records)
+    else:
+        group_names, group_codes = np.unique(np.asarray(groups), return_inverse=True)
+    _, label_codes = np.unique(labels, return_inverse=True)
+
+    num_groups = len(group_names)
+    group_sizes = np.bincount(group_codes, minlength=num_groups)
+    # stratum of each group: label of its first record
+    first_record = np.full(num_groups, num_records, dtype=np.int64)
+    np.minimum.at(first_record, group_codes, np.arange(num_records))
+    group_strata = label_codes[first_record]
+
+    order = np.lexsort((group_sort_keys(group_names, seed), group_strata))
+    ordered_sizes = group_sizes[order]
+    ordered_strata = group_strata[order]
+
+    # cumulative record count within each stratum, along the shuffled group order
+    cumulative = np.cumsum(ordered_sizes)
+    stratum_totals = np.bincount(ordered_strata, weights=ordered_sizes)
+    stratum_starts = np.concatenate(([0], np.cumsum(stratum_totals)[:-1]))
+    midpoints = (
+        cumulative - ordered_sizes / 2 - stratum_starts[ordered_strata]
+    ) / stratum_totals[ordered_strata]
+
+    ratios = np.asarray(ratios, dtype=np.float64)
+    boundaries = np.cumsum(ratios / ratios.sum())[:-1]
+    group_splits = np.empty(num_groups, dtype=np.int64)
+    group_splits[order] = np.searchsorted(boundaries, midpoints, side="right")
+    return group_splits[group_codes]
+
+
+def write_split_csv(csv_file: str, file_paths, labels, split_idx, split_names) -> None:
+    """Writes `file_name,label,type` rows (the Vision train_test_split.csv format)."""
+    with open(csv_file, "w", newline="") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["file_name", "label", "type"])
+        for file_path, label, idx in zip(file_paths, labels, split_idx):
+            writer.writerow([os.path.basename(file_path), label, split_names[idx]])
+
+
+def write_split_json(json_file: str, file_paths, split_idx, split_names) -> None:
+    """Writes {split_name: [file_name, ...]} (the train_test_split.json format)."""
+    data = {name: [] for name in split_names}
+    for file_path, idx in zip(file_paths, split_idx):
+        data[split_names[idx]].append(os.path.basename(file_path))
+    with open(json_file, "w") as file:
+        json.dump(data, file)
+
+
+def read_split_json(json_file: str, file_paths, split_names):
+    """
+    Reads the split of `file_paths` back from a train_test_split.json file.
+
+    Returns:
+        Optional[np.ndarray]: The split index of every file, or None if a file is not
+                              in the split file.
+    """
+    with open(json_file, "r") as file:
+        data = json.load(file)
+    split_of = {
+        file_name: split_names.index(split_name)
+        for split_name, file_names in data.items()
+        for file_name in file_names
+    }
+    split_idx = [split_of.get(os.path.basename(file_path)) for file_path in file_paths]
+    if any(idx is None for idx in split_idx):
+        return None
+    return np.array(split_idx, dtype=np.int64)
@@ -0,0 +1,202 @@
+"""
+Deterministic, class-balanced subsets of the processed datasets (like mini_mnist, for any
+dataset), e.g. for smoke tests:
+
+    python subset.py vision --fraction 0.01
+    python subset.py cifar100 --per-class 10 --name cifar100_tiny
+
+Every (split, label) group keeps `per_class` samples, or `fraction` of its samples (at
+least one). The samples kept are those with the smallest hash of (seed, id), so the
+selection does not depend on the file order, and a larger fraction with the same seed
+is a superset of a smaller one.
+
+Samples are read from the dataset's split manifest when it has one (Vision,
+CUB-200-2011), so no directory tree is walked; exported datasets are listed through the
+shared file cache. The subset is materialized with hardlinks (see materialize.py) into
+`processed/<name>/`, with its own split manifest, split table and test key. Regenerating
+a subset replaces its whole directory, so no tensor cache, shards or resized images of
+the previous subset survive.
+"""
+
+import os
+import json
+import shutil
+import argparse
+
+import numpy as np
+
+import paths
+from create_test_key import create_dataset_test_keys
+from dataset_files import SPLITS, get_dataset_path, list_split_files, list_split_names
+from materialize import (
+    MATERIALIZE_MODES,
+    SPLIT_MANIFEST_FILE_NAME,
+    Materializer,
+    read_split_manifest,
+)
+from splitter import group_sort_keys
+
+SUBSET_INFO_FILE_NAME = "subset.json"
+
+
+def read_dataset_rows(dataset_path: str):
+    """
+    Returns (id, label, split, source_path) of every sample of a processed dataset.
+
+    The split manifest is used when present. The source path is the file under the
+    processed split directories, or the manifest's source path if the dataset was
+    materialized in "manifest" mode.
+    """
+    manifest_file = os.path.join(dataset_path, SPLIT_MANIFEST_FILE_NAME)
+    if os.path.exists(manifest_file):
+        rows = []
+        for row in read_split_manifest(manifest_file):
+            source_path = os.path.join(dataset_path, row["split"], row["label"], row["id"])
+            # "manifest" mode writes no processed files: use the recorded source
+            if not os.path.lexists(source_path):
+                source_path = row["source_path"]
+            rows.append((row["id"], row["label"], row["split"], source_path))
+        return rows
+
+    rows = []
+    for split_name in list_split_names(dataset_path):
+        X, y = list_split_files(dataset_path, split_name, use_cache=True)
+        rows.extend(
+            (os.path.basename(path), label, split_name, path) for path, label in zip(X, y)
+        )
+    return rows
+
+
+def select_subset(rows, per_class=None, fraction=None, seed: int = 42):
+    """
+    Selects a class-balanced subset of rows.
+
+    Args:
+        rows (List[Tuple]): (id, label, split, ...) rows.
+        per_class (Optional[int]): Samples to keep per split and label.
+        fraction (Optional[float]): Fraction of each split and label to keep (at least
+                                    one sample).
+        seed (int): Seed of the selection.
+
+    Returns:
+        List[Tuple]: The selected rows, ordered by split, label and id.
+    """
+    if (per_class is None) == (fraction is None):
+        raise ValueError("Pass exactly one of per_class and fraction")
+    if per_class is not None and per_class < 1:
+        raise ValueError(f"per_class must be at least 1, got {per_class}")
+    if fraction is not None and not 0 < fraction <= 1:
+        raise ValueError(f"fraction must be in (0, 1], got {fraction}")
+    groups = {}
+    for row in rows:
+        groups.setdefault((row[2], row[1]), []).append(row)
+
+    selected = []
+    for (split_name, label), group in sorted(
+        groups.items(), key=lambda item: (SPLITS.index(item[0][0]), item[0][1])
+    ):
+        if per_class is not None:
+            count = min(per_class, len(group))
+        else:
+            count = max(1, int(len(group) * fraction))
+        keys = group_sort_keys([row[0] for row in group], seed)
+        keep = np.argsort(keys, kind="stable")[:count]
+        selected.extend(sorted((group[i] for i in keep), key=lambda row: row[0]))
+    return selected
+
+
+def clear_subset_dir(subset_path: str) -> None:
+    """
+    Removes a previous subset, with everything derived from it (tensor cache, shards,
+    resized images, ...). Refuses to remove a non-empty directory that is not a subset.
+    """
+    if not os.path.isdir(subset_path):
+        return
+    if os.listdir(subset_path) and not os.path.exists(
+        os.path.join(subset_path, SUBSET_INFO_FILE_NAME)
+    ):
+        raise ValueError(f"{subset_path} exists and is not a subset, not replacing it")
+    shutil.rmtree(subset_path)
+
+
+def create_subset(
+    dataset_name: str,
+    subset_name=None,
+    per_class=None,
+    fraction=None,
+    seed: int = 42,
+    mode: str = "hardlink",
+    processed_dir: str = paths.PROCESSED_DIR,
+) -> dict:
+    """
+    Creates a class-balanced subset of a processed dataset, with its test key.
+
+    Args:
+        dataset_name (str): Source dataset, e.g. "vision".
+        subset_name (Optional[str]): Name of the subset dataset. Defaults to
+                                     "<dataset>_subset".
+        per_class (Optional[int]): Samples to keep per split and label.
+        fraction (Optional[float]): Fraction of each split and label to keep.
+        seed (int): Seed of the selection.
+        mode (str): Materialize mode (see materialize.py).
+        processed_dir (str): Directory holding the processed datasets.
+
+    Returns:
+        dict: The subset's name, source, parameters and number of samples per split.
+    """
+    subset_name = subset_name or f"{dataset_name}_subset"
+    if subset_name == dataset_name:
+        raise ValueError("The subset name must differ from the dataset name")
+    dataset_path = get_dataset_path(dataset_name, processed_dir)
+    subset_path = get_dataset_path(subset_name, processed_dir)
+
+    rows = read_dataset_rows(dataset_path)
+    selected = select_subset(rows, per_class=per_class, fraction=fraction, seed=seed)
+
+    counts = {}
+    for _, _, split_name, _ in selected:
+        counts[split_name] = counts.get(split_name, 0) + 1
+    info = {
+        "name": subset_name,
+        "source": dataset_name,
+        "per_class": per_class,
+        "fraction": fraction,
+        "seed": seed,
+        "samples": counts,
+    }
+
+    clear_subset_dir(subset_path)
+    # written first, so a run that fails half-way still leaves a replaceable subset
+    os.makedirs(subset_path)
+    with open(os.path.join(subset_path, SUBSET_INFO_FILE_NAME), "w") as file:
+        json.dump(info, file, indent=2)
+    with Materializer(subset_path, mode=mode) as materializer:
+        for file_id, label, split_name, source_path in selected:
+            materializer.add(source_path, split_name, label, file_id=file_id)
+
+    if "testing" in counts:
+        # read the testing rows from the subset's split table, no traversal
+        create_dataset_test_keys(subset_path, from_table=True)
+    return info
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create a class-balanced subset.")
+    parser.add_argument("dataset", help="Processed dataset name.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--per-class", type=int, help="Samples per split and label.")
+    group.add_argument("--fraction", type=float, help="Fraction of each split and label.")
+    parser.add_argument("--name", default=None, help="Subset name (<dataset>_subset).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mode", choices=MATERIALIZE_MODES, default="hardlink")
+    args = parser.parse_args()
+
+    info = create_subset(
+        args.dataset,
+        subset_name=args.name,
+        per_class=args.per_class,
+        fraction=args.fraction,
+        seed=args.seed,
+        mode=args.mode,
+    )
+    print(f"Created {info['name']}: {info['samples']}")
@@ -0,0 +1,240 @@
+"""
+Memory-mapped raw tensor cache for the small fixed-size datasets.
+
+Each split is stored as an uncompressed uint8 `.npy` array of shape (N, H, W, C) with a
+matching labels array, so loaders can open it with `np.memmap` (through
+`np.load(mmap_mode="r")`) and every worker process shares the same page-cache pages
+without copying or decoding anything:
+
+    processed/<dataset>/cache/
+        classes.json               # label index -> label name
+        <split>_images.npy         # uint8 (N, H, W, C)
+        <split>_labels.npy         # int32 (N,)
+        <split>_ids.txt            # sample id (file name) of each row
+        <split>_fingerprint.txt    # fingerprint of the split files it was built from
+
+The cache can be built from in-memory arrays or from the existing processed folder trees
+(`python tensor_cache.py [dataset ...]`), in which case the ids are the file names used
+in the `*_test_key.csv` files. Caches built from the folder trees record the split's
+fingerprint (`dataset_files.split_fingerprint`); `is_tensor_cache_fresh` tells whether
+the split changed since, so loaders never serve an outdated cache.
+"""
+
+import os
+import sys
+import json
+
+import numpy as np
+
+import paths
+from dataset_files import (
+    get_dataset_path,
+    list_class_names,
+    list_split_names,
+    list_split_files,
+    split_fingerprint,
+)
+from image_formats import read_image
+
+CACHE_DIR_NAME = "cache"
+
+CLASSES_FILE_NAME = "classes.json"
+
+# datasets whose images all share one small fixed size
+SMALL_DATASETS = ["mnist", "fashion_mnist", "mini_mnist", "cifar10", "cifar100"]
+
+
+def get_cache_dir(dataset_path: str) -> str:
+    """Returns the directory holding the tensor cache of a dataset."""
+    return os.path.join(dataset_path, CACHE_DIR_NAME)
+
+
+def _split_file_paths(cache_dir: str, split_name: str):
+    return (
+        os.path.join(cache_dir, f"{split_name}_images.npy"),
+        os.path.join(cache_dir, f"{split_name}_labels.npy"),
+        os.path.join(cache_dir, f"{split_name}_ids.txt"),
+    )
+
+
+def _fingerprint_path(cache_dir: str, split_name: str) -> str:
+    return os.path.join(cache_dir, f"{split_name}_fingerprint.txt")
+
+
+def _write_fingerprint(cache_dir: str, split_name: str, fingerprint) -> None:
+    fingerprint_path = _fingerprint_path(cache_dir, split_name)
+    if fingerprint is None:
+        if os.path.exists(fingerprint_path):
+            os.remove(fingerprint_path)
+        return
+    with open(fingerprint_path, "w") as file:
+        file.write(fingerprint)
+
+
+def _write_ids(ids_path: str, ids) -> None:
+    with open(ids_path, "w") as file:
+        for sample_id in ids:
+            file.write(f"{sample_id}\n")
+
+
+def _write_classes(cache_dir: str, class_names) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, CLASSES_FILE_NAME), "w") as file:
+        json.dump(list(class_names), file)
+
+
+def write_split_cache(
+    cache_dir: str,
+    split_name: str,
+    images: np.ndarray,
+    labels: np.ndarray,
+    ids=None,
+    class_names=None,
+    fingerprint=None,
+) -> None:
+    """
+    Writes one split held in memory (e.g. the arrays returned by a dataset loader).
+
+    Args:
+        cache_dir (str): The directory where the cache files are written.
+        split_name (str): Training, validation, or testing.
+        images (np.ndarray): uint8 images of shape (N, H, W) or (N, H, W, C).
+        labels (np.ndarray): Integer labels of shape (N,).
+        ids (Optional[List[str]]): Sample ids. Defaults to "<row>.jpg", which matches
+                                   the file names written by the dataset notebooks.
+        class_names (Optional[List[str]]): Label index -> label name table.
+        fingerprint (Optional[str]): Fingerprint of the split files the arrays match
+                                     (see `dataset_files.split_fingerprint`).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    images = np.asarray(images, dtype=np.uint8)
+    if images.ndim == 3:
+        images = images[..., np.newaxis]
+    images_path, labels_path, ids_path = _split_file_paths(cache_dir, split_name)
+    np.save(images_path, images)
+    np.save(labels_path, np.asarray(labels, dtype=np.int32).reshape(-1))
+    if ids is None:
+        ids = [f"{i}.jpg" for i in range(len(images))]
+    _write_ids(ids_path, ids)
+    _write_fingerprint(cache_dir, split_name, fingerprint)
+    if class_names is not None:
+        _write_classes(cache_dir, class_names)
+
+
+def build_split_cache_from_files(dataset_path: str, split_name: str, class_names):
+    """
+    Decodes the image files of one processed split into the tensor cache.
+
+    Images are decoded one at a time straight into a memory-mapped output array, so
+    memory use does not grow with the size of the split.
+
+    Returns:
+        int: The number of cached samples.
+    """
+    # fingerprint first: a change during the build then shows as a mismatch
+    fingerprint = split_fingerprint(dataset_path, split_name)
+    X, y = list_split_files(dataset_path, split_name)
+    cache_dir = get_cache_dir(dataset_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    images_path, labels_path, ids_path = _split_file_paths(cache_dir, split_name)
+    # a stale fingerprint would mark a half-written cache as fresh
+    _write_fingerprint(cache_dir, split_name, None)
+    if not X:
+        for file_path in (images_path, labels_path, ids_path):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        return 0
+
+    first = read_image(X[0])
+    sample_shape = first.shape if first.ndim == 3 else first.shape + (1,)
+
+    images = np.lib.format.open_memmap(
+        images_path, mode="w+", dtype=np.uint8, shape=(len(X),) + sample_shape
+    )
+    for i, file_path in enumerate(X):
+        array = read_image(file_path)
+        if array.shape != first.shape:
+            raise ValueError(
+                f"{file_path} has shape {array.shape}, expected {first.shape}"
+            )
+        images[i] = array.reshape(sample_shape)
+    images.flush()
+    del images
+
+    class_to_idx = {name: idx for idx, name in enumerate(class_names)}
+    np.save(labels_path, np.array([class_to_idx[label] for label in y], dtype=np.int32))
+    _write_ids(ids_path, (os.path.basename(path) for path in X))
+    _write_fingerprint(cache_dir, split_name, fingerprint)
+    return len(X)
+
+
+def build_dataset_cache(dataset_path: str) -> None:
+    """Builds the tensor cache for every split of a processed dataset."""
+    split_names = list_split_names(dataset_path)
+    class_names = list_class_names(dataset_path)
+    _write_classes(get_cache_dir(dataset_path), class_names)
+    for split_name in split_names:
+        num_samples = build_split_cache_from_files(dataset_path, split_name, class_names)
+        print(f"Cached {num_samples} {split_name} samples of {dataset_path}")
+
+
+class TensorCacheSplit:
+    """
+    Read-only view over one cached split.
+
+    `images` and `labels` are memory-mapped, so indexing them only touches the pages
+    that are needed and nothing is copied until the caller asks for it.
+    """
+
+    def __init__(self, cache_dir: str, split_name: str):
+        images_path, labels_path, ids_path = _split_file_paths(cache_dir, split_name)
+        self.images = np.load(images_path, mmap_mode="r")
+        self.labels = np.load(labels_path, mmap_mode="r")
+        with open(ids_path, "r") as file:
+            self.ids = file.read().splitlines()
+        classes_path = os.path.join(cache_dir, CLASSES_FILE_NAME)
+        self.class_names = None
+        if os.path.exists(classes_path):
+            with open(classes_path, "r") as file:
+                self.class_names = json.load(file)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return self.images[idx], self.labels[idx]
+
+
+def has_tensor_cache(dataset_path: str, split_name: str) -> bool:
+    """Check if the tensor cache exists for a split of a dataset."""
+    images_path, _, _ = _split_file_paths(get_cache_dir(dataset_path), split_name)
+    return os.path.exists(images_path)
+
+
+def is_tensor_cache_fresh(dataset_path: str, split_name: str) -> bool:
+    """
+    Check if the tensor cache of a split matches the split's files. A cache of a split
+    without a folder tree (e.g. written from in-memory arrays only) cannot be checked
+    and counts as fresh.
+    """
+    fingerprint = split_fingerprint(dataset_path, split_name)
+    if fingerprint is None:
+        return True
+    fingerprint_path = _fingerprint_path(get_cache_dir(dataset_path), split_name)
+    if not os.path.exists(fingerprint_path):
+        return False
+    with open(fingerprint_path, "r") as file:
+        return file.read().strip() == fingerprint
+
+
+def load_tensor_cache(dataset_path: str, split_name: str) -> TensorCacheSplit:
+    """Opens the memory-mapped tensor cache of one split of a processed dataset."""
+    return TensorCacheSplit(get_cache_dir(dataset_path), split_name)
+
+
+if __name__ == "__main__":
+    dataset_names = sys.argv[1:] or SMALL_DATASETS
+    for dataset_name in dataset_names:
+        dataset_path = get_dataset_path(dataset_name, paths.PROCESSED_DIR)
+        if os.path.isdir(dataset_path):
+            build_dataset_cache(dataset_path)
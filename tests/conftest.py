@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from PIL import Image
+
+# the modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# keep the stage metrics of the tests out of datasets/metrics.jsonl (and out of any log
+# configured in the environment); read by instrumentation.py when it is imported
+os.environ["RT_METRICS_LOG"] = ""
+os.environ.pop("RT_PROMETHEUS_FILE", None)
+
+
+@pytest.fixture
+def make_split():
+    """Returns a function writing (label, file name, gray value) images into a split."""
+
+    def make(dataset_path, split_name, files):
+        for label, name, value in files:
+            label_dir = os.path.join(dataset_path, split_name, label)
+            os.makedirs(label_dir, exist_ok=True)
+            image = np.full((6, 6), value, dtype=np.uint8)
+            Image.fromarray(image).save(os.path.join(label_dir, name))
+
+    return make
@@ -0,0 +1,90 @@
+import csv
+import os
+
+import pytest
+
+import create_test_key
+from materialize import Materializer
+
+
+def read_key(path):
+    with open(path, newline="") as file:
+        return list(csv.reader(file))
+
+
+@pytest.fixture
+def sources(tmp_path, make_split):
+    make_split(str(tmp_path / "raw"), "all", [("cat", "a.png", 1), ("dog", "b.png", 2)])
+    make_split(str(tmp_path / "raw"), "all", [("cat", "c.png", 3), ("cat", "d.png", 4)])
+    raw_dir = tmp_path / "raw" / "all"
+    return [
+        (str(raw_dir / "cat" / "a.png"), "testing", "cat"),
+        (str(raw_dir / "dog" / "b.png"), "testing", "dog"),
+        (str(raw_dir / "cat" / "c.png"), "testing", "cat"),
+        (str(raw_dir / "cat" / "d.png"), "training", "cat"),
+    ]
+
+
+EXPECTED_KEY = [
+    ["id", "target"],
+    ["a.png", "cat"],
+    ["c.png", "cat"],
+    ["b.png", "dog"],
+]
+
+
+@pytest.mark.parametrize("mode", ["copy", "manifest"])
+def test_key_from_tree_manifest_and_table(tmp_path, sources, mode):
+    dataset_path = str(tmp_path / "toy")
+    with Materializer(dataset_path, mode=mode) as materializer:
+        for source_path, split_name, label in sources:
+            materializer.add(source_path, split_name, label)
+    key_file = os.path.join(dataset_path, "toy_test_key.csv")
+
+    assert create_test_key.create_dataset_test_keys(dataset_path) == 3
+    assert read_key(key_file) == EXPECTED_KEY
+    for options in ({"from_manifest": True}, {"from_table": True}):
+        os.remove(key_file)
+        create_test_key.create_dataset_test_keys(dataset_path, **options)
+        assert read_key(key_file) == EXPECTED_KEY
+
+
+def test_write_test_keys(tmp_path):
+    key_file = str(tmp_path / "key.csv")
+    rows = [("a.png", "cat"), ("a.png", "cat"), ("b.png", "dog")]
+    assert create_test_key.write_test_keys(iter(rows), key_file) == 2
+    assert read_key(key_file) == [["id", "target"], ["a.png", "cat"], ["b.png", "dog"]]
+
+
+def test_collision_leaves_no_partial_key(tmp_path):
+    key_file = str(tmp_path / "key.csv")
+    with pytest.raises(create_test_key.TestKeyCollisionError):
+        create_test_key.write_test_keys(iter([("a.png", "cat"), ("a.png", "dog")]), key_file)
+    assert os.listdir(tmp_path) == []
+
+
+def test_failed_datasets_are_returned(tmp_path, make_split):
+    make_split(str(tmp_path / "good"), "testing", [("cat", "a.png", 1)])
+    os.makedirs(tmp_path / "bad")
+    failed = create_test_key.create_datasets_test_keys(
+        [str(tmp_path / "good"), str(tmp_path / "bad")]
+    )
+    assert failed == ["bad"]
+
+
+def test_scandir_and_cache_list_the_same_files(tmp_path, make_split, monkeypatch):
+    import file_cache
+
+    monkeypatch.setattr(
+        file_cache, "_file_cache", file_cache.FileCache(str(tmp_path / "cache.sqlite"))
+    )
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "testing", [("cat", "b.png", 1), ("cat", "a.png", 2)])
+    # files that are not images are not test samples
+    for name in ("notes.txt", ".DS_Store", "Thumbs.db"):
+        (tmp_path / "toy" / "testing" / "cat" / name).write_bytes(b"")
+    os.makedirs(tmp_path / "toy" / "testing" / "cat" / "extra.png")
+
+    expected = [("a.png", "cat"), ("b.png", "cat")]
+    assert list(create_test_key.iter_test_keys(dataset_path)) == expected
+    assert list(create_test_key.iter_test_keys(dataset_path, use_cache=True)) == expected
@@ -0,0 +1,33 @@
+import numpy as np
+
+from data_loader import load_dataset, shuffle_indices
+
+
+def test_shuffle_mixes_label_sorted_indices():
+    # CIFAR-10 shaped: the sources are ordered by label
+    labels = np.repeat(np.arange(10), 5000)
+    order = shuffle_indices(np.arange(len(labels)), np.random.default_rng(0))
+    assert sorted(order) == list(range(len(labels)))
+    counts = np.bincount(labels[order[:2560]], minlength=10)
+    assert counts.min() > 150
+
+
+def test_block_shuffle_keeps_every_index():
+    rng = np.random.default_rng(0)
+    order = list(shuffle_indices(np.arange(1000), rng, buffer_size=64))
+    assert sorted(order) == list(range(1000))
+    assert order[:64] != list(range(64))
+
+
+def test_loader_epochs(tmp_path, make_split):
+    files = [(label, f"{label}{i}.png", i) for label in "abc" for i in range(5)]
+    make_split(str(tmp_path / "toy"), "training", files)
+    loader = load_dataset(
+        "toy", processed_dir=str(tmp_path), batch_size=4, shuffle=True, num_workers=2
+    )
+    assert loader.class_names == ["a", "b", "c"]
+    first = np.concatenate([labels for _, labels in loader])
+    second = np.concatenate([labels for _, labels in loader])
+    assert np.bincount(first).tolist() == [5, 5, 5]
+    assert np.bincount(second).tolist() == [5, 5, 5]
+    assert len(loader) == 4
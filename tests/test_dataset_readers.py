@@ -0,0 +1,102 @@
+import os
+import gzip
+import pickle
+
+import numpy as np
+
+import dataset_readers
+from dataset_readers import (
+    IDX_FILE_NAMES,
+    iter_cifar10_chunks,
+    iter_mnist_chunks,
+    load_cifar10,
+    load_mnist,
+    select_chunks,
+)
+from image_export import save_image_chunks
+
+
+def write_idx(file_path, array):
+    header = bytes([0, 0, 0x08, array.ndim]) + np.array(array.shape, dtype=">u4").tobytes()
+    with gzip.open(file_path, "wb") as file:
+        file.write(header + array.astype(np.uint8).tobytes())
+
+
+def make_mnist(data_dir):
+    rng = np.random.default_rng(0)
+    arrays = {
+        "x_train": rng.integers(0, 256, (7, 4, 4)),
+        "y_train": np.arange(7) % 3,
+        "x_test": rng.integers(0, 256, (3, 4, 4)),
+        "y_test": np.arange(3) % 3,
+    }
+    os.makedirs(data_dir)
+    for key, file_name in IDX_FILE_NAMES.items():
+        write_idx(os.path.join(data_dir, file_name), arrays[key])
+    return arrays
+
+
+def test_mnist_chunks_match_load(tmp_path):
+    data_dir = str(tmp_path / "data")
+    arrays = make_mnist(data_dir)
+    chunks = list(iter_mnist_chunks("train", data_dir, download=False, chunk_size=3))
+    assert [len(images) for images, _, _ in chunks] == [3, 3, 1]
+    assert np.array_equal(np.concatenate([c[0] for c in chunks]), arrays["x_train"])
+    assert np.concatenate([c[2] for c in chunks]).tolist() == list(range(7))
+
+    (x_train, y_train), (x_test, y_test) = load_mnist(data_dir, download=False)
+    assert np.array_equal(x_test, arrays["x_test"])
+    assert y_train.tolist() == arrays["y_train"].tolist()
+
+
+def test_cifar10_chunks_from_batch_dir(tmp_path):
+    data_dir = str(tmp_path / "data")
+    batch_dir = os.path.join(data_dir, "cifar-10-batches-py")
+    os.makedirs(batch_dir)
+    names = [f"data_batch_{i}" for i in range(1, 6)] + ["test_batch"]
+    for i, name in enumerate(names):
+        batch = {
+            b"data": np.full((2, 3 * 32 * 32), i, dtype=np.uint8),
+            b"labels": [i, i],
+        }
+        with open(os.path.join(batch_dir, name), "wb") as file:
+            pickle.dump(batch, file)
+
+    chunks = list(iter_cifar10_chunks("train", data_dir, download=False))
+    assert np.concatenate([c[1] for c in chunks]).tolist() == [0, 0, 1, 1, 2, 2, 3, 3, 4, 4]
+    (_, _), (x_test, y_test) = load_cifar10(data_dir, download=False)
+    assert x_test.shape == (2, 32, 32, 3) and y_test.tolist() == [5, 5]
+
+
+def test_export_selected_chunks(tmp_path):
+    data_dir = str(tmp_path / "data")
+    make_mnist(data_dir)
+    output_dir = str(tmp_path / "mini")
+    chunks = select_chunks(iter_mnist_chunks("train", data_dir, chunk_size=3), [5, 1, 6])
+    result = save_image_chunks(chunks, output_dir, "training", workers=1)
+    assert result["images"] == 3
+    written = sorted(
+        os.path.join(label, name)
+        for label in os.listdir(os.path.join(output_dir, "training"))
+        for name in os.listdir(os.path.join(output_dir, "training", label))
+    )
+    assert written == ["0/6.jpg", "1/1.jpg", "2/5.jpg"]
+
+
+def test_mnist_from_keras_cache(tmp_path, monkeypatch):
+    npz_file = str(tmp_path / "mnist.npz")
+    x_train = np.arange(5 * 4 * 4, dtype=np.uint8).reshape(5, 4, 4)
+    np.savez(
+        npz_file,
+        x_train=x_train,
+        y_train=np.arange(5),
+        x_test=x_train[:2],
+        y_test=np.arange(2),
+    )
+    monkeypatch.setattr(dataset_readers, "KERAS_MNIST_FILE", npz_file)
+    data_dir = str(tmp_path / "empty")
+
+    (loaded, _), (_, y_test) = load_mnist(data_dir, download=False)
+    assert np.array_equal(loaded, x_train) and y_test.tolist() == [0, 1]
+    chunks = list(iter_mnist_chunks("train", data_dir, download=False, chunk_size=2))
+    assert [c[2].tolist() for c in chunks] == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,71 @@
+import os
+
+import dataset_server
+from dataset_server import DatasetClient, start_server
+from shards import write_split_shards
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_serves_samples(tmp_path, make_split):
+    files = [("cat", "a.png", 10), ("dog", "b.png", 20)]
+    make_split(str(tmp_path / "toy"), "training", files)
+    server = start_server(port=0, processed_dir=str(tmp_path))
+    try:
+        client = DatasetClient(f"http://127.0.0.1:{server.server_address[1]}")
+        assert client.list_datasets() == ["toy"]
+        index = client.get_index("toy", "training")
+        assert index["ids"] == ["a.png", "b.png"]
+        assert index["class_names"] == ["cat", "dog"]
+        data, label = client.get_sample("toy", "training", "b.png")
+        assert label == "dog" and data.startswith(b"\x89PNG")
+        assert len(client.get_batch("toy", "training", [1, 0])) == 2
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_replaced_catalogs_are_closed(tmp_path, make_split, monkeypatch):
+    monkeypatch.setattr(dataset_server, "CATALOG_CHECK_INTERVAL", 0.0)
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "training", [("cat", "a.png", 10)])
+    write_split_shards(dataset_path, "training")
+    server = start_server(port=0, processed_dir=str(tmp_path))
+    try:
+        client = DatasetClient(f"http://127.0.0.1:{server.server_address[1]}")
+        first = server.get_catalog("toy", "training")
+        assert first.reader is not None
+        client.get_sample("toy", "training", "a.png")
+        fds = open_fds()
+        for value in range(5):
+            # every rebuild of the shards replaces the catalog of the split
+            make_split(dataset_path, "training", [("cat", f"{value}.png", value)])
+            write_split_shards(dataset_path, "training")
+            client.get_sample("toy", "training", f"{value}.png")
+        assert first.reader._fds == []
+        assert open_fds() <= fds
+        client.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_catalog_in_use_stays_open(tmp_path, make_split, monkeypatch):
+    monkeypatch.setattr(dataset_server, "CATALOG_CHECK_INTERVAL", 0.0)
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "training", [("cat", "a.png", 10)])
+    write_split_shards(dataset_path, "training")
+    server = dataset_server.DatasetServer(("127.0.0.1", 0), str(tmp_path))
+    try:
+        with server.use_catalog("toy", "training") as catalog:
+            make_split(dataset_path, "training", [("cat", "b.png", 20)])
+            write_split_shards(dataset_path, "training")
+            assert server.get_catalog("toy", "training") is not catalog
+            # still readable by the request that holds it
+            assert catalog.read(0)
+        assert catalog.reader._fds == []
+    finally:
+        server.server_close()
@@ -0,0 +1,50 @@
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "datasets", "raw", "vision")
+)
+
+from folder_map import count_indexed_files, query_file_index  # noqa: E402
+
+FOLDER_MAP = """\
+|-- D02_Apple_iPhone4s
+  |-- images
+    |-- nat
+      |-- D02_I_nat_0002.jpg
+      |-- D02_I_nat_0001.jpg
+    |-- flat
+      |-- D02_I_flat_0001.jpg
+  |-- videos
+    |-- flat
+      |-- D02_V_flat_0001.jpg
+|-- D01_Samsung_GalaxyS3Mini
+  |-- images
+    |-- flat
+      |-- D01_I_flat_0001.jpg
+"""
+
+
+def test_query_keeps_map_order(tmp_path):
+    folder_map_file = tmp_path / "folder_map.txt"
+    folder_map_file.write_text(FOLDER_MAP)
+    index_kwargs = {
+        "folder_map_file": str(folder_map_file),
+        "index_file": str(tmp_path / "index.sqlite"),
+    }
+    records = query_file_index(**index_kwargs)
+    assert [r.relative_path.rsplit("/", 1)[1] for r in records] == [
+        "D02_I_nat_0002.jpg",
+        "D02_I_nat_0001.jpg",
+        "D02_I_flat_0001.jpg",
+        "D01_I_flat_0001.jpg",
+    ]
+    assert records[0].device == "D02_Apple_iPhone4s" and records[0].sub_folder == "nat"
+    limited = query_file_index(sub_folders=["flat"], limit=1, **index_kwargs)
+    assert [r.relative_path for r in limited] == [
+        "D02_Apple_iPhone4s/images/flat/D02_I_flat_0001.jpg"
+    ]
+    assert count_indexed_files(**index_kwargs) == {
+        "D01_Samsung_GalaxyS3Mini": 1,
+        "D02_Apple_iPhone4s": 3,
+    }
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+
+from image_formats import compare_image_formats, print_format_report
+
+
+def test_compare_image_formats(tmp_path):
+    images = [np.full((6, 6), value, dtype=np.uint8) for value in (10, 200)]
+    results = compare_image_formats(images, formats=("png", "raw"), work_dir=str(tmp_path))
+    assert [r["format"] for r in results] == ["png", "raw"]
+    assert all(r["images"] == 2 and r["lossless"] for r in results)
+
+
+def test_empty_input_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        compare_image_formats([], work_dir=str(tmp_path))
+    with pytest.raises(ValueError):
+        compare_image_formats([np.zeros((2, 2), dtype=np.uint8)], formats=())
+    with pytest.raises(ValueError):
+        print_format_report("toy", [])
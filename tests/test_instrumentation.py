@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+import instrumentation
+from instrumentation import append_metrics_log, format_prometheus, track_stage
+
+
+def test_stage_counts(tmp_path, monkeypatch):
+    log_file = str(tmp_path / "metrics.jsonl")
+    monkeypatch.setattr(append_metrics_log, "__defaults__", (log_file,))
+    with track_stage("toy.copy", quiet=True) as stage:
+        stage.add(2, bytes_written=10)
+        stage.skip()
+    with open(log_file) as file:
+        record = json.loads(file.read())
+    assert record["stage"] == "toy.copy" and record["status"] == "ok"
+    assert (record["files"], record["skipped"], record["bytes_written"]) == (2, 1, 10)
+    assert 'rt_pipeline_stage_files_total{stage="toy.copy",status="ok"} 2' in (
+        format_prometheus([record])
+    )
+
+
+def test_unwritable_metrics_log_does_not_raise(tmp_path, monkeypatch, capsys):
+    # a directory cannot be opened for appending
+    monkeypatch.setattr(append_metrics_log, "__defaults__", (str(tmp_path),))
+    with track_stage("toy.ok", quiet=True):
+        pass
+    # the error of the stage itself is the one raised
+    with pytest.raises(KeyError):
+        with track_stage("toy.failed", quiet=True):
+            raise KeyError("stage error")
+    assert "Could not append the stage metrics" in capsys.readouterr().out
+    assert instrumentation.get_finished_stages()[-1]["status"] == "failed"
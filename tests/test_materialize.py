@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+from materialize import (
+    SPLIT_MANIFEST_FILE_NAME,
+    read_materialize_mode,
+    read_split_manifest,
+    sync_split_dirs,
+)
+
+
+@pytest.fixture
+def sources(tmp_path):
+    source_dir = tmp_path / "sources"
+    source_dir.mkdir()
+    rows = []
+    for name, label, split_name in (("a.jpg", "x", "training"), ("b.jpg", "y", "testing")):
+        (source_dir / name).write_bytes(name.encode())
+        rows.append((name, label, split_name, str(source_dir / name)))
+    return rows
+
+
+def test_sync_moves_and_removes(tmp_path, sources):
+    dataset_dir = str(tmp_path / "ds")
+    assert sync_split_dirs(dataset_dir, sources)["added"] == 2
+    a, b = sources
+    counts = sync_split_dirs(dataset_dir, [(a[0], "y", "testing", a[3])])
+    assert counts["moved"] == 1 and counts["removed"] == 1
+    assert os.path.isfile(os.path.join(dataset_dir, "testing", "y", "a.jpg"))
+    # the vacated label directories are removed
+    assert not os.path.exists(os.path.join(dataset_dir, "training", "x"))
+    assert not os.path.exists(os.path.join(dataset_dir, "testing", "y", "b.jpg"))
+
+
+def test_mode_change_rematerializes(tmp_path, sources):
+    dataset_dir = str(tmp_path / "ds")
+    sync_split_dirs(dataset_dir, sources, mode="copy")
+    counts = sync_split_dirs(dataset_dir, sources, mode="hardlink")
+    assert counts["updated"] == 2
+    assert read_materialize_mode(dataset_dir) == "hardlink"
+    for file_id, label, split_name, source_path in sources:
+        destination = os.path.join(dataset_dir, split_name, label, file_id)
+        assert os.path.samefile(destination, source_path)
+
+    counts = sync_split_dirs(dataset_dir, sources, mode="manifest")
+    assert counts["removed"] == 2
+    assert not os.path.exists(os.path.join(dataset_dir, "training", "x"))
+    assert len(read_split_manifest(os.path.join(dataset_dir, SPLIT_MANIFEST_FILE_NAME))) == 2
+
+
+def test_failed_sync_keeps_manifest(tmp_path, sources):
+    dataset_dir = str(tmp_path / "ds")
+    sync_split_dirs(dataset_dir, sources)
+    missing = ("c.jpg", "x", "training", str(tmp_path / "sources" / "missing.jpg"))
+    with pytest.raises(FileNotFoundError):
+        sync_split_dirs(dataset_dir, sources + [missing])
+    rows = read_split_manifest(os.path.join(dataset_dir, SPLIT_MANIFEST_FILE_NAME))
+    assert sorted(row["id"] for row in rows) == ["a.jpg", "b.jpg"]
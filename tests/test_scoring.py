@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+import scoring
+
+
+def write_csv(path, rows):
+    path.write_text("\n".join(",".join(map(str, row)) for row in rows) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def key_file(tmp_path):
+    return write_csv(
+        tmp_path / "toy_test_key.csv",
+        [("id", "target"), ("c.jpg", "dog"), ("a.jpg", "cat"), ("b.jpg", "cat")],
+    )
+
+
+def test_load_test_key_and_cache(key_file, tmp_path):
+    test_key = scoring.load_test_key(key_file)
+    assert test_key.ids.tolist() == ["a.jpg", "b.jpg", "c.jpg"]
+    assert test_key.class_names == ["cat", "dog"]
+    assert test_key.targets.tolist() == [0, 0, 1]
+    assert (tmp_path / "toy_test_key.npz").exists()
+    cached = scoring.load_test_key(key_file)
+    assert cached.ids.tolist() == test_key.ids.tolist()
+    assert cached.targets.tolist() == test_key.targets.tolist()
+
+
+def test_hard_labels(key_file, tmp_path):
+    predictions = write_csv(
+        tmp_path / "labels.csv",
+        [("id", "label"), ("a.jpg", "cat"), ("c.jpg", "cat"), ("x.jpg", "dog")],
+    )
+    result = scoring.score_file(key_file, predictions, confusion=True)
+    assert result["accuracy"] == pytest.approx(1 / 3)
+    assert result["missing"] == 1
+    assert result["unknown"] == 1
+    assert result["log_loss"] is None
+    assert result["confusion_matrix"].tolist() == [[1, 0], [1, 0]]
+    # cat: precision 1/2, recall 1/2; dog: never predicted
+    assert result["macro_f1"] == pytest.approx(0.25)
+
+
+def test_probabilities(key_file, tmp_path):
+    predictions = write_csv(
+        tmp_path / "probabilities.csv",
+        [
+            ("id", "dog", "cat"),
+            ("a.jpg", 0.2, 0.8),
+            ("b.jpg", 0.6, 0.4),
+            ("c.jpg", 0.9, 0.1),
+        ],
+    )
+    result = scoring.score_file(key_file, predictions, top_k=(1, 2))
+    assert result["accuracy"] == pytest.approx(2 / 3)
+    assert result["top_1_accuracy"] == pytest.approx(2 / 3)
+    assert result["top_2_accuracy"] == pytest.approx(1.0)
+    expected = -np.mean(np.log([0.8, 0.4, 0.9]))
+    assert result["log_loss"] == pytest.approx(expected)
+
+
+def test_metric_functions():
+    targets = np.array([0, 0, 1, 2])
+    predictions = np.array([0, 1, 1, -1])
+    matrix = scoring.confusion_matrix(targets, predictions, 3)
+    assert matrix.tolist() == [[1, 1, 0], [0, 1, 0], [0, 0, 0]]
+    support = np.bincount(targets, minlength=3)
+    assert scoring.macro_f1(matrix, support) == pytest.approx((2 / 3 + 2 / 3 + 0) / 3)
+    probabilities = np.array([[0.5, 0.5], [0.0, 0.0]])
+    assert scoring.log_loss(probabilities, np.array([0, 1])) == pytest.approx(np.log(2))
+
+
+def test_duplicate_prediction_ids(key_file, tmp_path):
+    predictions = write_csv(
+        tmp_path / "labels.csv", [("id", "label"), ("a.jpg", "cat"), ("a.jpg", "dog")]
+    )
+    with pytest.raises(ValueError):
+        scoring.score_file(key_file, predictions)
+
+
+def test_submission_errors_are_reported(key_file, tmp_path):
+    empty = tmp_path / "empty.csv"
+    empty.write_text("")
+    result = scoring._score_submission(key_file, str(empty), top_k=(1,))
+    assert result["submission"] == str(empty)
+    assert "Empty prediction file" in result["error"]
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+import pytest
+
+from shards import (
+    ShardReader,
+    ShardWriter,
+    get_shards_dir,
+    is_shards_fresh,
+    write_split_shards,
+)
+
+
+def test_round_trip_across_shards(tmp_path):
+    samples = [(f"{i}.bin", f"label{i % 3}", bytes([i]) * (10 + i)) for i in range(20)]
+    with ShardWriter(str(tmp_path / "shards"), shard_size=64) as writer:
+        for sample in samples:
+            writer.add(*sample)
+    assert writer.num_samples == len(samples)
+    assert (tmp_path / "shards" / "shard_00001.bin").exists()
+    with ShardReader(str(tmp_path / "shards")) as reader:
+        assert len(reader) == len(samples)
+        assert reader.ids == [sample_id for sample_id, _, _ in samples]
+        for idx, (_, label, data) in enumerate(samples):
+            assert reader.read(idx) == (data, label)
+        assert reader.read(-1) == (samples[-1][2], samples[-1][1])
+        with pytest.raises(IndexError):
+            reader.read(len(samples))
+
+
+def test_failed_write_keeps_existing_shards(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    with ShardWriter(shards_dir) as writer:
+        writer.add("a", "cat", b"old")
+    with pytest.raises(RuntimeError):
+        with ShardWriter(shards_dir) as writer:
+            writer.add("b", "dog", b"new")
+            raise RuntimeError("interrupted")
+    with ShardReader(shards_dir) as reader:
+        assert reader.ids == ["a"]
+        assert reader.read(0) == (b"old", "cat")
+    assert not os.path.exists(f"{shards_dir}.tmp")
+
+
+def test_swap_leaves_no_old_shards(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    for data in (b"old", b"new"):
+        with ShardWriter(shards_dir) as writer:
+            writer.add("a", "cat", data)
+    with ShardReader(shards_dir) as reader:
+        assert reader.read(0) == (b"new", "cat")
+    assert sorted(os.listdir(tmp_path)) == ["shards"]
+
+
+def test_rewrite_removes_old_shards(tmp_path):
+    shards_dir = str(tmp_path / "shards")
+    with ShardWriter(shards_dir, shard_size=4) as writer:
+        for i in range(5):
+            writer.add(str(i), "cat", b"data")
+    with ShardWriter(shards_dir, shard_size=4) as writer:
+        writer.add("x", "dog", b"data")
+    assert sorted(os.listdir(shards_dir)) == [
+        "labels.json",
+        "shard_00000.bin",
+        "shard_00000.index.csv",
+    ]
+
+
+def test_split_shards_and_freshness(tmp_path, make_split):
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "training", [("cat", "a.png", 0), ("dog", "b.png", 255)])
+    assert write_split_shards(dataset_path, "training") == 2
+    assert is_shards_fresh(dataset_path, "training")
+    with ShardReader(get_shards_dir(dataset_path, "training")) as reader:
+        image, label = reader.read_image(1)
+        assert label == "dog"
+        assert np.asarray(image)[0, 0] == 255
+
+    make_split(dataset_path, "training", [("cat", "c.png", 7)])
+    assert not is_shards_fresh(dataset_path, "training")
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from split_table import SplitTable, convert_to_split_table, write_split_table
+
+ROWS = [
+    ("b.jpg", "dog", "training"),
+    ("a.jpg", "cat", "testing"),
+    ("c.jpg", "cat", "training"),
+    ("d.jpg", "dog", "testing"),
+    ("e.jpg", "cat", "testing"),
+]
+
+
+@pytest.fixture
+def table(tmp_path):
+    ids, labels, splits = zip(*ROWS)
+    assert write_split_table(str(tmp_path / "table"), ids, labels, splits) == len(ROWS)
+    return SplitTable(str(tmp_path / "table"))
+
+
+def test_query_split(table):
+    assert table.ids(split="testing") == ["a.jpg", "e.jpg", "d.jpg"]
+    assert table.labels(split="testing") == ["cat", "cat", "dog"]
+
+
+def test_query_label(table):
+    assert table.ids(split="training", label="dog") == ["b.jpg"]
+    assert table.ids(split="training", label="bird") == []
+    assert table.ids(split="validation") == []
+    with pytest.raises(ValueError):
+        table.ids(label="cat")
+
+
+def test_rows_and_counts(table):
+    assert len(table) == len(ROWS)
+    assert sorted(table.iter_rows()) == sorted(
+        (id, label, split) for id, label, split in ROWS
+    )
+    assert table.counts() == {
+        "training": {"cat": 1, "dog": 1},
+        "testing": {"cat": 2, "dog": 1},
+    }
+
+
+def test_rewrite_replaces_table(tmp_path, table):
+    write_split_table(str(tmp_path / "table"), ["x.jpg"], ["cat"], ["testing"])
+    assert SplitTable(str(tmp_path / "table")).ids(split="testing") == ["x.jpg"]
+    assert not (tmp_path / "table.tmp").exists()
+
+
+def test_convert_split_json(tmp_path):
+    json_file = tmp_path / "train_test_split.json"
+    json_file.write_text(json.dumps({"train": ["a.jpg"], "test": ["b.jpg"]}))
+    convert_to_split_table(str(json_file), str(tmp_path / "table"))
+    table = SplitTable(str(tmp_path / "table"))
+    assert table.ids(split="training") == ["a.jpg"]
+    assert table.ids(split="testing") == ["b.jpg"]
@@ -0,0 +1,61 @@
+import numpy as np
+
+from splitter import (
+    grouped_stratified_split,
+    read_split_json,
+    vision_group_key,
+    write_split_json,
+)
+
+
+def test_vision_group_key():
+    assert vision_group_key("D01_I_natFBH_0001.jpg") == "D01_I_nat_0001.jpg"
+    assert vision_group_key("D01_I_flat_0001.jpg") == "D01_I_flat_0001.jpg"
+
+
+def test_empty():
+    assert len(grouped_stratified_split([])) == 0
+
+
+def test_ratios_per_label():
+    labels = np.repeat(["a", "b"], [1000, 500])
+    ids = [f"{i}.jpg" for i in range(len(labels))]
+    split_idx = grouped_stratified_split(labels, ratios=(0.7, 0.1, 0.2), ids=ids)
+    for label, size in (("a", 1000), ("b", 500)):
+        counts = np.bincount(split_idx[labels == label], minlength=3)
+        assert np.allclose(counts / size, (0.7, 0.1, 0.2), atol=0.01)
+
+
+def test_groups_stay_together():
+    groups = [f"g{i // 4}" for i in range(400)]
+    labels = [f"l{i // 40}" for i in range(400)]
+    split_idx = grouped_stratified_split(labels, groups, ratios=(0.5, 0.5))
+    for group in set(groups):
+        assert len({s for g, s in zip(groups, split_idx) if g == group}) == 1
+
+
+def test_independent_of_record_order():
+    ids = [f"{i}.jpg" for i in range(300)]
+    labels = [i % 3 for i in range(300)]
+    split_idx = grouped_stratified_split(labels, ids=ids)
+    order = np.random.default_rng(0).permutation(len(ids))
+    shuffled = grouped_stratified_split(
+        [labels[i] for i in order], ids=[ids[i] for i in order]
+    )
+    assert dict(zip(ids, split_idx)) == dict(zip([ids[i] for i in order], shuffled))
+
+
+def test_seed_changes_split():
+    ids = [f"{i}.jpg" for i in range(300)]
+    labels = [0] * 300
+    first = grouped_stratified_split(labels, ids=ids, seed=1)
+    second = grouped_stratified_split(labels, ids=ids, seed=2)
+    assert not np.array_equal(first, second)
+
+
+def test_read_split_json(tmp_path):
+    json_file = str(tmp_path / "split.json")
+    file_paths = ["x/a.jpg", "x/b.jpg", "y/c.jpg"]
+    write_split_json(json_file, file_paths, [1, 0, 1], ["train", "test"])
+    assert read_split_json(json_file, file_paths, ["train", "test"]).tolist() == [1, 0, 1]
+    assert read_split_json(json_file, file_paths + ["d.jpg"], ["train", "test"]) is None
@@ -0,0 +1,87 @@
+import io
+import os
+import sys
+import json
+import tarfile
+
+import pytest
+from PIL import Image
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "datasets",
+        "raw",
+        "cub_200_2011",
+    ),
+)
+
+from materialize import SPLIT_MANIFEST_FILE_NAME, read_split_manifest  # noqa: E402
+from stream_extract import stream_dataset  # noqa: E402
+
+IMAGES = [("001.Albatross", "a.jpg"), ("001.Albatross", "b.jpg"), ("002.Auklet", "c.jpg")]
+
+
+def jpeg_bytes(value):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), (value, value, value)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Writes a small CUB-like .tgz and its split file, returns both paths."""
+    archive_path = str(tmp_path / "CUB_200_2011.tgz")
+    with tarfile.open(archive_path, "w:gz") as tar:
+        for i, (label, name) in enumerate(IMAGES):
+            data = jpeg_bytes(40 * i)
+            info = tarfile.TarInfo(f"CUB_200_2011/images/{label}/{name}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        # not an image, not extracted
+        info = tarfile.TarInfo("CUB_200_2011/README")
+        tar.addfile(info, io.BytesIO(b""))
+    split_file = str(tmp_path / "train_test_split.json")
+    with open(split_file, "w") as file:
+        json.dump({"train": ["a.jpg", "c.jpg"], "test": ["b.jpg"]}, file)
+    return archive_path, split_file
+
+
+def test_stream_into_splits(tmp_path, archive):
+    archive_path, split_file = archive
+    output_dir = str(tmp_path / "cub_200_2011")
+    stale = os.path.join(output_dir, "training", "001.Albatross", "old.jpg")
+    os.makedirs(os.path.dirname(stale))
+    open(stale, "wb").close()
+
+    counts = stream_dataset(archive_path, output_dir, split_file)
+
+    assert counts == {"written": 3, "skipped": 0}
+    assert not os.path.exists(stale)
+    assert os.path.isfile(os.path.join(output_dir, "training", "002.Auklet", "c.jpg"))
+    assert os.path.isfile(os.path.join(output_dir, "testing", "001.Albatross", "b.jpg"))
+    rows = read_split_manifest(os.path.join(output_dir, SPLIT_MANIFEST_FILE_NAME))
+    assert sorted(r["id"] for r in rows) == ["a.jpg", "b.jpg", "c.jpg"]
+    for row in rows:
+        assert os.path.isabs(row["source_path"])
+        assert os.path.isfile(row["source_path"])
+    assert not os.path.exists(f"{output_dir}.tmp")
+
+
+def test_truncated_archive_keeps_existing_splits(tmp_path, archive):
+    archive_path, split_file = archive
+    output_dir = str(tmp_path / "cub_200_2011")
+    stream_dataset(archive_path, output_dir, split_file)
+
+    truncated_path = str(tmp_path / "truncated.tgz")
+    with open(archive_path, "rb") as source, open(truncated_path, "wb") as file:
+        data = source.read()
+        file.write(data[: len(data) // 2])
+
+    with pytest.raises((tarfile.TarError, EOFError, OSError)):
+        stream_dataset(truncated_path, output_dir, split_file)
+
+    assert os.path.isfile(os.path.join(output_dir, "training", "001.Albatross", "a.jpg"))
+    assert os.path.isfile(os.path.join(output_dir, "testing", "001.Albatross", "b.jpg"))
+    assert not os.path.exists(f"{output_dir}.tmp")
@@ -0,0 +1,49 @@
+import numpy as np
+
+from tensor_cache import (
+    TensorCacheSplit,
+    build_dataset_cache,
+    is_tensor_cache_fresh,
+    load_tensor_cache,
+    write_split_cache,
+)
+
+
+def test_round_trip_from_arrays(tmp_path):
+    images = np.arange(4 * 5 * 5, dtype=np.uint8).reshape(4, 5, 5)
+    labels = np.array([0, 1, 1, 0])
+    write_split_cache(str(tmp_path), "training", images, labels, class_names=["a", "b"])
+    cache = TensorCacheSplit(str(tmp_path), "training")
+    assert len(cache) == 4
+    assert cache.images.shape == (4, 5, 5, 1)
+    assert np.array_equal(cache.images[..., 0], images)
+    assert cache.labels.tolist() == labels.tolist()
+    assert cache.ids == ["0.jpg", "1.jpg", "2.jpg", "3.jpg"]
+    assert cache.class_names == ["a", "b"]
+    image, label = cache[2]
+    assert np.array_equal(image[..., 0], images[2]) and label == 1
+
+
+def test_round_trip_from_files(tmp_path, make_split):
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "training", [("cat", "a.png", 10), ("dog", "b.png", 20)])
+    # "bird" only appears in the testing split, the class table covers both splits
+    make_split(dataset_path, "testing", [("bird", "c.png", 30), ("dog", "d.png", 40)])
+    build_dataset_cache(dataset_path)
+
+    training = load_tensor_cache(dataset_path, "training")
+    testing = load_tensor_cache(dataset_path, "testing")
+    assert training.class_names == ["bird", "cat", "dog"]
+    assert training.ids == ["a.png", "b.png"]
+    assert training.labels.tolist() == [1, 2]
+    assert testing.labels.tolist() == [0, 2]
+    assert training.images[:, 0, 0, 0].tolist() == [10, 20]
+    assert is_tensor_cache_fresh(dataset_path, "training")
+
+
+def test_changed_split_is_stale(tmp_path, make_split):
+    dataset_path = str(tmp_path / "toy")
+    make_split(dataset_path, "training", [("cat", "a.png", 10)])
+    build_dataset_cache(dataset_path)
+    make_split(dataset_path, "training", [("cat", "b.png", 20)])
+    assert not is_tensor_cache_fresh(dataset_path, "training")
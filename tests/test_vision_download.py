@@ -0,0 +1,132 @@
+import io
+import os
+import sys
+import threading
+import http.server
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "datasets", "raw", "vision")
+)
+
+from f1_get_vision_dataset_files import download_files  # noqa: E402
+
+
+def jpeg_bytes(value):
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((8, 8, 3), value, dtype=np.uint8)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class FileServer(http.server.ThreadingHTTPServer):
+    """Serves `files` ({url path: bytes}); the first `failures[path]` GETs answer 503."""
+
+    def __init__(self, files):
+        super().__init__(("127.0.0.1", 0), FileHandler)
+        self.files = files
+        self.failures = {}
+        self.gets = {}
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, with_body):
+        data = self.server.files.get(self.path.lstrip("/"))
+        if data is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(data)
+
+    def do_HEAD(self):
+        self._send(with_body=False)
+
+    def do_GET(self):
+        path = self.path.lstrip("/")
+        with self.server.lock:
+            self.server.gets[path] = self.server.gets.get(path, 0) + 1
+            failing = self.server.failures.get(path, 0) > 0
+            if failing:
+                self.server.failures[path] -= 1
+        if failing:
+            self.send_error(503)
+            return
+        self._send(with_body=True)
+
+
+@pytest.fixture
+def server():
+    files = {f"D01/images/flat/{i}.jpg": jpeg_bytes(i * 40) for i in range(4)}
+    server = FileServer(files)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def run(server, tmp_path, paths, **kwargs):
+    tasks = [(server.base_url + path, path) for path in paths]
+    return download_files(
+        tasks,
+        str(tmp_path / "data"),
+        manifest_file=str(tmp_path / "manifest.csv"),
+        workers=2,
+        backoff=0,
+        **kwargs,
+    )
+
+
+def read(tmp_path, path):
+    with open(os.path.join(tmp_path, "data", *path.split("/")), "rb") as file:
+        return file.read()
+
+
+def test_resume_downloads_only_missing_files(server, tmp_path):
+    paths = sorted(server.files)
+    assert run(server, tmp_path, paths[:2]) == (2, 0, [])
+    assert run(server, tmp_path, paths) == (2, 2, [])
+    assert all(server.gets[path] == 1 for path in paths)
+    assert all(read(tmp_path, path) == server.files[path] for path in paths)
+
+
+def test_retry_after_server_errors(server, tmp_path):
+    path = sorted(server.files)[0]
+    server.failures[path] = 2
+    assert run(server, tmp_path, [path], retries=3) == (1, 0, [])
+    assert server.gets[path] == 3
+    assert read(tmp_path, path) == server.files[path]
+
+
+def test_failed_download_leaves_no_file(server, tmp_path):
+    path = sorted(server.files)[0]
+    server.failures[path] = 5
+    downloaded, skipped, failed = run(server, tmp_path, [path], retries=2)
+    assert (downloaded, skipped, failed) == (0, 0, [server.base_url + path])
+    assert os.listdir(tmp_path / "data" / "D01" / "images" / "flat") == []
+
+
+def test_existing_files_without_manifest_are_skipped(server, tmp_path):
+    complete, truncated = sorted(server.files)[:2]
+    for path, data in ((complete, server.files[complete]), (truncated, b"\xff\xd8")):
+        file_path = tmp_path / "data" / path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(data)
+    assert run(server, tmp_path, [complete, truncated]) == (1, 1, [])
+    assert complete not in server.gets
+    assert read(tmp_path, truncated) == server.files[truncated]
+    # the adopted file is now in the manifest: no further request for it
+    assert run(server, tmp_path, [complete]) == (0, 1, [])
@@ -0,0 +1,323 @@
+"""
+Integrity verification of the image files of a dataset tree.
+
+Every image is checked in a process pool and classified as:
+
+    ok         - the file passed the check
+    empty      - zero bytes
+    truncated  - a JPEG without its end-of-image marker (an interrupted write/download)
+    corrupt    - not a JPEG (no start-of-image marker) or the decoder rejected it
+
+Two check modes are available. "markers" only reads the first and last bytes of each
+file, "decode" fully decodes every image. Non-JPEG images (PNG, WebP and raw .npy, see
+image_formats.py) are always decoded.
+Results are kept in the shared file cache (file_cache.py). Every file is re-statted
+before its cached result is trusted, and the result is dropped as soon as the file's size
+or mtime differ, so re-verifying an unchanged tree costs one stat per file and reads no
+images. In a processed dataset only the split directories are verified, not the derived
+data next to them (tensor cache, shards, split table, resized images).
+
+Bad files can be repaired:
+
+    - downloaded Vision files are deleted and downloaded again,
+    - materialized files (Vision, CUB-200-2011) are re-created from the source path in
+      the dataset's split manifest,
+    - exported files (the notebook datasets) are named after their index in the source
+      arrays, see `get_export_indices` to re-export just those with `save_image_chunks`.
+
+    python verify_images.py mnist cifar10 --mode decode
+    python verify_images.py vision --repair
+    python verify_images.py --vision-raw --repair
+"""
+
+import os
+import sys
+import csv
+import argparse
+import concurrent.futures
+
+import paths
+from dataset_files import (
+    IMAGE_EXTENSIONS,
+    get_dataset_path,
+    list_dataset_names,
+    list_split_names,
+)
+from file_cache import get_file_cache
+from image_formats import read_image
+from instrumentation import track_stage
+from materialize import SPLIT_MANIFEST_FILE_NAME, materialize_file, read_split_manifest
+
+VERIFY_MODES = ["markers", "decode"]
+
+VERIFY_REPORT_FILE_NAME = "verify_report.csv"
+
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+
+# some encoders pad the file after the end-of-image marker
+JPEG_TAIL_SIZE = 64
+
+VISION_DIR = os.path.join(paths.RAW_DIR, "vision")
+
+
+def _is_jpeg_name(file_path: str) -> bool:
+    return file_path.lower().endswith((".jpg", ".jpeg"))
+
+
+def check_markers(file_path: str) -> str:
+    """Checks the JPEG start- and end-of-image markers of a file."""
+    with open(file_path, "rb") as file:
+        head = file.read(2)
+        if not head:
+            return "empty"
+        if head != JPEG_SOI:
+            return "corrupt"
+        file.seek(0, os.SEEK_END)
+        file.seek(max(0, file.tell() - JPEG_TAIL_SIZE))
+        tail = file.read().rstrip(b"\x00\r\n ")
+    return "ok" if tail.endswith(JPEG_EOI) else "truncated"
+
+
+def check_decode(file_path: str) -> str:
+    """Fully decodes an image; JPEGs are also checked for truncation first."""
+    if _is_jpeg_name(file_path):
+        status = check_markers(file_path)
+        if status != "ok":
+            return status
+    elif os.path.getsize(file_path) == 0:
+        return "empty"
+    try:
+        read_image(file_path)
+    except Exception:
+        return "corrupt"
+    return "ok"
+
+
+def check_image(file_path: str, mode: str = "markers") -> str:
+    """
+    Checks the integrity of one image file.
+
+    Args:
+        file_path (str): Path of the image.
+        mode (str): "markers" or "decode" (see module docstring).
+
+    Returns:
+        str: ok, empty, truncated or corrupt.
+    """
+    if mode == "decode" or not _is_jpeg_name(file_path):
+        return check_decode(file_path)
+    return check_markers(file_path)
+
+
+def _check_chunk(file_paths, mode: str):
+    """Checks a chunk of files. Runs in a worker process."""
+    return [check_image(file_path, mode) for file_path in file_paths]
+
+
+def _is_cached_result_valid(cached: str, mode: str) -> bool:
+    # a result is stored as "<mode>:<status>"; a full decode also covers a marker check
+    cached_mode = cached.split(":", 1)[0]
+    return cached_mode == mode or cached_mode == "decode"
+
+
+def verify_tree(root: str, mode: str = "markers", workers=None, chunk_size: int = 256):
+    """
+    Checks every image under a directory, reusing cached results of unchanged files.
+
+    Args:
+        root (str): Directory to verify (a processed dataset or a raw download tree). Of
+                    a processed dataset, only the split directories are verified.
+        mode (str): "markers" or "decode".
+        workers (Optional[int]): Number of worker processes. Defaults to the CPU count.
+        chunk_size (int): Number of files handed to a worker at a time.
+
+    Returns:
+        dict: {path: status} of every image that is not ok.
+    """
+    if mode not in VERIFY_MODES:
+        raise ValueError(f"Unknown verify mode '{mode}', expected one of {VERIFY_MODES}")
+    cache = get_file_cache()
+    split_names = list_split_names(root)
+    roots = [os.path.join(root, split_name) for split_name in split_names] or [root]
+    files = []
+    for directory in roots:
+        # re-stat every file: a file rewritten in place keeps its directory's mtime
+        files.extend(
+            cache.list_files(directory, suffixes=IMAGE_EXTENSIONS, stat_files=True)
+        )
+    statuses = {}
+    pending = []
+    cached = cache.get_verify_results(path for path, _, _ in files)
+    for path, size, _ in files:
+        if size == 0:
+            statuses[path] = "empty"
+        elif path in cached and _is_cached_result_valid(cached[path], mode):
+            statuses[path] = cached[path].split(":", 1)[1]
+        else:
+            pending.append(path)
+
+    name = os.path.basename(os.path.normpath(root))
+    with track_stage(f"{name}.verify", total=len(pending), progress=True) as stage:
+        stage.skip(len(files) - len(pending))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        new_rows = []
+        if chunks:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {
+                    executor.submit(_check_chunk, chunk, mode): chunk for chunk in chunks
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    chunk = futures[future]
+                    for path, status in zip(chunk, future.result()):
+                        statuses[path] = status
+                        new_rows.append((path, f"{mode}:{status}"))
+                        if status != "ok":
+                            stage.error()
+                    stage.add(len(chunk))
+        cache.set_verify_results(new_rows)
+
+    return {path: status for path, status in sorted(statuses.items()) if status != "ok"}
+
+
+def write_verify_report(report_file: str, bad_files: dict) -> None:
+    """Writes the path and status of every bad file to a CSV file."""
+    with open(report_file, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["path", "status"])
+        writer.writerows(bad_files.items())
+
+
+def get_export_indices(bad_files: dict) -> dict:
+    """
+    Returns {split: [index, ...]} of bad exported images (`<split>/<label>/<idx>.<ext>`).
+
+    The indices select the images to export again from the source arrays:
+
+        idx = get_export_indices(bad_files)["training"]
+        chunks = select_chunks(iter_mnist_chunks("train"), idx)
+        save_image_chunks(chunks, output_dir, "training")
+    """
+    indices = {}
+    for path in bad_files:
+        split_name = os.path.basename(os.path.dirname(os.path.dirname(path)))
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if stem.isdigit():
+            indices.setdefault(split_name, []).append(int(stem))
+    return {split_name: sorted(idx) for split_name, idx in indices.items()}
+
+
+def rematerialize_files(dataset_path: str, bad_files: dict, mode: str = "copy") -> int:
+    """
+    Re-creates bad files of a processed dataset from the sources in its split manifest.
+
+    Sources that are missing or fail the same check are left alone.
+
+    Returns:
+        int: The number of repaired files.
+    """
+    manifest_file = os.path.join(dataset_path, SPLIT_MANIFEST_FILE_NAME)
+    if not os.path.exists(manifest_file):
+        print(f"No split manifest in {dataset_path}; re-export the dataset instead.")
+        return 0
+    sources = {
+        (row["split"], row["label"], row["id"]): row["source_path"]
+        for row in read_split_manifest(manifest_file)
+    }
+    repaired = 0
+    for path in bad_files:
+        label_dir = os.path.dirname(path)
+        key = (
+            os.path.basename(os.path.dirname(label_dir)),
+            os.path.basename(label_dir),
+            os.path.basename(path),
+        )
+        source_path = sources.get(key)
+        if (
+            source_path is None
+            or not os.path.exists(source_path)
+            or os.path.samefile(source_path, path)
+            or check_image(source_path, "decode") != "ok"
+        ):
+            print(f"No intact source for {path}")
+            continue
+        materialize_file(source_path, path, mode)
+        repaired += 1
+    return repaired
+
+
+def redownload_vision_files(bad_files: dict):
+    """
+    Deletes bad files of the raw Vision download tree and downloads them again.
+
+    Returns:
+        Tuple[int, int, List[str]]: See `download_files` in f1_get_vision_dataset_files.py.
+    """
+    if VISION_DIR not in sys.path:
+        sys.path.insert(0, VISION_DIR)
+    from constants import BASE_URL, RAW_DATA_DIR
+    from f1_get_vision_dataset_files import build_download_tasks, download_files
+    from folder_map import FolderMapRecord
+
+    records = []
+    for path in bad_files:
+        relative_path = os.path.relpath(path, RAW_DATA_DIR).replace(os.sep, "/")
+        device, sub_folder = relative_path.split("/")[0], relative_path.split("/")[-2]
+        records.append(FolderMapRecord(device, sub_folder, relative_path))
+        os.remove(path)
+    return download_files(build_download_tasks(records, BASE_URL), RAW_DATA_DIR)
+
+
+def verify_dataset(
+    dataset_path: str, mode: str = "markers", repair: bool = False, workers=None
+):
+    """
+    Verifies a processed dataset, writes `<dataset>/verify_report.csv` and optionally
+    repairs the bad files from their split manifest sources.
+
+    Returns:
+        dict: {path: status} of the bad files found before any repair.
+    """
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    bad_files = verify_tree(dataset_path, mode=mode, workers=workers)
+    write_verify_report(os.path.join(dataset_path, VERIFY_REPORT_FILE_NAME), bad_files)
+    print(f"{dataset_name}: {len(bad_files)} bad images")
+    if bad_files and repair:
+        repaired = rematerialize_files(dataset_path, bad_files)
+        print(f"{dataset_name}: repaired {repaired} of {len(bad_files)} images")
+        if repaired < len(bad_files):
+            export_indices = get_export_indices(bad_files)
+            if export_indices:
+                print(f"{dataset_name}: indices to re-export: {export_indices}")
+    return bad_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify (and repair) dataset images.")
+    parser.add_argument("datasets", nargs="*", help="Processed dataset names.")
+    parser.add_argument("--mode", choices=VERIFY_MODES, default="markers")
+    parser.add_argument("--repair", action="store_true", help="Repair the bad files.")
+    parser.add_argument(
+        "--vision-raw",
+        action="store_true",
+        help="Verify the downloaded Vision files; --repair downloads bad files again.",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.vision_raw:
+        raw_data_dir = os.path.join(VISION_DIR, "data")
+        bad_files = verify_tree(raw_data_dir, mode=args.mode, workers=args.workers)
+        write_verify_report(os.path.join(VISION_DIR, VERIFY_REPORT_FILE_NAME), bad_files)
+        print(f"Vision downloads: {len(bad_files)} bad images")
+        if bad_files and args.repair:
+            redownload_vision_files(bad_files)
+
+    dataset_names = args.datasets or ([] if args.vision_raw else list_dataset_names())
+    for dataset_name in dataset_names:
+        verify_dataset(
+            get_dataset_path(dataset_name),
+            mode=args.mode,
+            repair=args.repair,
+            workers=args.workers,
+        )